@@ -1,24 +1,32 @@
 # -*- coding: utf-8 -*-
+import atexit
 import os
 import pathlib
 import secrets
 
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, abort, \
+    session
 from werkzeug.utils import secure_filename
 
-from .linepole import settings as kml_settings
 from .linepole.KMLHandler import KMLHandler
-from .eep import eepower_utils as eeu, eep_traitement as eep
+from .eep import eepower_utils as eeu
+from .eep.report_cache import ReportCache
 
 from .utils.File import validate_file_epow as validate, get_uploads_files, purge_file, full_paths, \
-    create_dir_if_dont_exist as create_dir, zip_files, add_to_list_file, get_items_from_file, \
+    create_dir_if_dont_exist as create_dir, get_items_from_file, \
     FileError
+from .utils.Jobs import JobQueue, WorkerPool, DB_PATH as JOB_DB_PATH, QUEUED, RUNNING, DONE, new_job_id
+from .utils.Workspace import WorkspaceStore, save_file
+
+# applications dont les fichiers et l'état sont propres à chaque session
+SESSION_APPS = ('eepower', 'linepole_generator')
 
 
 def create_app():
     app = Flask(__name__)
 
-    app.secret_key = secrets.token_bytes()
+    # la clé doit être la même pour tous les processus du serveur pour qu'ils partagent les sessions
+    app.secret_key = os.environ.get('SECRET_KEY', '').encode() or secrets.token_bytes()
 
     app.config['ROOT_DIR'] = pathlib.Path(__file__).parent.parent
 
@@ -28,10 +36,36 @@ def create_app():
     app.config['UPLOAD_PATH'] = create_dir(app.config['ROOT_DIR']/'uploads')
 
     app.config['UPLOAD_PATH_EPOW'] = create_dir(app.config['UPLOAD_PATH']/'eepower')
-
-    app.config['UPLOAD_PATH_LP'] = create_dir(app.config['UPLOAD_PATH']/'linepole_generator')
+    # les rapports EasyPower sont lus en entier dès leur validation, seul leur en-tête est lu sinon
+    app.config['EEPOWER_PARSE_ON_UPLOAD'] = os.environ.get('EEPOWER_PARSE_ON_UPLOAD', '0') == '1'
+    # nombre de processus lisant en parallèle les rapports des scénarios
+    app.config['EEPOWER_WORKERS'] = int(os.environ.get('EEPOWER_WORKERS', 1))
+
+    # nombre de processus utilisés pour calculer les tracés en parallèle
+    app.config['LINEPOLE_WORKERS'] = int(os.environ.get('LINEPOLE_WORKERS', 1))
+    # le kml généré est compressé en kmz
+    app.config['LINEPOLE_KMZ'] = os.environ.get('LINEPOLE_KMZ', '0') == '1'
+    # les csv sont écrits directement depuis les tableaux des lignes, sans passer par les DataFrame
+    app.config['LINEPOLE_CSV_FROM_ARRAYS'] = os.environ.get('LINEPOLE_CSV_FROM_ARRAYS', '1') == '1'
+    # les altitudes des poteaux sont interpolées dans le profil d'élévation gardé pour chaque tracé
+    app.config['LINEPOLE_INCREMENTAL'] = os.environ.get('LINEPOLE_INCREMENTAL', '1') == '1'
     app.config['GENERATED_PATH'] = create_dir(app.config['ROOT_DIR']/'generated')
-    app.config['CURRENT_OUTPUT_FILE'] = ''
+
+    # chaque session a ses fichiers et son état sur le disque, ils sont supprimés après WORKSPACE_TTL secondes
+    # sans utilisation
+    app.config['WORKSPACE_PATH'] = create_dir(os.environ.get('WORKSPACE_PATH',
+                                                             app.config['ROOT_DIR']/'workspaces'))
+    app.config['WORKSPACE_TTL'] = int(os.environ.get('WORKSPACE_TTL', 24 * 3600))
+    workspaces = WorkspaceStore(app.config['WORKSPACE_PATH'], ttl=app.config['WORKSPACE_TTL'])
+
+    # les traitements longs sont faits par des processus de travail, hors des requêtes
+    # JOB_WORKERS=0 pour lancer les processus à part : python -m app.utils.Jobs
+    app.config['JOB_DB'] = JOB_DB_PATH
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 1))
+    jobs = JobQueue(app.config['JOB_DB'])
+    if app.config['JOB_WORKERS'] > 0:
+        worker_pool = WorkerPool(app.config['JOB_DB'], app.config['JOB_WORKERS']).start()
+        atexit.register(worker_pool.stop)
 
     app.config['MAX_XP'] = 3
     app.config['MAX_SLAN'] = 2
@@ -41,13 +75,43 @@ def create_app():
     app.config['DEV_TEMPLATE_DOC'] = app.config['UPLOAD_PATH_DEV'] / 'templates'
     app.config['GENERATED_DEV_DOC_PATH'] = app.config['GENERATED_PATH'] / 'developpement'
 
+    # bus exclus par défaut, chaque session ajoute les siens
     BUSES_FILE = os.path.join(app.config['UPLOAD_PATH_EPOW'], r'bus_exclus')
-    EEP_DATA = {"BUS_EXCLUS": get_items_from_file(BUSES_FILE),
-                "FILE_PATHS": [],
-                "FILES": [],
-                "SCENARIOS": [],
-                "NB_SCEN": 0,
-                "REPORT_TYPE": []}
+
+    def workspace():
+        # l'espace de travail de la session est créé à sa première requête
+        if not workspaces.is_valid_id(session.get('workspace')):
+            session['workspace'] = workspaces.new_id()
+        return workspaces.get(session['workspace'])
+
+    def eep_data(ws):
+        upload_path = ws.upload_path('eepower')
+        files = get_uploads_files(upload_path)
+        scenarios = eeu.scenario_finder(files)
+        return {"BUS_EXCLUS": ws.get_state("BUS_EXCLUS", get_items_from_file(BUSES_FILE)),
+                "FILE_PATHS": full_paths(upload_path),
+                "FILES": files,
+                "SCENARIOS": scenarios,
+                "NB_SCEN": len(scenarios),
+                "REPORT_TYPE": ws.get_state("REPORT_TYPE", [])}
+
+    def session_job(ws, job_id):
+        # un travail n'est visible que depuis la session qui l'a lancé
+        job = jobs.get(job_id)
+        if job is None or job['params'].get('workspace') != ws.id:
+            abort(404)
+        return job
+
+    def pending_job(ws, app_name):
+        # un seul travail à la fois par session, ils partagent le KMLHandler et les fichiers téléversés
+        job = jobs.get(ws.get_state('JOB_' + app_name, ''))
+        return job if job is not None and job['status'] in (QUEUED, RUNNING) else None
+
+    @app.before_request
+    def evict_workspaces():
+        # les travaux terminés pointent vers des fichiers des espaces de travail supprimés
+        if workspaces.evict():
+            jobs.purge(app.config['WORKSPACE_TTL'])
 
     with app.app_context():
         from app.dev_app.DbDevApi import db_dev_api
@@ -62,11 +126,15 @@ def create_app():
 
     @app.route('/eepower', methods=['GET', 'POST'])
     def eepower():
-        uploaded_files = get_uploads_files(app.config['UPLOAD_PATH_EPOW'])
+        ws = workspace()
+        upload_path = ws.upload_path('eepower')
+        uploaded_files = get_uploads_files(upload_path)
         if request.method == 'POST':
             # ajout de fichier pour analyse
             if request.form['btn_id'] == 'soumettre_fichier':
                 error_messages = []
+                # les rapports lus à la validation sont gardés pour la génération des rapports
+                cache = ReportCache(ws.cache_path('eepower')) if app.config['EEPOWER_PARSE_ON_UPLOAD'] else None
                 submittted_files = request.files.getlist('file')
                 for uploaded_file in submittted_files:
                     file = pathlib.Path(secure_filename(uploaded_file.filename))
@@ -74,12 +142,12 @@ def create_app():
                         # valide si l'extension des fichiers est bonne
                         if file.suffix not in app.config['UPLOAD_EXTENSIONS']:
                             flash("Les fichiers reçus ne sont des fichiers .csv ou .xlsx", 'error')
-                        path_to_file = pathlib.Path(app.config['UPLOAD_PATH_EPOW']) / file
+                        path_to_file = upload_path / file
                         uploaded_file.save(path_to_file)
                         # valide en ouvrant les fichiers si le contenu est bon
                         try:
 
-                            EEP_DATA["REPORT_TYPE"].append(validate(path_to_file))
+                            ws.set_state("REPORT_TYPE", ws.get_state("REPORT_TYPE", []) + [validate(path_to_file, cache=cache)])
                         except FileError as e:
                             os.remove(path_to_file)
                             error_messages.append("{0}".format(e))
@@ -99,68 +167,65 @@ def create_app():
     @app.route('/eepower-2', methods=['GET', 'POST'])
     def eepower_traitement():
         app_name = 'eepower'
+        ws = workspace()
         try:
-            EEP_DATA["FILES"] = get_uploads_files(app.config['UPLOAD_PATH_EPOW'])
-            EEP_DATA["FILE_PATHS"] = full_paths(app.config['UPLOAD_PATH_EPOW'])
-            EEP_DATA["SCENARIOS"] = eeu.scenario_finder(EEP_DATA["FILES"])
-            EEP_DATA["NB_SCEN"] = len(EEP_DATA["SCENARIOS"])
+            EEP_DATA = eep_data(ws)
         except(AttributeError):
             flash("Problème avec les regex", 'error')
-            EEP_DATA["FILES"] = []
-            return redirect(url_for('eepower_traitement'))
+            return redirect(url_for('eepower'))
         file_ready = 0
 
 
         if request.method == 'POST':
             if request.form['btn_id'] == 'ajouter_bus':
                 if request.form['bus'] != '':
-                    add_to_list_file(BUSES_FILE, str.upper(request.form['bus']))
-                    EEP_DATA["BUS_EXCLUS"] = get_items_from_file(BUSES_FILE)
+                    EEP_DATA["BUS_EXCLUS"] = EEP_DATA["BUS_EXCLUS"] + [str.upper(request.form['bus'])]
+                    ws.set_state("BUS_EXCLUS", EEP_DATA["BUS_EXCLUS"])
                     render_template('easy_power_traitement.html', nb_scen=EEP_DATA["NB_SCEN"],
                                     bus_exclus=EEP_DATA["BUS_EXCLUS"],
                                     file_ready=1)
 
             elif request.form['btn_id'] == 'suivant':
+                job = pending_job(ws, app_name)
+                if job is not None:
+                    flash("Un traitement est déjà en cours, attendez qu'il soit terminé", 'warning')
+                    return render_template('easy_power_traitement.html', nb_scen=EEP_DATA["NB_SCEN"],
+                                           bus_exclus=EEP_DATA["BUS_EXCLUS"],
+                                           file_ready=1, job_id=job['id'])
+                job_id = new_job_id()
                 try:
-                    dirpath = create_dir(app.config['GENERATED_PATH']/'eepower')
+                    # les fichiers de chaque travail sont dans leur propre répertoire
+                    dirpath = ws.generated_path(app_name) / job_id
                 except FileNotFoundError:
                     flash("Problème lors de la création du répertoire", 'error')
                     return render_template('easy_power_traitement.html', nb_scen=EEP_DATA["NB_SCEN"],
                                            bus_exclus=EEP_DATA["BUS_EXCLUS"],
                                            file_ready=file_ready)
-                try:
-                    file_list = []
-                    if "CC" in EEP_DATA["REPORT_TYPE"]:
-                        file_list += eep.report_cc(EEP_DATA, dirpath)
-                    if "AF" in EEP_DATA["REPORT_TYPE"]:
-                        file_list += eep.report_af(EEP_DATA, dirpath)
-                    if "ED" in EEP_DATA["REPORT_TYPE"]:
-                        file_list += eep.report_ed(EEP_DATA, dirpath)
-                    if "TCC" in EEP_DATA["REPORT_TYPE"]:
-                        file_list += eep.report_tcc(EEP_DATA, dirpath)
-                    if file_list == []:
-                        flash("Pas de fichiers fournis", 'error')
-                        return render_template('easy_power_traitement.html', nb_scen=EEP_DATA["NB_SCEN"],
-                                               bus_exclus=EEP_DATA["BUS_EXCLUS"],
-                                               file_ready=file_ready)
-                    app.config['CURRENT_OUTPUT_FILE'] = pathlib.Path(zip_files(file_list, zip_file_name=app_name + '_result'))
-
-                except FileNotFoundError as e:
-                    flash(e, 'error')
+                if EEP_DATA["FILES"] == []:
+                    flash("Pas de fichiers fournis", 'error')
                     return render_template('easy_power_traitement.html', nb_scen=EEP_DATA["NB_SCEN"],
                                            bus_exclus=EEP_DATA["BUS_EXCLUS"],
                                            file_ready=file_ready)
 
-
+                # les rapports sont générés par un processus de travail
+                jobs.enqueue('eepower', {'app_name': app_name, 'workspace': ws.id,
+                                         'upload_path': str(ws.upload_path(app_name)),
+                                         'cache_path': str(ws.cache_path(app_name)),
+                                         'output_path': str(dirpath),
+                                         'zip_file_name': app_name + '_result',
+                                         'bus_exclus': EEP_DATA["BUS_EXCLUS"],
+                                         'workers': app.config['EEPOWER_WORKERS'],
+                                         'report_type': EEP_DATA["REPORT_TYPE"]}, job_id=job_id)
+                ws.set_state('JOB_' + app_name, job_id)
                 return render_template('easy_power_traitement.html', nb_scen=EEP_DATA["NB_SCEN"],
                                        bus_exclus=EEP_DATA["BUS_EXCLUS"],
-                                       file_ready=1)
+                                       file_ready=1, job_id=job_id)
 
             elif request.form['btn_id'] == 'retour':
                 return redirect(url_for('eepower'))
 
             elif request.form['btn_id'] == 'telecharger':
-                return redirect(url_for('download', app_name=app_name, filename=app.config['CURRENT_OUTPUT_FILE'].name))
+                return redirect(url_for('job_download', job_id=ws.get_state('JOB_' + app_name, '')))
 
             elif request.form['btn_id'] == 'terminer':
                 return redirect(url_for('purge', app_name=app_name))
@@ -172,8 +237,35 @@ def create_app():
     @app.route('/linepole_generator', methods=['GET', 'POST'])
     def linepole_generator():
         app_name = 'linepole_generator'
-        uploaded_files = get_uploads_files(app.config['UPLOAD_PATH_LP'])
-        output_path = create_dir(os.path.join(app.config['GENERATED_PATH'], app_name))
+        ws = workspace()
+        upload_path = ws.upload_path(app_name)
+        uploaded_files = get_uploads_files(upload_path)
+
+        def enqueue_linepole(mode, **params):
+            # les poteaux et les lignes parallèles sont générés par un processus de travail
+            # à partir du KMLHandler enregistré par l'analyse, dans un répertoire propre au travail
+            job_id = new_job_id()
+            params.update({'app_name': app_name, 'workspace': ws.id, 'mode': mode,
+                           'kml': str(upload_path / uploaded_files[0]),
+                           'handler': str(ws.object_path('KMLHandler', '.npz')),
+                           'output_path': str(ws.generated_path(app_name) / job_id),
+                           'zip_file_name': app_name + '_result',
+                           'workers': app.config['LINEPOLE_WORKERS'],
+                           'kmz': app.config['LINEPOLE_KMZ'],
+                           'csv_from_arrays': app.config['LINEPOLE_CSV_FROM_ARRAYS'],
+                           'incremental': app.config['LINEPOLE_INCREMENTAL']})
+            jobs.enqueue('linepole', params, job_id=job_id)
+            ws.set_state('JOB_' + app_name, job_id)
+            return job_id
+
+        if request.method == 'POST' and request.form['btn_id'] in ('analyze', 'pole', 'parallele'):
+            job = pending_job(ws, app_name)
+            if job is not None:
+                # le travail en cours lit le KMLHandler de la session
+                flash("Un traitement est déjà en cours, attendez qu'il soit terminé", 'warning')
+                pole = job['params']['mode'] == 'pole'
+                return render_template('linepole.html', uploaded_files=uploaded_files, file_ready=1, file_submit=1,
+                                       pole=int(pole), parallele=int(not pole), job_id=job['id'])
 
         if request.method == 'POST':
             # ajout de fichier pour analyse
@@ -187,72 +279,35 @@ def create_app():
                     if file_ext != '.kml':
                         flash("Le fichier reçu n'est pas un fichier .kml", 'error')
 
-                    file.save(os.path.join(app.config['UPLOAD_PATH_LP'], filename))
+                    file.save(upload_path / filename)
                     return redirect(url_for('linepole_generator', uploaded_files=uploaded_files, file_ready=0))
 
                 return redirect(url_for('linepole_generator', uploaded_files=uploaded_files, file_ready=0, file_submit=1))
 
             elif request.form['btn_id'] == 'analyze':
-                global handle
-                kml_settings.init()
-                handle = KMLHandler(os.path.join(app.config["UPLOAD_PATH_LP"], uploaded_files[0]))
+                handle = KMLHandler(upload_path / uploaded_files[0], workers=app.config['LINEPOLE_WORKERS'])
+                save_file(ws.object_path('KMLHandler', '.npz'), handle.save)
                 return render_template('linepole.html', uploaded_files=uploaded_files, file_ready=0, file_submit=1,
                                        loader=0, pole=0, parallele=0)
 
             elif request.form['btn_id'] == 'pole':
-                kml_settings.space_by_type['custom'] = request.form.get('dist_pole', type=int)
-                handle.generatePoles()
-                handle.generateOutput()
-
-                # create the kml with poles
-                kml_file_name = os.path.join(output_path, "augmented_kml.kml")
-                kml_file = open(kml_file_name, "w+")
-                kml_file.write(repr(handle))
-                kml_file.close()
-
-                # create a csv in the camelia format
-                camelia = handle.camelia
-                cam_file_name = os.path.join(output_path, "camelia_output.csv")
-                camelia.to_csv(cam_file_name)
-
-                # generate a csv containing all generated data
-                csv_name = os.path.join(output_path, "all_data.csv")
-                handle.outputdf.to_csv(csv_name)
-
-                outputs = [kml_file_name, cam_file_name, csv_name]
-
-                app.config['CURRENT_OUTPUT_FILE'] = pathlib.Path(zip_files(outputs, zip_file_name=app_name + '_result'))
+                # avec le relief, les poteaux sont placés selon le profil d'élévation avec l'espacement comme portée maximale
+                placement = {'max_span': request.form.get('dist_pole', type=int)} if request.form.get('relief') else None
+                job_id = enqueue_linepole('pole', dist_pole=request.form.get('dist_pole', type=int), placement=placement)
                 return render_template('linepole.html', uploaded_files=uploaded_files, file_ready=1, file_submit=1,
-                                       pole=1, parallele=0)
+                                       pole=1, parallele=0, job_id=job_id)
 
             elif request.form['btn_id'] == 'parallele':
-                offset = request.form.get('dist_line', type=int)
-                max_dist = request.form.get('dist_max_line', type=int)
-
-                handle.generateOffset(offset, max_dist)
-                handle.generateOutput()
-
-                # create the kml with poles
-                kml_file_name = os.path.join(output_path, "augmented_kml.kml")
-                kml_file = open(kml_file_name, "w+")
-                kml_file.write(repr(handle))
-                kml_file.close()
-
-                # generate a csv containing all generated data
-                csv_name = os.path.join(output_path, "all_data.csv")
-                handle.outputdf.to_csv(csv_name)
-
-                outputs = [kml_file_name, csv_name]
-
-                app.config['CURRENT_OUTPUT_FILE'] = pathlib.Path(zip_files(outputs, zip_file_name=app_name + '_result'))
+                job_id = enqueue_linepole('parallele', offset=request.form.get('dist_line', type=int),
+                                          max_dist=request.form.get('dist_max_line', type=int))
                 return render_template('linepole.html', uploaded_files=uploaded_files, file_ready=1, file_submit=1,
-                                       pole=0, parallele=1)
+                                       pole=0, parallele=1, job_id=job_id)
 
             elif request.form['btn_id'] == 'purger':
                 return redirect(url_for('purge', app_name=app_name, file_submit=0))
 
             elif request.form['btn_id'] == 'telecharger':
-                return redirect(url_for('download', app_name=app_name, filename=app.config['CURRENT_OUTPUT_FILE'].name))
+                return redirect(url_for('job_download', job_id=ws.get_state('JOB_' + app_name, '')))
 
             elif request.form['btn_id'] == 'terminer':
                 return redirect(url_for('purge', app_name=app_name))
@@ -261,21 +316,45 @@ def create_app():
 
     @app.route('/download/<app_name>/<filename>/', methods=['GET', 'POST'])
     def download(app_name, filename):
-        directory = pathlib.Path(app.config['GENERATED_PATH']/app_name).absolute()
+        if app_name in SESSION_APPS:
+            directory = workspace().generated_path(app_name).absolute()
+        else:
+            directory = pathlib.Path(app.config['GENERATED_PATH']/app_name).absolute()
         # filename = pathlib.Path(file).name
         return send_from_directory(directory=directory, path=filename,
                                    as_attachment=True)
 
 
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        job = session_job(workspace(), job_id)
+        return jsonify({'id': job['id'], 'kind': job['kind'], 'status': job['status'], 'progress': job['progress'],
+                        'message': job['message'], 'error': job['error'],
+                        'download': url_for('job_download', job_id=job_id) if job['status'] == DONE else None})
+
+
+    @app.route('/jobs/<job_id>/download', methods=['GET'])
+    def job_download(job_id):
+        job = session_job(workspace(), job_id)
+        if job['status'] != DONE:
+            abort(404)
+        # le résultat est dans le répertoire du travail, un nouveau travail ne l'écrase pas
+        result = pathlib.Path(job['result'])
+        return send_from_directory(directory=result.parent.absolute(), path=result.name, as_attachment=True)
+
+
     @app.route('/purge/<app_name>', methods=['GET', 'POST'])
     def purge(app_name):
-        purge_file(os.path.join(app.config['UPLOAD_PATH'], app_name))
-        purge_file(os.path.join(app.config['GENERATED_PATH'], app_name))
-        EEP_DATA = {"BUS_EXCLUS": [],
-                    "FILE_PATHS": [],
-                    "FILE": [],
-                    "SCENARIOS": [],
-                    "NB_SCEN": 0}
+        if app_name in SESSION_APPS:
+            ws = workspace()
+            ws.purge(app_name)
+            if app_name == 'eepower':
+                ws.set_state("REPORT_TYPE", [])
+            else:
+                ws.object_path('KMLHandler', '.npz').unlink(missing_ok=True)
+        else:
+            purge_file(os.path.join(app.config['UPLOAD_PATH'], app_name))
+            purge_file(os.path.join(app.config['GENERATED_PATH'], app_name))
         return redirect(url_for(app_name))
 
 
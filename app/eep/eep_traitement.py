@@ -1,9 +1,12 @@
 from pandas import ExcelWriter
 from pathlib import Path
 from re import search
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import json
+import time
 from .eepower_utils import simple_cc_report, simple_af_report, simple_ed_report, group_by_scenario, pire_cas,\
-    parse_excel_sheet, simple_tcc_reports
+    parse_excel_sheet, simple_tcc_reports, cc_reads
+from .report_cache import ReportCache
 
 
 CC_XL_FILE_NAME = 'eep-cc-output.xlsx'
@@ -37,6 +40,8 @@ def report_tcc(data, target_rep):
     :type data["FILE_PATHS"]: list of str
     :param data["FILE_NAME"]: list of name of the files
     :type data["FILE_NAME"]: list of str
+    :param data["CACHE"]: optional cache of the parsed reports
+    :type data["CACHE"]: ReportCache
     :param target_rep: the path to the target path
     :type target_rep: str
     :return: a path to the directory and the name of generated file
@@ -52,7 +57,7 @@ def report_tcc(data, target_rep):
 
     try:
         f = [f for f in data["FILES"] if "tcc_coordination" in f.name.lower()][0]
-        reports = simple_tcc_reports(str(f), bus_excluded=data["BUS_EXCLUS"])
+        reports = simple_tcc_reports(str(f), bus_excluded=data["BUS_EXCLUS"], cache=data.get("CACHE"))
     except IndexError:
         raise FileNotFoundError("Aucun fichier de réglages de protections")
 
@@ -92,6 +97,8 @@ def report_ed(data, target_rep):
     :type data["FILE_PATHS"]: list of str
     :param data["FILE_NAME"]: list of name of the files
     :type data["FILE_NAME"]: list of str
+    :param data["CACHE"]: optional cache of the parsed reports
+    :type data["CACHE"]: ReportCache
     :param target_rep: the path to the target path
     :type target_rep: str
     :return: a path to the directory and the name of generated file
@@ -102,7 +109,7 @@ def report_ed(data, target_rep):
     tex_output_path = Path(target_rep).joinpath(ED_TEX_FILE_NAME)
     try:
         f = [f for f in data["FILES"] if "equipment_duty" in f.name.lower()][0]
-        report = simple_ed_report(str(f), bus_excluded=data["BUS_EXCLUS"])
+        report = simple_ed_report(str(f), bus_excluded=data["BUS_EXCLUS"], cache=data.get("CACHE"))
     except IndexError:
         raise FileNotFoundError("Aucun fichier de capacité d'équipement")
 
@@ -130,6 +137,8 @@ def report_af(data, target_rep):
     :type data["FILE_PATHS"]: list of str
     :param data["FILE_NAME"]: list of name of the files
     :type data["FILE_NAME"]: list of str
+    :param data["CACHE"]: optional cache of the parsed reports
+    :type data["CACHE"]: ReportCache
     :param target_rep: the path to the target path
     :type target_rep: str
     :return: a path to the directory and the name of generated file
@@ -140,7 +149,7 @@ def report_af(data, target_rep):
     tex_output_path = Path(target_rep).joinpath(AF_TEX_FILE_NAME)
     try:
         f = [f for f in data["FILES"] if "arc_flash_scenario_report" in f.name.lower()][0]
-        report = simple_af_report(str(f), bus_excluded=data["BUS_EXCLUS"])
+        report = simple_af_report(str(f), bus_excluded=data["BUS_EXCLUS"], cache=data.get("CACHE"))
     except IndexError:
         raise FileNotFoundError("Aucun fichier de niveau d'arc-flash")
 
@@ -170,21 +179,25 @@ def report_cc(data, target_rep):
     :type data["FILE"]: list of str
     :param data["NB_SCEN"]: number of scenario
     :type data["NB_SCEN"]: list of str
+    :param data["WORKERS"]: number of processes parsing the files of the scenarios
+    :type data["WORKERS"]: int
+    :param data["CACHE"]: optional cache of the parsed reports
+    :type data["CACHE"]: ReportCache
     :param target_rep: the path to the target path
     :type target_rep: str
     :return: a path to the directory and the name of generated file
     :rtype: tuple of path
     """
     reports = []
-    hv = None
     xl_output_path = Path(target_rep)/CC_XL_FILE_NAME
     tex_output_path = Path(target_rep)/CC_TEX_FILE_NAME
 
     scenarios = data["SCENARIOS"]
 
+    groups = []
     for scenario in scenarios:
         group = group_by_scenario(data["FILES"], scenario)
-        file30, file1, _type = None, None, None
+        file30, file1, hv, _type = None, None, None, None
         for file in group:
             if '30_Cycle_Report' in file.name or '30 Cycle' in file.name:
                 file30 = file
@@ -202,7 +215,20 @@ def report_cc(data, target_rep):
         elif not file1 or not file30:
             raise FileNotFoundError("Il faut au moins un fichier 30s et un fichier instantané")
 
-        tmp_report = simple_cc_report(str(file30), str(file1), hv=hv, typefile=_type, bus_excluded=data["BUS_EXCLUS"])
+        groups.append((str(file30), str(file1), str(hv) if hv else None, _type))
+
+    # chaque fichier distinct est lu une seule fois, les fichiers des scénarios sont lus en parallèle
+    reads = [read for group in groups for read in cc_reads(*group)]
+    cache = data.get("CACHE")
+    if cache is None:
+        cache = ReportCache()
+    # tous les fichiers lus restent en mémoire le temps du rapport
+    cache.max_items = max(cache.max_items, len(reads))
+    cache.prefetch(reads, workers=data.get("WORKERS", 1))
+
+    for file30, file1, hv, _type in groups:
+        tmp_report = simple_cc_report(file30, file1, hv=hv, typefile=_type, bus_excluded=data["BUS_EXCLUS"],
+                                      cache=cache)
         reports.append(tmp_report)
 
     pire_cas_rap = pire_cas(reports, scenarios)
@@ -224,6 +250,43 @@ def report_cc(data, target_rep):
         raise ValueError
 
 
+REPORTS = {"CC": report_cc, "AF": report_af, "ED": report_ed, "TCC": report_tcc}
+
+
+def generate_reports(data, target_rep, workers=1):
+    """
+    Generate the reports of data["REPORT_TYPE"], at the same time on a process pool when workers > 1
+    the reports read disjoint files and write disjoint outputs
+    :param data: a dictionary that contains all information for the processs, see the report functions
+    :type data: dict
+    :param target_rep: the path to the target path
+    :type target_rep: str
+    :param workers: number of reports generated at the same time
+    :type workers: int
+    :return: generator of (report_type, files, seconds, error) in the order the reports are done, error is the
+    exception raised by the report, None if it succeeded
+    :rtype: generator of tuple
+    """
+    report_types = [report_type for report_type in REPORTS if report_type in data["REPORT_TYPE"]]
+    if workers > 1 and len(report_types) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(report_types))) as pool:
+            futures = [pool.submit(_timed_report, report_type, data, target_rep) for report_type in report_types]
+            for future in as_completed(futures):
+                yield future.result()
+    else:
+        for report_type in report_types:
+            yield _timed_report(report_type, data, target_rep)
+
+
+def _timed_report(report_type, data, target_rep):
+    start = time.perf_counter()
+    try:
+        files, error = [Path(file) for file in REPORTS[report_type](data, target_rep)], None
+    except Exception as e:
+        files, error = [], e
+    return report_type, files, time.perf_counter() - start, error
+
+
 def df_to_tabularay(df, filepath, type='cc'):
     """
     Gives a tabularray table instead of the normal to_latex()
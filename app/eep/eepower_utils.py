@@ -2,62 +2,140 @@ import pandas as pd
 from math import sqrt
 import re
 import numpy as np
+import openpyxl
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
 from pathlib import Path
 
 SCEN_PATERN = r"(?i)(lv|lm|hv|30_cycle_report).+(scen\D*)(\s*_*-*)(\d+\w{0,1})"
 
 
-def parse_excel_sheet(file, sheet_name=0, header=0):
+TCC_TITLE = 'TCC Coordination Report'
+# valeurs lues comme manquantes par pandas.read_excel
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+             'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+
+def _convert_cell(cell):
+    """
+    Value of an openpyxl cell as read by pandas.read_excel
+    """
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def _is_na(value):
+    return (isinstance(value, str) and value in NA_VALUES) or (isinstance(value, float) and np.isnan(value))
+
+
+def _fill_mi_header(row, control_row):
     """
-    parses multiple tables from an excel sheet into multiple data frame objects. Returns [dfs, df_mds],
-    where dfs is a list of data frames and df_mds their potential associated metadata
-    from https://stackoverflow.com/questions/43367805/pandas-read-excel-multiple-tables-on-the-same-sheet
+    Forward fill the blank cells of a header row inside their parent column, like pandas.read_excel
     """
-    xl = pd.ExcelFile(file)
+    last = row[0]
+    for i in range(1, len(row)):
+        if not control_row[i]:
+            last = row[i]
+        if row[i] == "" or row[i] is None:
+            row[i] = last
+        else:
+            control_row[i] = False
+            last = row[i]
+    return row, control_row
+
+
+def _table_frame(rows, header, width):
+    """
+    DataFrame of the rows of a table, parsed like pandas.read_excel
+    :param width: number of columns, the widest row of the sheet up to the end of the table
+    """
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    if isinstance(header, (list, tuple)):
+        control_row = [True] * width
+        for index in header:
+            rows[index], control_row = _fill_mi_header(rows[index], control_row)
+    return TextParser(rows, header=header, skip_blank_lines=False).read()
+
+
+def iter_excel_tables(file, sheet_name=0, header=0, title=TCC_TITLE):
+    """
+    Stream the tables of an excel sheet, the workbook is read once row by row
+    a table is a run of rows whose cell in the title column is filled, it starts with its header rows
+    :param file: path of the .xlsx file
+    :param sheet_name: index or name of the sheet
+    :param header: row or list of rows of the header in every table e.g: [0, 1] for a two-level header
+    :param title: first cell of the title column, in the first row of the sheet
+    :return: generator of pandas.DataFrame, one by table
+    """
+    nb_header = max(header) + 1 if isinstance(header, (list, tuple)) else header + 1
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
     try:
-        entire_sheet = xl.parse(sheet_name=sheet_name)
-
-        lines = np.logical_not(entire_sheet['TCC Coordination Report'].isnull())
-        starts = []
-        ends = []
-        for line, value in lines.items():
-            if line != 0:
-                previous_value = lines[line-1]
-            if line != len(lines) - 1:
-                next_value = lines[line+1]
-            if value and not previous_value:
-                starts.append(line+1)
-            elif value and not next_value:
-                ends.append(line)
-            elif value and line == len(lines) - 1:
-                ends.append(line)
-
-        if len(starts) < len(ends) or len(starts) > len(ends)+1:
-            raise BaseException('Could not detect equal number of beginnings and ends')
-
-        # make data frames
-        dfs = []
-        df_mds = []
-        for ind in range(len(starts)):
-            start = int(starts[ind])
-
-            if ind < len(ends):
-                stop = int(ends[ind] + 1)
-            else:
-                stop = int(entire_sheet.shape[0])
-            df = xl.parse(sheet_name=sheet_name, skiprows=start, nrows=stop-start, header=header)
-            dfs.append(df)
-        xl.close()
-        return dfs
-    except BaseException as e:
-        xl.close()
-        raise e
-    except Exception as e:
-        xl.close()
-        raise e
-
-
-def simple_tcc_reports(rap_tcc, bus_excluded=None):
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        sheet.reset_dimensions()
+        rows = iter(sheet.rows)
+        first_row = [_convert_cell(cell) for cell in next(rows, [])]
+        if title not in first_row:
+            raise KeyError(title)
+        column = first_row.index(title)
+
+        # comme pandas, les lignes sont complétées jusqu'à la plus large lue depuis le début de la feuille
+        width = len(first_row)
+        while width and first_row[width - 1] == "":
+            width -= 1
+        table = []
+        for row in rows:
+            values = [_convert_cell(cell) for cell in row]
+            while values and values[-1] == "":
+                values.pop()
+            width = max(width, len(values))
+            if column < len(values) and not _is_na(values[column]):
+                table.append(values)
+                continue
+            # la première ligne vide dans la colonne du titre termine le tableau
+            if len(table) >= nb_header:
+                yield _table_frame(table, header, width)
+            table = []
+        if len(table) >= nb_header:
+            yield _table_frame(table, header, width)
+    finally:
+        workbook.close()
+
+
+def parse_excel_sheet(file, sheet_name=0, header=0):
+    """
+    parses multiple tables from an excel sheet into multiple data frame objects, see iter_excel_tables
+    :return: list of pandas.DataFrame
+    """
+    return list(iter_excel_tables(file, sheet_name=sheet_name, header=header))
+
+
+# lecture des rapports de court-circuit selon leur format
+CC_CSV = {'skiprows': 1, 'index_col': 0}
+CC_EXCEL = {'skiprows': 7, 'index_col': 0, 'engine': 'openpyxl'}
+# lecteurs des rapports, par nom, utilisés aussi par le cache des rapports
+READERS = {'csv': pd.read_csv, 'excel': pd.read_excel, 'tables': parse_excel_sheet}
+
+
+def read_report(file, reader, cache=None, **kwargs):
+    """
+    Parse a report, through the cache if there is one
+    :param reader: 'csv', 'excel' or 'tables', see READERS
+    :param cache: ReportCache or None
+    :param kwargs: arguments of the reader
+    :rtype: pandas.DataFrame or list of pandas.DataFrame
+    """
+    if cache is not None:
+        return cache.read(file, reader, **kwargs)
+    return READERS[reader](file, **kwargs)
+
+
+def simple_tcc_reports(rap_tcc, bus_excluded=None, cache=None):
     """
     Créer un dataframe pandas avec les données nécessaires issues d'EasyPower:
 
@@ -65,6 +143,8 @@ def simple_tcc_reports(rap_tcc, bus_excluded=None):
     :type rap_af: str
     :param bus_excluded: liste des bus à ne pas inclure dans le tableau
     :type bus_excluded: list of str
+    :param cache: cache des rapports déjà lus, les fichiers sont lus directement si None
+    :type cache: ReportCache
     :return: un Dataframe Pandas contenant les informations nécessaire dans le tableau
     :rtype: pd.DataFrame
     """
@@ -115,7 +195,7 @@ def simple_tcc_reports(rap_tcc, bus_excluded=None):
         }
     }
 
-    rapports = parse_excel_sheet(rap_tcc, header=[0, 1])
+    rapports = read_report(rap_tcc, 'tables', cache=cache, header=[0, 1])
     for df in rapports:
         prim_cols = set([prim for prim, sec in df.columns.to_list()])
         sec_cols = set([sec for prim, sec in df.columns.to_list()])
@@ -148,7 +228,7 @@ def simple_tcc_reports(rap_tcc, bus_excluded=None):
     return tables
 
 
-def simple_ed_report(rap_ed, bus_excluded=None):
+def simple_ed_report(rap_ed, bus_excluded=None, cache=None):
     """
     Créer un dataframe pandas avec les données nécessaires issues d'EasyPower
 
@@ -156,6 +236,8 @@ def simple_ed_report(rap_ed, bus_excluded=None):
     :type rap_af: str
     :param bus_excluded: liste des bus à ne pas inclure dans le tableau
     :type bus_excluded: list of str
+    :param cache: cache des rapports déjà lus, les fichiers sont lus directement si None
+    :type cache: ReportCache
     :return: un Dataframe Pandas contenant les informations nécessaire dans le tableau
     :rtype: pd.DataFrame
     """
@@ -173,7 +255,7 @@ def simple_ed_report(rap_ed, bus_excluded=None):
         "Comments": "Commentaires"
     }
 
-    rapport = pd.DataFrame(pd.read_excel(rap_ed, index_col=1))
+    rapport = pd.DataFrame(read_report(rap_ed, 'excel', cache=cache, index_col=1))
 
     if bus_excluded is not None and bus_excluded != []:
         try:
@@ -200,7 +282,7 @@ def simple_ed_report(rap_ed, bus_excluded=None):
     return rapport
 
 
-def simple_af_report(rap_af, bus_excluded=None):
+def simple_af_report(rap_af, bus_excluded=None, cache=None):
     """
     Créer un dataframe pandas avec les données nécessaires issues d'EasyPower:
 
@@ -211,6 +293,8 @@ def simple_af_report(rap_af, bus_excluded=None):
     :type rap_af: str
     :param bus_excluded: liste des bus à ne pas inclure dans le tableau
     :type bus_excluded: list of str
+    :param cache: cache des rapports déjà lus, les fichiers sont lus directement si None
+    :type cache: ReportCache
     :return: un Dataframe Pandas contenant les informations nécessaire dans le tableau
     :rtype: pd.DataFrame
     """
@@ -232,9 +316,9 @@ def simple_af_report(rap_af, bus_excluded=None):
     file_path = Path(rap_af)
     typefile = file_path.suffix
     if typefile == '.csv':
-        rapport = pd.DataFrame(pd.read_csv(rap_af, index_col=0))
+        rapport = pd.DataFrame(read_report(rap_af, 'csv', cache=cache, index_col=0))
     elif typefile == '.xlsx':
-        rapport = pd.DataFrame(pd.read_excel(rap_af, index_col=0))
+        rapport = pd.DataFrame(read_report(rap_af, 'excel', cache=cache, index_col=0))
 
     if bus_excluded is not None and bus_excluded != []:
         rapport = rapport[~rapport.index.str.contains('|'.join(bus_excluded))]
@@ -256,7 +340,17 @@ def simple_af_report(rap_af, bus_excluded=None):
     return rapport.dropna()
 
 
-def simple_cc_report(rap_30, rap_1, hv=None, typefile='csv', bus_excluded=None):
+def cc_reads(rap_30, rap_1, hv=None, typefile='csv'):
+    """
+    Files read by simple_cc_report, to parse them ahead with ReportCache.prefetch
+    :return: list of (file, reader, kwargs)
+    :rtype: list of tuple
+    """
+    reader, kwargs = ('csv', CC_CSV) if typefile == 'csv' else ('excel', CC_EXCEL)
+    return [(file, reader, kwargs) for file in (rap_30, rap_1, hv) if file]
+
+
+def simple_cc_report(rap_30, rap_1, hv=None, typefile='csv', bus_excluded=None, cache=None):
     """
     Créer une dataframe pandas en groupant les information utile depuis les rapport 30 cycles et 1 cycle
     :param rap_30:
@@ -265,17 +359,19 @@ def simple_cc_report(rap_30, rap_1, hv=None, typefile='csv', bus_excluded=None):
     :type rap_1:
     :param typefile:
     :type typefile:
+    :param cache: cache des rapports déjà lus, les fichiers sont lus directement si None
+    :type cache: ReportCache
     :return:
     :rtype:
     """
     bus_excluded = [str.upper(bus) for bus in bus_excluded]
     #ajouté pour être sûr de dropper les lignes voulues (easypower donne des noms en capitale)
     if typefile == 'csv':
-        rapport_30cycles = pd.DataFrame(pd.read_csv(rap_30, skiprows=1, index_col=0))
-        rapport_1cycle = pd.DataFrame(pd.read_csv(rap_1, skiprows=1, index_col=0))
+        rapport_30cycles = pd.DataFrame(read_report(rap_30, 'csv', cache=cache, **CC_CSV))
+        rapport_1cycle = pd.DataFrame(read_report(rap_1, 'csv', cache=cache, **CC_CSV))
     elif typefile == 'xlsx':
-        rapport_30cycles = pd.DataFrame(pd.read_excel(rap_30, skiprows=7, index_col=0, engine='openpyxl'))
-        rapport_1cycle = pd.DataFrame(pd.read_excel(rap_1, skiprows=7, index_col=0, engine='openpyxl'))
+        rapport_30cycles = pd.DataFrame(read_report(rap_30, 'excel', cache=cache, **CC_EXCEL))
+        rapport_1cycle = pd.DataFrame(read_report(rap_1, 'excel', cache=cache, **CC_EXCEL))
 
     if bus_excluded != None and bus_excluded != []:
         temp1 = rapport_1cycle[~rapport_1cycle.index.str.contains('|'.join(bus_excluded))]
@@ -306,7 +402,7 @@ def simple_cc_report(rap_30, rap_1, hv=None, typefile='csv', bus_excluded=None):
     rap.insert(4, '2,6*I Sym', peak)
 
     if hv:
-        hv_report = simple_cc_report(rap_30, hv, hv=None, typefile=typefile, bus_excluded=bus_excluded)
+        hv_report = simple_cc_report(rap_30, hv, hv=None, typefile=typefile, bus_excluded=bus_excluded, cache=cache)
         rap = pd.concat([rap, hv_report])
         rap = rap.sort_values(by='Bus (V)', ascending=False)
 
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the parsed EasyPower reports, keyed by the content of the file and the way it is read
+an uploaded report is parsed once when it is validated, the reports generated from it read it back from the cache
+"""
+import hashlib
+import json
+import pickle
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .eepower_utils import READERS
+from ..utils.Workspace import save_file, load_object
+
+
+class ReportCache:
+    def __init__(self, path=None, max_items=16):
+        """
+        Parsed reports kept in memory, the least recently used are dropped past max_items
+        the reports are also spilled on disk so the other processes of the session (e.g: the workers generating the
+        reports) find them
+        :param path: directory of the files of the cache, memory only if None
+        :param max_items: number of parsed reports kept in memory
+        """
+        self.path = Path(path) if path is not None else None
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def key(file, reader, **kwargs):
+        """
+        :return: hash of the content of the file and of the reader with its arguments
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        with open(file, 'rb') as content:
+            for chunk in iter(lambda: content.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(json.dumps([reader, kwargs], sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def read(self, file, reader, **kwargs):
+        """
+        Parse a report, or take it from the cache if the same content was parsed the same way
+        :param file: path of the report
+        :param reader: 'csv', 'excel' or 'tables', see eepower_utils.READERS
+        :param kwargs: arguments of the reader
+        :return: a copy of the parsed report, the caller can modify it
+        :rtype: pandas.DataFrame or list of pandas.DataFrame
+        """
+        key = self.key(file, reader, **kwargs)
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return _copy(value)
+
+        value = load_object(self._file(key)) if self.path is not None else None
+        if value is None:
+            self.misses += 1
+            value = READERS[reader](file, **kwargs)
+            self._spill(key, value)
+        else:
+            self.hits += 1
+        self._store(key, value)
+        return _copy(value)
+
+    def prefetch(self, reads, workers=1):
+        """
+        Parse the reports missing from the cache, on a process pool when workers > 1
+        every distinct content is parsed once, even if several reads share it
+        :param reads: list of (file, reader, kwargs) as given to read
+        :param workers: number of processes
+        :return: number of reports parsed
+        """
+        missing = OrderedDict()
+        for file, reader, kwargs in reads:
+            key = self.key(file, reader, **kwargs)
+            if key not in self._items and key not in missing and \
+                    (self.path is None or not self._file(key).exists()):
+                missing[key] = (file, reader, kwargs)
+        if workers > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+                values = list(pool.map(_parse, missing.values()))
+        else:
+            values = [_parse(read) for read in missing.values()]
+        for key, value in zip(missing, values):
+            self.misses += 1
+            self._spill(key, value)
+            self._store(key, value)
+        return len(missing)
+
+    def _spill(self, key, value):
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            save_file(self._file(key), lambda out: pickle.dump(value, out, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _store(self, key, value):
+        self._items[key] = value
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def _file(self, key):
+        return self.path / (key + '.pickle')
+
+
+def _parse(read):
+    file, reader, kwargs = read
+    return READERS[reader](file, **kwargs)
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return [df.copy() for df in value]
+    return value.copy()
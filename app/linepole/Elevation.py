@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+"""
+Elevation providers used by the linepole generator.
+
+Every provider takes a N×2 array of (latitude, longitude) and returns a N array of
+elevations in meters, so a whole line can be resolved in a single call.
+"""
+import math
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+RACEMAP_URL = "https://elevation.racemap.com/api"
+CACHE_PATH = Path(__file__).parent.parent.parent / 'generated' / 'elevation_cache.sqlite'
+
+
+class AltitudeRetrievingError(Exception):
+    def __init__(self, err, list):
+        self.err = err
+        self.list = list
+        self.message = ("Error while getting elevation :", err, '\n arguments : {0}'.format(list))
+
+
+class ElevationProvider:
+    """
+    Base class of the elevation providers
+    A provider returns NaN for the coordinates it can't resolve, so that a fallback provider can complete them
+    """
+
+    def get_elevations(self, coords):
+        """
+        Give the elevation of every coordinate
+        :param coords: array of (lat, long)
+        :type coords: numpy.ndarray of shape (N, 2)
+        :return: elevation in meters, NaN when unknown
+        :rtype: numpy.ndarray of shape (N,)
+        """
+        raise NotImplementedError
+
+
+class HTTPElevationProvider(ElevationProvider):
+    def __init__(self, url=RACEMAP_URL, chunk_size=100, max_retries=5, timeout=30, workers=4):
+        """
+        Provider querying an elevation web API (elevation.racemap.com by default)
+        The HTTP connections are pooled in a single in-process session and the chunks are sent concurrently
+        :param url: url of the API, it receives a json list of [lat, long] and answers a json list of elevations
+        :type url: str
+        :param chunk_size: number of coordinates sent by request
+        :type chunk_size: int
+        :param max_retries: number of retries when the API answers 'Too Many Requests'
+        :type max_retries: int
+        :param timeout: timeout of a request in seconds
+        :type timeout: float
+        :param workers: maximum number of requests in flight
+        :type workers: int
+        """
+        self.url = url
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.workers = workers
+        self._session = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_session'] = None
+        return state
+
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self._session = requests.Session()
+            pool_size = max(self.workers, 1)
+            self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+            self._session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+        return self._session
+
+    def get_elevations(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        chunks = [coords[i:i + self.chunk_size].tolist() for i in range(0, len(coords), self.chunk_size)]
+        if not chunks:
+            return np.empty(0)
+        self._get_session()
+        if self.workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as pool:
+                elevations = list(pool.map(self._post_chunk, chunks))
+        else:
+            elevations = [self._post_chunk(chunk) for chunk in chunks]
+        return np.concatenate(elevations)
+
+    def _post_chunk(self, coords_chunk):
+        session = self._get_session()
+        err = None
+        for retry in range(self.max_retries + 1):
+            try:
+                response = session.post(self.url, json=coords_chunk, timeout=self.timeout)
+            except Exception as e:
+                err = e
+            else:
+                if response.status_code == 429 or b'Too Many Requests' in response.content:
+                    err = 'Too many requests'
+                elif response.status_code != 200 or response.content == b'':
+                    raise AltitudeRetrievingError(response.status_code, response.content)
+                else:
+                    try:
+                        elevation = response.json()
+                    except ValueError:
+                        raise AltitudeRetrievingError(response.status_code, response.content)
+                    if len(elevation) != len(coords_chunk):
+                        raise AltitudeRetrievingError('Wrong number of elevations', response.content)
+                    return np.array(elevation, dtype=float)
+            time.sleep(min(0.5 * 2 ** retry, 8))
+        raise AltitudeRetrievingError(err, coords_chunk)
+
+
+class DEMTile:
+    __slots__ = ('data', 'lat_origin', 'lon_origin', 'dlat', 'dlon', 'nodata')
+
+    def __init__(self, data, lat_origin, lon_origin, dlat, dlon, nodata=None):
+        """
+        Regular grid of elevation, row 0 is the northern row
+        :param data: 2D array (memory-mapped) of elevations
+        :param lat_origin: latitude of the samples of the first row
+        :param lon_origin: longitude of the samples of the first column
+        :param dlat: latitude step between two rows (positive)
+        :param dlon: longitude step between two columns (positive)
+        :param nodata: value of the voids in the grid
+        """
+        self.data = data
+        self.lat_origin, self.lon_origin = lat_origin, lon_origin
+        self.dlat, self.dlon = dlat, dlon
+        self.nodata = nodata
+
+    def contains(self, lat, lon):
+        rows, cols = self.data.shape
+        return (lat <= self.lat_origin) & (lat >= self.lat_origin - (rows - 1) * self.dlat) & \
+               (lon >= self.lon_origin) & (lon <= self.lon_origin + (cols - 1) * self.dlon)
+
+    def sample(self, lat, lon):
+        """
+        Bilinear interpolation of the grid for every coordinate (they must be inside the tile)
+        :return: elevations, NaN where one of the surrounding samples is a void
+        :rtype: numpy.ndarray
+        """
+        rows, cols = self.data.shape
+        y = (self.lat_origin - lat) / self.dlat
+        x = (lon - self.lon_origin) / self.dlon
+        r0 = np.clip(np.floor(y).astype(np.intp), 0, rows - 2)
+        c0 = np.clip(np.floor(x).astype(np.intp), 0, cols - 2)
+        fy = np.clip(y - r0, 0, 1)
+        fx = np.clip(x - c0, 0, 1)
+
+        z00 = self.data[r0, c0].astype(float)
+        z01 = self.data[r0, c0 + 1].astype(float)
+        z10 = self.data[r0 + 1, c0].astype(float)
+        z11 = self.data[r0 + 1, c0 + 1].astype(float)
+        if self.nodata is not None:
+            for z in (z00, z01, z10, z11):
+                z[z == self.nodata] = np.nan
+
+        return (z00 * (1 - fx) + z01 * fx) * (1 - fy) + (z10 * (1 - fx) + z11 * fx) * fy
+
+
+HGT_NAME = re.compile(r"(?i)^([NS])(\d{2})([EW])(\d{3})\.hgt$")
+
+
+def open_hgt(path):
+    """
+    Memory-map a SRTM .hgt tile (SRTM1 3601x3601 or SRTM3 1201x1201)
+    :param path: path of the tile, the name gives its south-west corner e.g: N45W074.hgt
+    :rtype: DEMTile
+    """
+    path = Path(path)
+    m = HGT_NAME.match(path.name)
+    if not m:
+        raise ValueError("Le nom du fichier {0} n'est pas un nom de tuile SRTM".format(path.name))
+    lat = int(m.group(2)) * (1 if m.group(1).upper() == 'N' else -1)
+    lon = int(m.group(4)) * (1 if m.group(3).upper() == 'E' else -1)
+    size = int(math.sqrt(path.stat().st_size // 2))
+    data = np.memmap(path, dtype='>i2', mode='r', shape=(size, size))
+    step = 1 / (size - 1)
+    return DEMTile(data, lat + 1, lon, step, step, nodata=-32768)
+
+
+_TIFF_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'II', 6: 'b', 8: 'h', 9: 'i', 10: 'ii', 11: 'f', 12: 'd'}
+
+
+def _read_tiff_tags(file):
+    byte_order = file.read(2)
+    if byte_order == b'II':
+        bo = '<'
+    elif byte_order == b'MM':
+        bo = '>'
+    else:
+        raise ValueError("Ce fichier n'est pas un TIFF")
+    magic, ifd_offset = struct.unpack(bo + 'HI', file.read(6))
+    if magic != 42:
+        raise ValueError("Seuls les TIFF classiques sont gérés (pas les BigTIFF)")
+
+    file.seek(ifd_offset)
+    nb_entries, = struct.unpack(bo + 'H', file.read(2))
+    tags = {}
+    for entry in [file.read(12) for _ in range(nb_entries)]:
+        tag, typ, count = struct.unpack(bo + 'HHI', entry[:8])
+        if typ not in _TIFF_TYPES:
+            continue
+        fmt = bo + _TIFF_TYPES[typ] * count
+        size = struct.calcsize(fmt)
+        if size <= 4:
+            raw = entry[8:8 + size]
+        else:
+            offset, = struct.unpack(bo + 'I', entry[8:])
+            position = file.tell()
+            file.seek(offset)
+            raw = file.read(size)
+            file.seek(position)
+        if typ == 2:
+            tags[tag] = raw.split(b'\x00')[0].decode('ascii', 'ignore')
+        else:
+            tags[tag] = struct.unpack(fmt, raw)
+    return bo, tags
+
+
+def open_geotiff(path):
+    """
+    Memory-map a single band, uncompressed and striped GeoTIFF in geographic coordinates (EPSG:4326)
+    :param path: path of the GeoTIFF
+    :rtype: DEMTile
+    """
+    with open(path, 'rb') as file:
+        bo, tags = _read_tiff_tags(file)
+
+    width, height = tags[256][0], tags[257][0]
+    if tags.get(259, (1,))[0] != 1 or tags.get(277, (1,))[0] != 1 or 273 not in tags:
+        raise ValueError("Le GeoTIFF {0} doit être non compressé, en bandes (strips) et à une seule "
+                         "bande".format(path))
+    offsets, counts = tags[273], tags[279]
+    if any(offsets[i] + counts[i] != offsets[i + 1] for i in range(len(offsets) - 1)):
+        raise ValueError("Les bandes du GeoTIFF {0} ne sont pas contiguës".format(path))
+
+    kind = {1: 'u', 2: 'i', 3: 'f'}[tags.get(339, (1,))[0]]
+    dtype = np.dtype('{0}{1}{2}'.format(bo, kind, tags[258][0] // 8))
+    data = np.memmap(path, dtype=dtype, mode='r', offset=offsets[0], shape=(height, width))
+
+    scale_x, scale_y = tags[33550][:2]
+    _, _, _, lon, lat, _ = tags[33922][:6]
+    # GTRasterTypeGeoKey : 1 = PixelIsArea (le point d'attache est le coin du pixel), 2 = PixelIsPoint
+    geokeys = tags.get(34735, ())
+    pixel_is_point = any(geokeys[i] == 1025 and geokeys[i + 3] == 2 for i in range(4, len(geokeys), 4))
+    if not pixel_is_point:
+        lon += scale_x / 2
+        lat -= scale_y / 2
+
+    nodata = float(tags[42113]) if 42113 in tags else None
+    return DEMTile(data, lat, lon, scale_y, scale_x, nodata=nodata)
+
+
+class LocalDEMProvider(ElevationProvider):
+    def __init__(self, directory):
+        """
+        Provider reading DEM tiles (SRTM .hgt and GeoTIFF) from a local directory
+        The tiles are memory-mapped, only the pages holding the requested samples are read from the disk
+        :param directory: directory containing the tiles
+        :type directory: str or Path
+        """
+        self.directory = Path(directory)
+        self._hgt_paths = {}
+        self._hgt_tiles = {}
+        self._tiff_tiles = []
+        for path in sorted(self.directory.iterdir()):
+            m = HGT_NAME.match(path.name)
+            if m:
+                lat = int(m.group(2)) * (1 if m.group(1).upper() == 'N' else -1)
+                lon = int(m.group(4)) * (1 if m.group(3).upper() == 'E' else -1)
+                self._hgt_paths[(lat, lon)] = path
+            elif path.suffix.lower() in ('.tif', '.tiff'):
+                self._tiff_tiles.append(open_geotiff(path))
+
+    def _hgt_tile(self, key):
+        if key not in self._hgt_tiles:
+            self._hgt_tiles[key] = open_hgt(self._hgt_paths[key]) if key in self._hgt_paths else None
+        return self._hgt_tiles[key]
+
+    def get_elevations(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        lat, lon = coords[:, 0], coords[:, 1]
+        elevation = np.full(len(coords), np.nan)
+
+        if self._hgt_paths:
+            keys = np.floor(coords).astype(int)
+            for key in set(map(tuple, keys.tolist())):
+                tile = self._hgt_tile(key)
+                if tile is not None:
+                    mask = (keys[:, 0] == key[0]) & (keys[:, 1] == key[1])
+                    elevation[mask] = tile.sample(lat[mask], lon[mask])
+
+        for tile in self._tiff_tiles:
+            mask = np.isnan(elevation) & tile.contains(lat, lon)
+            if mask.any():
+                elevation[mask] = tile.sample(lat[mask], lon[mask])
+
+        return elevation
+
+
+class ChainedElevationProvider(ElevationProvider):
+    def __init__(self, *providers):
+        """
+        Ask every provider in turn for the coordinates still unresolved by the previous ones
+        e.g: ChainedElevationProvider(LocalDEMProvider(dem_dir), HTTPElevationProvider())
+        """
+        self.providers = providers
+
+    def get_elevations(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        elevation = np.full(len(coords), np.nan)
+        for provider in self.providers:
+            missing = np.isnan(elevation)
+            if not missing.any():
+                break
+            elevation[missing] = provider.get_elevations(coords[missing])
+        return elevation
+
+
+class ElevationCache:
+    def __init__(self, path=CACHE_PATH, max_entries=2000000, recency=3600):
+        """
+        Persistent store of elevations in a SQLite file, shared by every process of the application
+        the coordinates are quantized to 7 decimals like the LineSection coordinates
+        the least recently used entries are evicted once max_entries is reached, down to 90 % of max_entries so the
+        entries are only counted again after many insertions
+        :param path: path of the SQLite file, ':memory:' for a cache that lives only in the process
+        :type path: str or Path
+        :param max_entries: maximum number of elevations kept
+        :type max_entries: int
+        :param recency: seconds between two updates of the last use of an entry, a lookup of an entry used more
+        recently writes nothing
+        :type recency: float
+        """
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.recency = recency
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._count = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # le cache suit son fournisseur dans les processus du ProcessPool de KMLHandler, chacun ouvre sa connexion
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_count'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            if self.path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS elevation (lat INTEGER, lon INTEGER, alt REAL, '
+                               'last_used INTEGER, PRIMARY KEY (lat, lon)) WITHOUT ROWID')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS elevation_last_used ON elevation (last_used)')
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _keys(coords):
+        return np.round(np.asarray(coords, dtype=float).reshape(-1, 2) * 1e7).astype(np.int64)
+
+    def get(self, coords):
+        """
+        Look up the elevation of every coordinate
+        :param coords: array of (lat, long)
+        :type coords: numpy.ndarray of shape (N, 2)
+        :return: elevations, NaN for the coordinates absent of the cache
+        :rtype: numpy.ndarray of shape (N,)
+        """
+        keys = self._keys(coords)
+        elevation = np.full(len(keys), np.nan)
+        if len(keys) == 0:
+            return elevation
+        with self._lock:
+            conn = self._connect()
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS query (idx INTEGER, lat INTEGER, lon INTEGER)')
+            conn.execute('DELETE FROM query')
+            conn.executemany('INSERT INTO query VALUES (?, ?, ?)',
+                             zip(range(len(keys)), keys[:, 0].tolist(), keys[:, 1].tolist()))
+            rows = conn.execute('SELECT query.idx, elevation.alt, elevation.last_used FROM query '
+                                'JOIN elevation ON elevation.lat = query.lat AND elevation.lon = query.lon').fetchall()
+            now = time.time_ns()
+            stale = now - int(self.recency * 1e9)
+            # la date d'utilisation n'est mise à jour que si elle est plus vieille que recency, en une seule requête
+            if any(last_used < stale for _, _, last_used in rows):
+                conn.execute('UPDATE elevation SET last_used = ? '
+                             'WHERE last_used < ? AND (lat, lon) IN (SELECT lat, lon FROM query)', (now, stale))
+            conn.commit()
+        if rows:
+            idx, alt, _ = zip(*rows)
+            elevation[list(idx)] = alt
+        self.hits += len(rows)
+        self.misses += len(keys) - len(rows)
+        return elevation
+
+    def put(self, coords, elevation):
+        """
+        Store the elevations, the NaN are ignored
+        :param coords: array of (lat, long)
+        :type coords: numpy.ndarray of shape (N, 2)
+        :param elevation: elevation of each coordinate
+        :type elevation: numpy.ndarray of shape (N,)
+        """
+        keys = self._keys(coords)
+        elevation = np.asarray(elevation, dtype=float)
+        known = ~np.isnan(elevation)
+        if not known.any():
+            return
+        now = time.time_ns()
+        with self._lock:
+            conn = self._connect()
+            if self._count is None:
+                self._count, = conn.execute('SELECT COUNT(*) FROM elevation').fetchone()
+            conn.executemany('INSERT OR REPLACE INTO elevation VALUES (?, ?, ?, ?)',
+                             zip(keys[known, 0].tolist(), keys[known, 1].tolist(), elevation[known].tolist(),
+                                 [now] * int(known.sum())))
+            # compte majoré : les remplacements sont comptés comme des ajouts, les ajouts des autres processus
+            # sont retrouvés au prochain comptage
+            self._count += int(known.sum())
+            if self._count > self.max_entries:
+                self._count, = conn.execute('SELECT COUNT(*) FROM elevation').fetchone()
+                if self._count > self.max_entries:
+                    target = int(self.max_entries * 0.9)
+                    conn.execute('DELETE FROM elevation WHERE (lat, lon) IN '
+                                 '(SELECT lat, lon FROM elevation ORDER BY last_used LIMIT ?)',
+                                 (self._count - target,))
+                    self._count = target
+            conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            count, = self._connect().execute('SELECT COUNT(*) FROM elevation').fetchone()
+        return count
+
+    def stats(self):
+        """
+        :return: the hit and miss counters of this process and the number of stored elevations
+        :rtype: dict
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self)}
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM elevation')
+            conn.commit()
+            self._count = 0
+        self.hits, self.misses = 0, 0
+
+
+class CachedElevationProvider(ElevationProvider):
+    def __init__(self, provider, cache=None):
+        """
+        Consult the cache before asking the provider, and store what the provider answers
+        :param provider: provider used for the coordinates absent of the cache
+        :type provider: ElevationProvider
+        :param cache: elevation cache, the default SQLite file when None
+        :type cache: ElevationCache
+        """
+        self.provider = provider
+        self.cache = cache if cache is not None else ElevationCache()
+
+    def get_elevations(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        elevation = self.cache.get(coords)
+        missing = np.isnan(elevation)
+        if missing.any():
+            elevation[missing] = self.provider.get_elevations(coords[missing])
+            self.cache.put(coords[missing], elevation[missing])
+        return elevation
+
+
+_provider = None
+
+
+def default_provider():
+    """
+    The local DEM tiles of the directory given by the environment variable LINEPOLE_DEM_DIR are used first,
+    elevation.racemap.com completes the coordinates that are not covered
+    both are behind the persistent cache, its file can be moved with the environment variable
+    LINEPOLE_ELEVATION_CACHE
+    """
+    dem_dir = os.environ.get('LINEPOLE_DEM_DIR')
+    if dem_dir and Path(dem_dir).is_dir():
+        provider = ChainedElevationProvider(LocalDEMProvider(dem_dir), HTTPElevationProvider())
+    else:
+        provider = HTTPElevationProvider()
+    return CachedElevationProvider(provider, ElevationCache(os.environ.get('LINEPOLE_ELEVATION_CACHE', CACHE_PATH)))
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        _provider = default_provider()
+    return _provider
+
+
+def set_provider(provider):
+    """
+    Replace the provider used by get_elevation
+    :param provider: the new provider, None to go back to the default one
+    :type provider: ElevationProvider
+    :return: the provider replaced
+    :rtype: ElevationProvider
+    """
+    global _provider
+    previous, _provider = _provider, provider
+    return previous
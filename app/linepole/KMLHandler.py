@@ -1,36 +1,109 @@
 # -*- coding: utf-8 -*-
-from .Mesures import get_elevation as get_alt, get_distance_with_altitude as get_dist, get_subcoord_dist as sub_dist
+from .Mesures import get_elevation as get_alt
+from .Mesures import get_subcoords_dist as sub_coords
 from .Mesures import AltitudeRetrievingError
-from .Mesures import get_angle_between_two_lines as get_angle
-from .Mesures import get_xy_ground_distance as xy_dist
-from .Mesures import deg2grad, addToCoord
-from .KMLutils import openKML, random_color_gen, gen_placemark_from_Line
+from .Mesures import get_angles_between_lines as get_angles
+from .Mesures import get_distances_with_altitude as get_dists
+from .Mesures import deg2grad, get_parallel_lines, geodesic_inverse, get_local_xy
+from .SpatialIndex import SpatialIndex
+from .KMLutils import KMLRecord, read_kml, random_color_gen, line_styles, KMLWriter
 from itertools import repeat
-from fastkml import kml, Document, Folder, Placemark, styles
-from shapely.geometry import Point, LineString, Polygon
+from fastkml import kml, Document, styles
+from shapely.geometry import LineString, Polygon
 import pandas as pd
+import numpy as np
 from numpy import array, transpose
+from enum import IntEnum
 from . import settings
-from copy import deepcopy
 import random
-import math
 from colour import Color
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import io
+import json
+import os
+import zipfile
 
 resolution = 25 #résolution pour déterminer l'altitude en metres
+offset_space = 1000000 #espacement des points des lignes parallèles, leurs sections ne sont pas découpées
 ns = '{http://www.opengis.net/kml/2.2}'
 
+def _build_line(trace):
+    """
+    Build a Line without its altitudes, run in the worker processes
+    :param trace: (list_of_coord, typekey, offset, offset_max_dist, space)
+    :rtype: Line
+    """
+    list_of_coord, typekey, offset, offset_max_dist, space = trace
+    return Line(list_of_coord, typekey=typekey, offset=offset, offset_max_dist=offset_max_dist, fetch_alt=False,
+                space=space)
+
+
+def _pack(arrays, width=None):
+    """
+    Concatenate arrays of different lengths to save them in a .npz archive
+    :param arrays: list of numpy.ndarray or None
+    :param width: number of columns of the arrays, None for 1-D arrays
+    :return: (values, counts) the concatenated arrays and their lengths, -1 for None
+    :rtype: tuple of numpy.ndarray
+    """
+    counts = np.array([-1 if a is None else len(a) for a in arrays], dtype=np.int64)
+    shape = (-1,) if width is None else (-1, width)
+    present = [np.asarray(a).reshape(shape) for a in arrays if a is not None]
+    values = np.concatenate(present) if present else np.empty((0,) if width is None else (0, width))
+    return values, counts
+
+
+def _unpack(values, counts):
+    """
+    Split the arrays concatenated by _pack
+    :rtype: list of numpy.ndarray or None
+    """
+    bounds = np.cumsum(np.maximum(counts, 0))[:-1]
+    return [None if count < 0 else part for part, count in zip(np.split(values, bounds), counts)]
+
+
+def pole_numbers(hor_angle):
+    """
+    Name the poles of a line after their number and horizontal angle e.g: 's3-12gr'
+    :param hor_angle: horizontal angle of every pole in degrees
+    :rtype: list of str
+    """
+    return ['s{0}-{1}gr'.format(i, int(angle)) for i, angle in enumerate(deg2grad(np.asarray(hor_angle)))]
+
+
+def _csv_values(values):
+    """
+    Format a column like pandas.DataFrame.to_csv, the missing values are left empty
+    :rtype: list or numpy.ndarray of str
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+        text = values.astype(str)
+        text[np.isnan(values)] = ''
+        return text
+    return ['' if value is None else str(value) for value in values]
+
+
 class KMLHandler(kml.KML):
-    def __init__(self,kml_file):
+    def __init__(self,kml_file, workers=1):
         """
         A handle to manage the KML file input and augmented output
-        :param kml_file: a KML file path structured like : Documents => (Folders =>) Placemarks
+        :param kml_file: a KML (or KMZ) file path structured like : Documents => (Folders =>) Placemarks
+                         the file is streamed, only its structure and LineString coordinates are kept
+        :param workers: number of processes computing the traces in parallel, 1 to compute them in this process
         :property outputdf: a pandas DataFrame which contain all the data
-        :property ouputkml: a kml with the divided sections (need to be generated with .generateOutput fisrt)
         :property camelia: a pandas DataFrame structured for Camelia software
+        :property profiles: the ElevationProfile of the traces by index, kept by the incremental generations
+        :property spatial_index: SpatialIndex of the poles and segments of all the lines, built once by generation
+        outputdf and camelia are built once after each generatePoles/generateOffset, write_outputs_csv and
+        write_camelia_csv write the same tables from the arrays of the lines without building them
         """
         super().__init__()
         self.offset = False
-        self.inputKML = openKML(kml_file)
+        self.workers = workers
+        self._outputdf = self._camelia = self._spatial_index = None
+        self.profiles = {}
+        self.inputKML = read_kml(kml_file)
 
         self.Documents = self._set_documents()
         self.Folders = self._set_folders(self.Documents)
@@ -42,16 +115,161 @@ class KMLHandler(kml.KML):
         self._set_dataframe()
 
     def __repr__(self):
-        return self.outputkml.to_string(prettyprint=True)
+        return self.to_string()
 
     def __str__(self):
-        return self.outputkml.to_string(prettyprint=True)
+        return self.to_string()
 
-    def generatePoles(self):
-        self._set_sections()
+    def to_string(self, prettyprint=True):
+        output = io.StringIO()
+        self.write_kml(output, prettyprint=prettyprint)
+        return output.getvalue()
 
-    def generateOutput(self):
-        self.outputkml = self._get_output_kml()
+    def write_kml(self, file, prettyprint=True):
+        """
+        Write the augmented kml incrementally, the Documents, Folders, lines and poles are emitted as they are
+        generated so the memory used does not depend on the number of poles
+        :param file: text or binary file handle
+        :param prettyprint: indent the elements
+        :type prettyprint: bool
+        """
+        trace_index = self._get_trace_index()
+        with KMLWriter(file, prettyprint=prettyprint) as writer:
+            for doc in self.Documents:
+                writer.start_container('Document', doc.id, doc.name, doc.description)
+                if list(doc.features())[0].kind == 'Placemark':
+                    self._write_placemarks(writer, doc.features(), trace_index)
+                else:
+                    for folder in doc.features():
+                        writer.start_container('Folder', folder.id, folder.name, folder.description)
+                        self._write_placemarks(writer, folder.features(), trace_index)
+                        writer.end_container()
+                writer.end_container()
+
+    def write_kmz(self, file, prettyprint=False):
+        """
+        Write the augmented kml compressed in a KMZ
+        :param file: path or binary file handle of the KMZ
+        """
+        with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as kmz:
+            with kmz.open('doc.kml', 'w') as doc:
+                self.write_kml(doc, prettyprint=prettyprint)
+
+    def save(self, file):
+        """
+        Save the parsed traces, the generated lines and the elevation profiles in a NumPy .npz archive,
+        KMLHandler.load resumes from it without reading the kml nor fetching the altitudes again
+        :param file: path or binary file handle
+        """
+        records, record_coords = [], []
+        stack = [(self.inputKML, -1)]
+        while stack:
+            record, parent = stack.pop()
+            records.append({'kind': record.kind, 'id': record.id, 'name': record.name,
+                            'description': record.description, 'geom_type': record.geom_type, 'parent': parent})
+            record_coords.append(record.coords)
+            stack.extend((child, len(records) - 1) for child in reversed(record.children))
+
+        meta = {'version': STATE_VERSION, 'offset': self.offset, 'records': records,
+                'traces': self.info_df[['Trace', 'Type', 'Parent']].values.tolist()}
+        arrays = {}
+        arrays['record_coords'], arrays['record_counts'] = _pack(record_coords, 3)
+        arrays['trace_coords'], arrays['trace_counts'] = _pack(
+            [np.asarray(coords, dtype=float).reshape(-1, 3) for coords in self.info_df['Coordinates']], 3)
+        if 'Line' in self.info_df:
+            lines = list(self.info_df['Line'])
+            meta['lines'] = [{'type': line.type, 'start': list(line.start), 'stop': list(line.stop),
+                              'offset': line.offset, 'offset_max_dist': line.offset_max_dist,
+                              'offsets': list(line.offsets)} for line in lines]
+            for name in LINE_ARRAYS:
+                arrays['line_' + name], arrays['line_{0}_counts'.format(name)] = \
+                    _pack([getattr(line, name) for line in lines])
+            arrays['line_offsets'], arrays['line_offsets_counts'] = \
+                _pack([coords for line in lines for coords in line.offsets.values()], 3)
+        profiles = [self.profiles.get(i) for i in range(len(self.info_df))]
+        for name in PROFILE_ARRAYS:
+            arrays['profile_' + name], arrays['profile_{0}_counts'.format(name)] = \
+                _pack([None if profile is None else getattr(profile, name) for profile in profiles])
+        np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+
+    @classmethod
+    def load(cls, file, workers=1):
+        """
+        Handle saved by KMLHandler.save
+        :param file: path or binary file handle of the .npz archive
+        :param workers: number of processes computing the traces in parallel
+        :rtype: KMLHandler
+        """
+        with np.load(file, allow_pickle=False) as archive:
+            arrays = dict(archive)
+        meta = json.loads(str(arrays.pop('meta')))
+        if meta.get('version') != STATE_VERSION:
+            raise ValueError("Version de sauvegarde du KMLHandler non supportée : {0}".format(meta.get('version')))
+
+        handle = cls.__new__(cls)
+        kml.KML.__init__(handle)
+        handle.offset = meta['offset']
+        handle.workers = workers
+        handle._outputdf = handle._camelia = handle._spatial_index = None
+        handle.profiles = {}
+
+        records = []
+        for values, coords in zip(meta['records'], _unpack(arrays['record_coords'], arrays['record_counts'])):
+            parent = records[values['parent']] if values['parent'] >= 0 else None
+            record = KMLRecord(values['kind'], values['id'], parent=parent)
+            record.name, record.description = values['name'], values['description']
+            record.geom_type, record.coords = values['geom_type'], coords
+            if parent is not None:
+                parent.children.append(record)
+            records.append(record)
+        handle.inputKML = records[0]
+        handle.Documents = handle._set_documents()
+        handle.Folders = handle._set_folders(handle.Documents)
+        handle.Placemarks = handle._set_placemarks(handle.Folders if handle.Folders != None else handle.Documents)
+
+        info_df = pd.DataFrame(meta['traces'], columns=['Trace', 'Type', 'Parent'])
+        info_df.insert(1, 'Coordinates', [tuple(map(tuple, coords.tolist())) for coords in
+                                          _unpack(arrays['trace_coords'], arrays['trace_counts'])])
+        if 'lines' in meta:
+            columns = {name: _unpack(arrays['line_' + name], arrays['line_{0}_counts'.format(name)])
+                       for name in LINE_ARRAYS}
+            offsets = iter(_unpack(arrays['line_offsets'], arrays['line_offsets_counts']))
+            lines = []
+            for i, values in enumerate(meta['lines']):
+                line = Line.__new__(Line)
+                line.type, line.start, line.stop = values['type'], values['start'], values['stop']
+                line.offset, line.offset_max_dist = values['offset'], values['offset_max_dist']
+                for name in LINE_ARRAYS:
+                    setattr(line, name, columns[name][i])
+                line.offsets = {name: next(offsets) for name in values['offsets']}
+                lines.append(line)
+            info_df['Line'] = pd.Series(lines, index=info_df.index, dtype=object)
+            info_df['Outputs'] = [handle._output_coord(line) for line in lines]
+        handle.info_df = info_df
+
+        columns = [_unpack(arrays['profile_' + name], arrays['profile_{0}_counts'.format(name)])
+                   for name in PROFILE_ARRAYS]
+        for i, values in enumerate(zip(*columns)):
+            if values[0] is not None:
+                profile = ElevationProfile.__new__(ElevationProfile)
+                for name, value in zip(PROFILE_ARRAYS, values):
+                    setattr(profile, name, value)
+                handle.profiles[i] = profile
+        return handle
+
+    def generatePoles(self, incremental=False, placement=None, space=None):
+        """
+        Generate the poles of every trace
+        :param incremental: keep an elevation profile of every trace, sampled every ${resolution} meter the first time,
+        the altitudes of the poles are interpolated in it so changing the space between the poles fetches no altitude
+        :type incremental: bool
+        :param placement: constraints of the poles placed along the elevation profile of the traces instead of
+        equidistant poles, the profiles are kept as with incremental
+        :type placement: Placement.PolePlacement
+        :param space: space between the poles of every trace in meter, the space of the type of each trace when None
+        :type space: float or int
+        """
+        self._set_sections(incremental=incremental, placement=placement, space=space)
 
     def generateOffset(self, offset, max_dist):
         """
@@ -64,78 +282,129 @@ class KMLHandler(kml.KML):
         :return: kml content
         :rtype: str
         """
-        settings.space_by_type['offset'] = 1000000
         self._set_sections(offset, max_dist)
         self.offset = True
 
 
     def _get_outputdf(self):
         """
-        Generata an output dataframe ready to enter in kml
+        Generata an output dataframe ready to enter in kml, built once after the lines are generated
         :return: dataframe with every available info
         :rtype: pandas.DataFrame
         """
-        keys = self.info_df['Trace'].values.tolist()
-        frame = deepcopy([line.df for line in self.info_df['Line'].values.tolist()])
-        for i in range(len(frame)):
-            df = frame[i]
-            num = list(range(len(df)))
-            angle_gr = list(map(deg2grad,df['Angle Horizontal'].values))
-            df.insert(0,'Number', ['s' + '-'.join(x) + 'gr' for x in zip(map(str,num),map(str,map(int,angle_gr)))])
-            df.insert(1, 'Name', keys[i])
-        return pd.concat(frame, keys=keys, join='inner', ignore_index=True)
+        if self._outputdf is None:
+            keys = self.info_df['Trace'].values.tolist()
+            frame = [pd.DataFrame(self._output_columns(trace, line))
+                     for trace, line in zip(keys, self.info_df['Line'])]
+            self._outputdf = pd.concat(frame, keys=keys, join='inner', ignore_index=True)
+        return self._outputdf
 
     def _get_cameliadf(self):
-        return cameliaDF(self.outputdf)
+        if self._camelia is None:
+            self._camelia = cameliaDF(self.outputdf)
+        return self._camelia
+
+    def _get_spatial_index(self):
+        if self._spatial_index is None:
+            if 'Line' not in self.info_df:
+                raise ValueError("Les poteaux ne sont pas générés")
+            self._spatial_index = SpatialIndex(list(self.info_df['Line']), self.info_df['Trace'].tolist())
+        return self._spatial_index
+
+    def _invalidate_outputs(self):
+        self._outputdf = self._camelia = self._spatial_index = None
+
+    @staticmethod
+    def _output_columns(trace, line):
+        columns = {'Number': pole_numbers(line.hor_angle), 'Name': [trace] * len(line)}
+        columns.update(line.columns)
+        return columns
+
+    def write_outputs_csv(self, file):
+        """
+        Write outputdf as csv directly from the arrays of the lines
+        :param file: text file handle opened with newline=''
+        """
+        lines = [self._output_columns(trace, line) for trace, line in zip(self.info_df['Trace'], self.info_df['Line'])]
+        # seules les colonnes communes à toutes les lignes sont gardées, comme pour outputdf
+        names = [name for name in (lines[0] if lines else []) if all(name in columns for columns in lines[1:])]
+        writer = csv.writer(file, lineterminator=os.linesep)
+        writer.writerow([''] + names)
+        start = 0
+        for columns in lines:
+            nb_rows = len(columns['Number'])
+            writer.writerows(zip(map(str, range(start, start + nb_rows)),
+                                 *[_csv_values(columns[name]) for name in names]))
+            start += nb_rows
+
+    def write_camelia_csv(self, file):
+        """
+        Write camelia as csv directly from the arrays of the lines
+        :param file: text file handle opened with newline=''
+        """
+        writer = csv.writer(file, lineterminator=os.linesep)
+        writer.writerow([''] + CAMELIA_COLUMNS)
+        start = 0
+        for trace, line in zip(self.info_df['Trace'], self.info_df['Line']):
+            nb_rows = len(line)
+            empty_column = ['NaN'] * nb_rows
+            columns = {'Ligne': [trace] * nb_rows, 'Nom': pole_numbers(line.hor_angle),
+                       'Altitude (m)': _csv_values(line.alt),
+                       'Angle de piquetagegr': _csv_values(deg2grad(line.hor_angle)),
+                       'Longueur de portée(m)': _csv_values(line.dist_from_previous)}
+            writer.writerows(zip(map(str, range(start, start + nb_rows)),
+                                 *[columns.get(name, empty_column) for name in CAMELIA_COLUMNS]))
+            start += nb_rows
 
     def _set_documents(self):
         return list(self.inputKML.features())
 
     def _set_folders(self, upstream_features):
-        for feature in upstream_features:
-            if isinstance(list(feature.features())[0], Folder):
-                return list(feature.features())
-            else:
-                return None
+        folders = [feature for upstream in upstream_features for feature in upstream.features()
+                   if feature.kind == 'Folder']
+        return folders or None
 
     def _set_placemarks(self, upstream_features):
-        for feature in upstream_features:
-            if isinstance(list(feature.features())[0], Placemark):
-                return list(feature.features())
-            else:
-                return None
+        placemarks = [feature for upstream in upstream_features for feature in upstream.features()
+                      if feature.kind == 'Placemark']
+        return placemarks or None
 
     def _set_dataframe(self):
         pmname = []
         pmcoords = []
         pmdesc = []
-        for pm in self.Placemarks:
-            if pm.geometry.geom_type == 'LineString':
-                pmname1 = pm.name
-                pmcoords1 = self._flip_longlat(pm.geometry.coords)
+        for pm in self.Placemarks or []:
+            if pm.geom_type == 'LineString' and pm.coords is not None:
+                pmname.append(pm.name)
+                pmcoords.append(self._flip_longlat(pm.coords))
                 if pm.description == None:
-                    pmdesc1 = 'normal'
+                    pmdesc.append('normal')
                 else:
-                    pmdesc1 = pm.description
-            pmname.append(pmname1)
-            pmcoords.append(pmcoords1)
-            pmdesc.append(pmdesc1)
+                    pmdesc.append(pm.description)
 
-        info = {'Trace':pmname, 'Coordinates':pmcoords, 'Type':pmdesc}
+        info = {'Trace':pmname, 'Coordinates':pmcoords, 'Type':pmdesc, 'Parent':pmname}
         info_df = pd.DataFrame(info)
         self.info_df = info_df
 
 
-    def _set_sections(self, offset=None, offset_max_dist=None):
-        if 'custom' in settings.space_by_type.keys():
-            func = lambda trace: Line(trace['Coordinates'], typekey='custom')
-        elif 'offset' in settings.space_by_type.keys():
+    def _set_sections(self, offset=None, offset_max_dist=None, incremental=False, placement=None, space=None):
+        # les lignes parallèles d'une génération précédente sont retirées
+        self.info_df = self.info_df[self.info_df['Trace'] == self.info_df['Parent']].reset_index(drop=True)
+        if offset is not None:
             self.offset = True
-            func = lambda trace: Line(trace['Coordinates'], typekey='offset',
-                                      offset=offset, offset_max_dist=offset_max_dist)
+            traces = [(coords, 'offset', offset, offset_max_dist, offset_space)
+                      for coords in self.info_df['Coordinates']]
+        elif space is not None:
+            traces = [(coords, 'custom', None, None, space) for coords in self.info_df['Coordinates']]
+        else:
+            traces = [(coords, typekey, None, None, None)
+                      for coords, typekey in zip(self.info_df['Coordinates'], self.info_df['Type'])]
+        if placement is not None:
+            lines = self._place_lines(placement)
         else:
-            func = lambda trace: Line(trace['Coordinates'],typekey=trace['Type'])
-        self.info_df['Line'] = self.info_df.apply(func, axis=1)
+            lines = self._build_lines(traces, self._get_profiles() if incremental else None)
+        self.info_df['Line'] = pd.Series(lines, index=self.info_df.index, dtype=object)
+        self._invalidate_outputs()
 
         try:
             self._add_offset_to_df()
@@ -150,94 +419,175 @@ class KMLHandler(kml.KML):
             outputs_list.append(self._output_coord(current_line))
         self.info_df['Outputs'] = outputs_list
 
-    def _get_output_kml(self):
-        outputkml = kml.KML()
-        for doc in self.Documents:
-            id = doc.id
-            name = doc.name
-            desc = doc.description
-            outdoc = kml.Document(ns, id, name, desc)
-            outputkml.append(outdoc)
-
-            if isinstance(list(doc.features())[0], Placemark):
-                out_nsfolders = self._setPlacemark_for_KML(doc.features())
-                for out_nsfolder in out_nsfolders:
-                    outdoc.append(out_nsfolder)
-            else:
-                for folder in doc.features():
-                    id = folder.id
-                    name = folder.name
-                    desc = folder.description
-                    outfolder = kml.Folder(ns, id, name, desc)
-                    out_nsfolders = self._setPlacemark_for_KML(folder.features())
-                    for out_nsfolder in out_nsfolders:
-                        outfolder.append(out_nsfolder)
-                    outdoc.append(outfolder)
-
-        return outputkml
-
-    def _setPlacemark_for_KML(self,upstream_feature):
-        output_df = self.outputdf
-        out_nsfolders = []
+    def _get_trace_index(self):
+        """
+        Index the output by placemark, built once for the whole output
+        :return: for each placemark name, the (trace name, coordinates, pole numbers) of its trace and offset lines
+        :rtype: dict
+        """
+        index = {}
+        for parent, trace, coords, line in zip(self.info_df['Parent'], self.info_df['Trace'],
+                                               self.info_df['Outputs'], self.info_df['Line']):
+            index.setdefault(parent, []).append((trace, coords, pole_numbers(line.hor_angle)))
+        return index
+
+    def _write_placemarks(self, writer, upstream_feature, trace_index):
         for placemark in upstream_feature:
-            id = placemark.id
-            name = placemark.name
-            desc = placemark.description
-            # creating nested folder
-            out_nsfolder = kml.Folder(ns, id, name, desc)
-            # creating placemarks (points and LineString)
-            Lines = self.info_df[self.info_df['Trace'].str.contains(name)]['Outputs'].to_list()
-            line_names = self.info_df[self.info_df['Trace'].str.contains(name)]['Trace'].to_list()
-            outplacemarks = gen_placemark_from_Line(Lines,ns,line_names)
-            for pm in outplacemarks:
-                out_nsfolder.append(pm)
-
-            out_points_folder = kml.Folder(ns, id, name='Poteaux')
+            if placemark.kind != 'Placemark' or placemark.geom_type != 'LineString':
+                continue
+            writer.start_container('Folder', placemark.id, placemark.name, placemark.description)
+            traces = trace_index.get(placemark.name, [])
+            Lines = [coords for _, coords, _ in traces]
+            for name, coords, color, width in line_styles(Lines, [trace for trace, _, _ in traces]):
+                writer.write_linestring(name, coords, color=color, width=width)
+
             if not self.offset:
-                for Line in Lines:
-                    for point in Line:
-                        id = str(Line.index(point))
-                        point_name = output_df[output_df['Name'].str.contains(placemark.name)]['Number'].to_list()
-                        name = point_name[Line.index(point)]
-                        desc = 'Electric Pole'
-                        outpoint = kml.Placemark(ns, id, name, desc)
-                        outpoint.geometry = Point(point)
-                        out_points_folder.append(outpoint)
-                out_nsfolder.append(out_points_folder)
-            out_nsfolders.append(out_nsfolder)
-                
-        return out_nsfolders
-    
+                writer.start_container('Folder', placemark.id, 'Poteaux')
+                for _, Line, point_names in traces:
+                    writer.write_points(Line, map(str, range(len(Line))), point_names, 'Electric Pole')
+                writer.end_container()
+            writer.end_container()
+
     def _flip_longlat(self, coordTuple):
-        outList = []
-        for coord in coordTuple:
-            outList.append(tuple([coord[1],coord[0],coord[2]]))
-        return tuple(outList)
+        coords = np.asarray(coordTuple, dtype=float)
+        return tuple(map(tuple, coords[:, [1, 0, 2]].tolist()))
 
 
     def _output_coord(self, Line):
-        return Line.df[['long','lat','alt']].values.tolist()
+        return np.column_stack((Line.long, Line.lat, Line.alt)).tolist()
 
     def _add_offset_to_df(self):
+        rows, lines = [], []
         for index, row in self.info_df.iterrows():
-            offset_lines = row.Line.offset_lines
-            for line in offset_lines:
-                list_of_coords = offset_lines[line].to_list()
-                info = {'Trace': '_'.join([row.Trace, line]), 'Coordinates': [list_of_coords],
-                        'Type': 'offset', 'Line': Line(list_of_coords, typekey='offset',
-                                                       offset=None, offset_max_dist=None)}
-                info_os = pd.DataFrame(info)
-                self.info_df = self.info_df.append(info_os,ignore_index=True)
+            for name, coords in row.Line.offset_lines.items():
+                rows.append({'Trace': '_'.join([row.Trace, name]), 'Coordinates': coords.tolist(), 'Type': 'offset',
+                             'Parent': row.Parent})
+                lines.append(Line.from_vertices(coords))
+        self._set_altitudes(lines)
+        info_os = pd.DataFrame(rows, columns=['Trace', 'Coordinates', 'Type', 'Parent'])
+        info_os['Line'] = pd.Series(lines, index=info_os.index, dtype=object)
+        self.info_df = pd.concat([self.info_df, info_os], ignore_index=True)
+
+    def _build_lines(self, traces, profiles=None):
+        """
+        Build the Lines of independent traces, on a process pool when workers > 1
+        the altitudes of all the traces are then fetched in a single batch
+        :param traces: list of (list_of_coord, typekey, offset, offset_max_dist, space)
+        :param profiles: ElevationProfile of every trace to interpolate the altitudes in, None to fetch them all
+        :return: a Line for each trace
+        :rtype: list of Line
+        """
+        if not traces:
+            return []
+        if self.workers > 1 and len(traces) > 1:
+            workers = min(self.workers, len(traces))
+            with ProcessPoolExecutor(max_workers=workers, initializer=settings.init,
+                                     initargs=(settings.space_by_type,)) as pool:
+                lines = list(pool.map(_build_line, traces, chunksize=max(1, len(traces) // (4 * workers))))
+        else:
+            lines = [_build_line(trace) for trace in traces]
+        if profiles is None:
+            self._set_altitudes(lines)
+        else:
+            self._set_profile_altitudes(lines, profiles)
+        return lines
+
+    def _get_profiles(self):
+        """
+        ElevationProfile of every trace, the missing ones are sampled every ${resolution} meter
+        the altitudes of all the new profiles are fetched in a single batch
+        :rtype: list of ElevationProfile
+        """
+        new = {}
+        for i, coords in enumerate(self.info_df['Coordinates']):
+            if i not in self.profiles:
+                points, _, position = line_sub_coords(coords, space=resolution, positions=True)
+                new[i] = ElevationProfile(coords), points, position
+        if new:
+            alt = get_alt(np.concatenate([points[:, :2] for _, points, _ in new.values()]))
+            bounds = np.cumsum([len(points) for _, points, _ in new.values()])[:-1]
+            for (i, (profile, _, position)), profile_alt in zip(new.items(), np.split(np.asarray(alt), bounds)):
+                profile.add(profile.distances(position), profile_alt)
+                self.profiles[i] = profile
+        return [self.profiles[i] for i in range(len(self.info_df))]
+
+    def _place_lines(self, placement):
+        """
+        Place the poles of every trace among candidate points every placement.step meter, their altitudes are
+        interpolated in the elevation profiles of the traces
+        :type placement: Placement.PolePlacement
+        :return: a Line for each trace
+        :rtype: list of Line
+        """
+        profiles = self._get_profiles()
+        candidates = [Line.from_points(*line_sub_coords(coords, space=placement.step, positions=True), typekey=typekey)
+                      for coords, typekey in zip(self.info_df['Coordinates'], self.info_df['Type'])]
+        self._set_profile_altitudes(candidates, profiles)
+        lines = []
+        for candidate, profile in zip(candidates, profiles):
+            turn = (candidate.hor_angle + 180) % 360 - 180
+            forced = (candidate.descr != Descr.POLE) & (np.abs(turn) > placement.max_turn)
+            poles = placement.place(profile.distances(candidate.position), candidate.alt, forced)
+            line = Line.from_points(candidate.coords[poles], candidate.descr[poles], candidate.position[poles],
+                                    typekey=candidate.type)
+            line.set_altitudes(candidate.alt[poles])
+            lines.append(line)
+        return lines
+
+    @staticmethod
+    def _set_profile_altitudes(lines, profiles):
+        """
+        Interpolate the altitudes of the lines in the profiles of their traces, only the points out of the profiles
+        are fetched, in a single batch, and added to them
+        :type lines: list of Line
+        :type profiles: list of ElevationProfile
+        """
+        dists = [profile.distances(line.position) for line, profile in zip(lines, profiles)]
+        alts = [profile.interpolate(dist) for dist, profile in zip(dists, profiles)]
+        missing = [np.isnan(alt) for alt in alts]
+        if any(m.any() for m in missing):
+            fetched = get_alt(np.concatenate([line.coords[m, :2] for line, m in zip(lines, missing)]))
+            bounds = np.cumsum([m.sum() for m in missing])[:-1]
+            for dist, alt, m, profile, line_alt in zip(dists, alts, missing, profiles,
+                                                       np.split(np.asarray(fetched, dtype=float), bounds)):
+                alt[m] = line_alt
+                profile.add(dist[m], line_alt)
+        for line, alt in zip(lines, alts):
+            line.set_altitudes(alt)
+
+    @staticmethod
+    def _set_altitudes(lines):
+        """
+        Fetch the altitudes of all the lines in a single batch
+        :type lines: list of Line
+        """
+        if not lines:
+            return
+        alt = get_alt(np.concatenate([line.coords[:, :2] for line in lines]))
+        bounds = np.cumsum([len(line) for line in lines])[:-1]
+        for line, line_alt in zip(lines, np.split(np.asarray(alt), bounds)):
+            line.set_altitudes(line_alt)
 
     outputdf = property(_get_outputdf)
     camelia = property(_get_cameliadf)
+    spatial_index = property(_get_spatial_index)
+
+STATE_VERSION = 2
+# tableaux des Line et des ElevationProfile enregistrés par KMLHandler.save
+LINE_ARRAYS = ('lat', 'long', 'alt', 'descr', 'azimut', 'dist_from_origin', 'dist_from_previous', 'hor_angle',
+               'position')
+PROFILE_ARRAYS = ('lengths', 'dist', 'alt')
+
+CAMELIA_COLUMNS = ['Ligne', 'Type', 'Nom', 'Hauteur (m)', 'Altitude (m)', 'Angle de piquetagegr',
+                   'Orientation supportgr', 'Fonction', 'Branchements', 'Nature', 'Structure', 'Classe',
+                   'Ecart entre unifilaires (m)', 'Nature du sol', 'Coef. ks', 'Surimplantation (m)', 'Armement',
+                   'Orientation armementgr', "Décalage d'accrochage (m)", 'Isolateur', 'Équipement',
+                   'Longueur de portée(m)']
+
 
 class cameliaDF(pd.DataFrame):
     def __init__(self,line_df):
-        columns = ['Ligne', 'Type', 'Nom', 'Hauteur (m)', 'Altitude (m)', 'Angle de piquetagegr', 'Orientation supportgr',
-                   'Fonction', 'Branchements', 'Nature', 'Structure', 'Classe', 'Ecart entre unifilaires (m)',
-                   'Nature du sol', 'Coef. ks', 'Surimplantation (m)', 'Armement', 'Orientation armementgr',
-                   "Décalage d'accrochage (m)", 'Isolateur', 'Équipement', 'Longueur de portée(m)']
+        columns = CAMELIA_COLUMNS
         empty_column = ['NaN'] * len(line_df)
         ligne = [n for n in line_df.Name.to_list()]
         type = empty_column
@@ -268,10 +618,133 @@ class cameliaDF(pd.DataFrame):
 
 
 
+class Descr(IntEnum):
+    """
+    Descriptor codes of the points of a LineSection
+    """
+    START = 0
+    STOP = 1
+    POLE = 2
+    ALTITUDE_PROFILE = 3
+
+    @property
+    def label(self):
+        return DESCR_LABELS[self]
+
+
+DESCR_LABELS = np.array(['Start Point', 'Stop Point', 'Pole', 'Altitude Profile'], dtype=object)
+
+
+def line_sub_coords(vertices, typekey='normal', pole='y', space=None, positions=False):
+    """
+    Slice all the sections of a line in one call to get a coordinate every ${space} meter
+    the stop of a section is the start of the next one, it is kept only once
+    :param vertices: list of [lat, long, alt], rounded to 7 decimals
+    :param pole: 'y' if the inner points are poles, else they are only used for the altitude profile
+    :param space: distance between the points, the space of the typekey by default
+    :param positions: also return the position of every point along the line: index of its section + fraction of
+    the section
+    :return: (profile, descr) the [lat, long, alt] of the sliced line and the descriptor codes of its points,
+    and their positions if asked
+    :rtype: tuple of numpy.ndarray
+    """
+    vertices = np.round(np.asarray(vertices, dtype=float), 7)
+    space = settings.space_by_type[typekey] if space is None else space
+    points, counts = sub_coords(vertices[:-1], vertices[1:], space, unit='m')
+    segment = np.repeat(np.arange(len(counts)), counts)
+    stops = np.cumsum(counts) - 1
+    start, stop = points[stops - counts + 1][segment], points[stops][segment]
+    descr = np.full(len(points), Descr.POLE if pole == 'y' else Descr.ALTITUDE_PROFILE, dtype=np.int8)
+    descr[(points[:, 0] == stop[:, 0]) & (points[:, 1] == stop[:, 1])] = Descr.STOP
+    descr[(points[:, 0] == start[:, 0]) & (points[:, 1] == start[:, 1])] = Descr.START
+    keep = np.ones(len(points), dtype=bool)
+    keep[stops[:-1]] = False
+    if positions:
+        position = segment + (np.arange(len(points)) - (stops - counts + 1)[segment]) / (counts - 1)[segment]
+        return points[keep], descr[keep], position[keep]
+    return points[keep], descr[keep]
+
+
+def section_descr(profile, start, stop, pole='y'):
+    """
+    Descriptor codes of the sliced section
+    :param profile: array of [lat, long, ...] of the sliced section
+    :param start: first coordinate of the section
+    :param stop: last coordinate of the section
+    :param pole: 'y' if the inner points are poles, else they are only used for the altitude profile
+    :rtype: numpy.ndarray of int8
+    """
+    profile = np.asarray(profile, dtype=float)
+    descr = np.full(len(profile), Descr.POLE if pole == 'y' else Descr.ALTITUDE_PROFILE, dtype=np.int8)
+    descr[(profile[:, 0] == stop[0]) & (profile[:, 1] == stop[1])] = Descr.STOP
+    descr[(profile[:, 0] == start[0]) & (profile[:, 1] == start[1])] = Descr.START
+    return descr
+
+
+class ElevationProfile:
+    __slots__ = ('lengths', 'dist', 'alt')
+
+    def __init__(self, vertices):
+        """
+        Altitudes already known along a trace, by distance from its first vertex
+        the altitudes of new poles are interpolated between them instead of being fetched again
+        :param vertices: list of (lat, long, ...) of the trace
+        """
+        vertices = np.round(np.asarray(vertices, dtype=float)[:, :2], 7)
+        self.lengths, _ = geodesic_inverse(vertices[:-1, 0], vertices[:-1, 1], vertices[1:, 0], vertices[1:, 1])
+        self.dist, self.alt = np.empty(0), np.empty(0)
+
+    def __len__(self):
+        return len(self.dist)
+
+    def distances(self, position):
+        """
+        :param position: index of the section + fraction of the section of points of the trace
+        :return: distance of the points from the first vertex along the trace in meter
+        :rtype: numpy.ndarray
+        """
+        position = np.asarray(position, dtype=float)
+        if len(self.lengths) == 0:
+            return np.zeros(len(position))
+        section = np.clip(np.floor(position).astype(int), 0, len(self.lengths) - 1)
+        origin = np.concatenate(([0.], np.cumsum(self.lengths)))
+        return origin[section] + (position - section) * self.lengths[section]
+
+    def interpolate(self, dist, resolution=resolution):
+        """
+        :param dist: distances from the first vertex in meter
+        :param resolution: maximum distance between two known altitudes to interpolate between them
+        :return: the altitudes, nan where they are not known
+        :rtype: numpy.ndarray
+        """
+        dist = np.asarray(dist, dtype=float)
+        alt = np.full(len(dist), np.nan)
+        if len(self.dist) == 0:
+            return alt
+        right = np.minimum(np.searchsorted(self.dist, dist), len(self.dist) - 1)
+        left = np.maximum(right - 1, 0)
+        known = np.isclose(self.dist[right], dist, rtol=0, atol=1e-6) | \
+            np.isclose(self.dist[left], dist, rtol=0, atol=1e-6) | \
+            ((self.dist[left] <= dist) & (dist <= self.dist[right]) & (self.dist[right] - self.dist[left] <= resolution))
+        alt[known] = np.interp(dist[known], self.dist, self.alt)
+        return alt
+
+    def add(self, dist, alt):
+        """
+        Keep new altitudes of the trace
+        """
+        dist, index = np.unique(np.concatenate((np.asarray(dist, dtype=float), self.dist)), return_index=True)
+        self.alt = np.concatenate((np.asarray(alt, dtype=float), self.alt))[index]
+        self.dist = dist
+
+
 class LineSection:
-    def __init__(self, coord1, coord2, typekey='normal', offset=None, offset_max_dist=None):
+    __slots__ = ('start', 'stop', 'type', 'lat', 'long', 'alt', 'descr', 'azimut', 'offsets')
+
+    def __init__(self, coord1, coord2, typekey='normal', offset=None, offset_max_dist=None, alt_profile=None):
         """
         Object that represent a section of LineString between two coordinates
+        the points are stored in contiguous arrays, the DataFrame is only built when .df is requested
         :param coord1: (lat, long)
         :type coord1: tuple or list
         :param coord2: tuple or list:(lat, long)
@@ -282,14 +755,18 @@ class LineSection:
         :type offset: float
         :param offset_max_dist: maximum distance of the offset option, allow to know the number of LineSection copies
         :type offset_max_dist: float
+        :param alt_profile: the sliced section with its altitudes when it was already fetched by the parent Line
+        :type alt_profile: list of [lat, long, alt]
         """
         self.start, self.stop, self.type = list(map(round,coord1, repeat(7))),\
                                            list(map(round,coord2, repeat(7))), typekey
+        self.azimut = None
+        self.offsets = {}
         if offset != None:
-            self.df = pd.DataFrame(self._get_alt_profile(pole='n'), columns=['lat', 'long', 'alt', 'descr'])
+            self._get_alt_profile(pole='n', alt_profile=alt_profile)
             self.addOffset(offset, offset_max_dist)
         else:
-            self.df = pd.DataFrame(self._get_alt_profile(pole='y'), columns=['lat', 'long', 'alt', 'descr'])
+            self._get_alt_profile(pole='y', alt_profile=alt_profile)
             self._set_prev_azi_angles()
 
     def __get__(self, instance, owner):
@@ -301,55 +778,87 @@ class LineSection:
         else:
             return self.df[self.df.index == item]
 
-    def _get_alt_profile(self, pole='n'):
+    def __len__(self):
+        return len(self.lat)
+
+    def _get_columns(self):
+        """
+        :return: the columns of the DataFrame by name
+        :rtype: dict
+        """
+        columns = {'lat': self.lat, 'long': self.long, 'alt': self.alt, 'descr': DESCR_LABELS[self.descr]}
+        for name, coords in self.offsets.items():
+            # les parallèles n'ont que les sommets, elles ne sont ajoutées que si la section n'est pas découpée
+            if len(coords) == len(self):
+                columns[name] = coords.tolist()
+        columns.update(self._get_extra_columns())
+        return columns
+
+    def _get_dataframe(self):
+        """
+        Materialize the arrays as a pandas DataFrame
+        :rtype: pandas.DataFrame
+        """
+        return pd.DataFrame(self._get_columns())
+
+    def _get_extra_columns(self):
+        return {} if self.azimut is None else {'Azimut Angle': self.azimut}
+
+    def _get_coords(self):
+        return np.column_stack((self.lat, self.long, self.alt))
+
+    def _set_coords(self, coords, descr):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        self.lat, self.long, self.alt = coords[:, 0].copy(), coords[:, 1].copy(), coords[:, 2].copy()
+        self.descr = np.asarray(descr, dtype=np.int8)
+
+    def _get_alt_profile(self, pole='n', alt_profile=None):
         "Slice the section to get elevation every ${space} meter"
-        dist_evaluated, *_ = get_dist(list(self.start), list(self.stop))
-        listCoord = sub_dist(self.start, self.stop, settings.space_by_type[self.type], unit='m')
-        alt = get_alt([coord[:-1] for coord in listCoord])
-        for i in range(len(alt)):
-            listCoord[i][-1] = alt[i]
-            if listCoord[i][:-1] == self.start[:-1]:
-                listCoord[i].append('Start Point')
-            elif listCoord[i][:-1] == self.stop[:-1]:
-                listCoord[i].append('Stop Point')
-            else:
-                if pole == 'y':
-                    listCoord[i].append('Pole')
-                else:
-                    listCoord[i].append('Altitude Profile')
-        return listCoord
+        if alt_profile is None:
+            listCoord, descr = line_sub_coords([self.start, self.stop], self.type, pole=pole)
+            listCoord[:, 2] = get_alt(listCoord[:, :2])
+        else:
+            listCoord = alt_profile
+            descr = section_descr(listCoord, self.start, self.stop, pole=pole)
+        self._set_coords(listCoord, descr)
+        return self.coords
 
     def _get_pole_points(self):
-        return self.df[self.df.descr == 'pole']
+        return self.df[self.descr == Descr.POLE]
 
     def _get_total_dist(self, list_of_coordAlt=None):
-        tot_dist = 0
-        if list_of_coordAlt == None:
-            list_of_coordAlt = self._get_list_of_coord()
-
-        for i in range(len(list_of_coordAlt)-1):
-            tot_dist += get_dist(list_of_coordAlt[i], list_of_coordAlt[i+1])[0]
-        return tot_dist
+        if list_of_coordAlt is None:
+            list_of_coordAlt = self.coords
+        if len(list_of_coordAlt) < 2:
+            return 0
+        dist, _ = get_dists(list_of_coordAlt)
+        return dist.sum()
 
     def _get_list_of_coord(self):
-        return self.df[['lat','long','alt']].values.tolist()
+        return self.coords.tolist()
+
+    def index_of(self, coord):
+        """
+        :return: index of the first point at the coordinate (lat, long)
+        """
+        return int(np.flatnonzero((self.lat == coord[0]) & (self.long == coord[1]))[0])
 
     def distance_from_origine(self, coord):
         """
         :return the distance from the first point
         """
-        index = self.df.loc[(self.df['lat'] == coord[0]) & (self.df['long'] == coord[1])].index.values[0]
-        listCoordAlt = self.df[self.df.index <= index][['lat','long','alt']].values.tolist()
-        return self._get_total_dist(listCoordAlt)
+        index = self.index_of(coord)
+        return self._get_total_dist(self.coords[:index + 1])
 
 
     def closest_coords(self, coord):
-        """:return closest coordinates index"""
-        list_of_coord = self.df[['lat','long']].values.tolist()
-        tree = spatial.KDTree(list_of_coord)
-        _, index = tree.query([[coord]])
-
-        return index[0][0]
+        """
+        :param coord: (lat, long)
+        :return closest coordinates index
+        for many queries over many lines use KMLHandler.spatial_index
+        """
+        x, y = get_local_xy(np.column_stack((self.lat, self.long)), coord).T
+        return int(np.argmin(np.hypot(x, y)))
 
     def insert_row(self, row_value, index):
         """
@@ -357,67 +866,57 @@ class LineSection:
         :param row_value: list of value to insert as: ['lat', 'long', 'alt', 'descr']
         :param index: index where the row will be inserted
         """
-        row = pd.DataFrame(row_value, columns=['lat', 'long', 'alt', 'descr'])
-        self.df = pd.concat([self.df.iloc[:index], row, self.df.iloc[index:]]).reset_index(drop=True)
+        rows = np.atleast_2d(np.array(row_value, dtype=object))
+        codes = [list(DESCR_LABELS).index(d) if isinstance(d, str) else d for d in rows[:, 3]]
+        self.lat = np.insert(self.lat, index, rows[:, 0].astype(float))
+        self.long = np.insert(self.long, index, rows[:, 1].astype(float))
+        self.alt = np.insert(self.alt, index, rows[:, 2].astype(float))
+        self.descr = np.insert(self.descr, index, codes).astype(np.int8)
+        if self.azimut is not None:
+            self._set_prev_azi_angles()
 
     def _set_prev_azi_angles(self):
-        angleList = [0]
-        for index, row in self.df.iterrows():
-            if index != 0:
-                coord1 = self[index][['lat', 'long', 'alt']].values.tolist()[0]
-                coord2 = self[index -1][['lat', 'long', 'alt']].values.tolist()[0]
-                _, angle = get_dist(coord1, coord2)
-                angleList.append(angle)
-        self.df['Azimut Angle'] = angleList
+        _, angles = get_dists(self.coords)
+        self.azimut = np.concatenate(([0.], angles))
 
     def dist_from_prev(self, index):
         if index == 0:
             return 0
         else:
-            return (self[index]['dist_from_origin'].values - self[index-1]['dist_from_origin'].values)[0]
+            return self._get_total_dist(self.coords[index - 1:index + 1])
 
-    def addOffset(self, offset, max_dist):
+    @staticmethod
+    def _get_offsets(vertices, offset, max_dist):
+        """
+        Parallels of the vertices every offset on both side, computed at once with mitered joins
+        :param vertices: list of (lat, long, alt)
+        :return: {name: array of (lat, long, alt)} e.g: {'offset_l_2m': [...], 'offset_r_2m': [...]}
+        :rtype: dict
+        """
         nb_line = int(max_dist // offset)
-        start_offset_r, start_offset_l = [], []
-        stop_offset_r, stop_offset_l = [], []
-        coord1, coord2 = list(self.start), list(self.stop)
-        _, _, theta = xy_dist(coord1, coord2)
-        phi = -math.pi/2 + theta
-        dist = offset
-        x_offsets = []
-        y_offsets = []
-        while dist <= max_dist:
-            if (math.degrees(theta) > (-180) and math.degrees(theta)) < 0 or\
-                    (math.degrees(theta) > (180) and math.degrees(theta) < 360):
-                x_offsets.append(-dist * math.sin(phi))
-                y_offsets.append(-dist * math.cos(phi))
-            else:
-                x_offsets.append(dist * math.sin(phi))
-                y_offsets.append(dist * math.cos(phi))
-            dist += offset
-        for i in range(nb_line):
-            start_offset_r.append(addToCoord(coord1, x_offsets[i], y_offsets[i]))
-            start_offset_l.append(addToCoord(coord1, -x_offsets[i], -y_offsets[i]))
-            stop_offset_r.append(addToCoord(coord2, x_offsets[i], y_offsets[i]))
-            stop_offset_l.append(addToCoord(coord2, -x_offsets[i], -y_offsets[i]))
-        for i in range(nb_line):
-            self.df['offset_l_%im' % int((1+i)*offset)] = [start_offset_l[i], stop_offset_l[i]]
-            self.df['offset_r_%im' % int((1+i)*offset)] = [start_offset_r[i], stop_offset_r[i]]
+        distances = np.repeat(np.arange(1, nb_line + 1) * offset, 2) * np.tile([1, -1], nb_line)
+        parallels = get_parallel_lines(np.asarray(vertices, dtype=float)[:, :3], distances)
+        names = ['offset_%s_%im' % (side, int(abs(dist))) for dist, side in zip(distances, ['l', 'r'] * nb_line)]
+        return dict(zip(names, parallels))
+
+    def addOffset(self, offset, max_dist):
+        self.offsets = self._get_offsets([self.start, self.stop], offset, max_dist)
 
     def _get_offset_line(self):
         """
-        Return a list of Line object representing the offset original Line
-        :return: list of Line object
-        :rtype: lisf of Line
+        Return the parallels of the line
+        :return: {name: array of (lat, long, alt)}
+        :rtype: dict
         """
-        columns = [col for col in self.df if col.startswith('offset_')]
-        offset_lines = []
-        if columns:
-            return self.df[columns]
+        if self.offsets:
+            return self.offsets
         else:
             print('No offsets available')
             raise IndexError
 
+    df = property(_get_dataframe)
+    columns = property(_get_columns)
+    coords = property(_get_coords)
     list_of_coord = property(_get_list_of_coord)
     pole_points = property(_get_pole_points)
     total_dist = property(_get_total_dist)
@@ -425,7 +924,9 @@ class LineSection:
 
 
 class Line(LineSection):
-    def __init__(self, list_of_coord, typekey='normal', offset=None, offset_max_dist=None):
+    __slots__ = ('offset', 'offset_max_dist', 'dist_from_origin', 'dist_from_previous', 'hor_angle', 'position')
+
+    def __init__(self, list_of_coord, typekey='normal', offset=None, offset_max_dist=None, fetch_alt=True, space=None):
         """
         Complete line composed of linesecions
         :param list_of_coord: [(lat1, long1), (lat2, long2), ...]
@@ -436,36 +937,105 @@ class Line(LineSection):
         :type offset: float
         :param offset_max_dist: maximum distance of the offset option, allow to know the number of LineSection copies
         :type offset_max_dist: float
+        :param fetch_alt: if False, the altitudes and distances are only set by set_altitudes, this allows to fetch
+        the altitudes of many lines at once
+        :type fetch_alt: bool
+        :param space: space between the poles in meter, the space of the typekey when None
+        :type space: float
         """
 
         self.start, self.stop = list_of_coord[0], list_of_coord[-1]
         self.offset, self.offset_max_dist = offset, offset_max_dist
-        if typekey in settings.space_by_type.keys():
+        if typekey in settings.space_by_type.keys() or space is not None:
             self.type = typekey
         else:
             self.type = 'normal'
+        self.offsets = {}
+        self.azimut = self.dist_from_origin = self.dist_from_previous = None
 
-        self.df = self._set_dataframe(list_of_coord)
-        func = lambda row: self.distance_from_origine([row.lat, row.long, row.alt])
-        self.df['dist_from_origin'] = self.df.apply(func,axis=1)
-        self.df['dist_from_prev'] = list(map(self.dist_from_prev, range(len(self.df))))
-        self._set_prev_azi_angles()
+        self._set_profile(list_of_coord, space)
         self._set_prev_hor_angles()
+        if fetch_alt:
+            self.set_altitudes(get_alt(self.coords[:, :2]))
+
+    def set_altitudes(self, alt):
+        """
+        Set the altitude of every point and compute the distances and slopes
+        :param alt: altitudes in meter
+        :type alt: list or numpy.ndarray
+        """
+        self.alt = np.asarray(alt, dtype=float)
+        self._set_distances()
 
-    def _set_dataframe(self, list_of_coord):
-        ls_list = []
-        for i in range(1, len(list_of_coord), 1):
-            ls = LineSection(list_of_coord[i-1], list_of_coord[i],typekey=self.type,
-                             offset=self.offset, offset_max_dist=self.offset_max_dist)
-            if i == len(list_of_coord)-1: #si c'est le dernier de la liste, on ajout la dernière coordonnée
-                ls_list.append(ls[:])
-            else:
-                ls_list.append(ls[:-1])
-        return pd.concat(ls_list, ignore_index=True, sort=False)
+    def _get_extra_columns(self):
+        return {'Azimut Angle': self.azimut, 'dist_from_origin': self.dist_from_origin,
+                'dist_from_prev': self.dist_from_previous, 'Angle Horizontal': self.hor_angle}
+
+    def _set_distances(self):
+        """
+        Compute every segment once, the distances from the origin are their cumulative sum
+        """
+        dist, angles = get_dists(self.coords)
+        self.dist_from_origin = np.concatenate(([0.], np.cumsum(dist))).round(3)
+        self.dist_from_previous = np.concatenate(([0.], dist))
+        self.azimut = np.concatenate(([0.], angles))
+
+    def _set_profile(self, list_of_coord, space=None):
+        pole = 'n' if self.offset is not None else 'y'
+        profile, descr, self.position = line_sub_coords(list_of_coord, self.type, pole=pole, space=space,
+                                                        positions=True)
+        self._set_coords(profile, descr)
+        if self.offset is not None:
+            vertices = np.zeros((len(list_of_coord), 3))
+            vertices[:, :2] = np.round(np.asarray(list_of_coord, dtype=float)[:, :2], 7)
+            self.offsets = self._get_offsets(vertices, self.offset, self.offset_max_dist)
+
+    @classmethod
+    def from_vertices(cls, vertices, typekey='offset'):
+        """
+        Line whose poles are its vertices, the sections are not sliced
+        the altitudes and distances are only set by set_altitudes
+        :param vertices: array of (lat, long, ...)
+        :rtype: Line
+        """
+        descr = np.full(len(vertices), Descr.START, dtype=np.int8)
+        descr[-1] = Descr.STOP
+        return cls.from_points(vertices, descr, np.arange(len(vertices), dtype=float), typekey)
+
+    @classmethod
+    def from_points(cls, points, descr, position, typekey='normal'):
+        """
+        Line whose poles are already chosen
+        the altitudes and distances are only set by set_altitudes
+        :param points: array of (lat, long, ...)
+        :param descr: descriptor codes of the points
+        :param position: position of the points along the trace (index of the section + fraction of the section)
+        :rtype: Line
+        """
+        line = cls.__new__(cls)
+        coords = np.zeros((len(points), 3))
+        coords[:, :2] = np.round(np.asarray(points, dtype=float)[:, :2], 7)
+        line.start, line.stop = coords[0].tolist(), coords[-1].tolist()
+        line.offset = line.offset_max_dist = None
+        # 'custom' et 'offset' n'ont pas d'espacement dans settings, il est donné à la génération
+        known = typekey in settings.space_by_type.keys() or typekey in ('custom', 'offset')
+        line.type = typekey if known else 'normal'
+        line.offsets = {}
+        line.azimut = line.dist_from_origin = line.dist_from_previous = None
+        line._set_coords(coords, descr)
+        line.position = np.asarray(position, dtype=float)
+        line._set_prev_hor_angles()
+        return line
 
     def _set_prev_hor_angles(self):
-        angle_list = [0]
-        for i in range(1, len(self.list_of_coord)-1, 1):
-            angle_list.append(get_angle(self.list_of_coord[i-1], self.list_of_coord[i], self.list_of_coord[i+1]))
-        angle_list.append(0)
-        self.df['Angle Horizontal'] = angle_list
\ No newline at end of file
+        angles = get_angles(self.coords[:, :2])
+        self.hor_angle = np.concatenate(([0.], angles, [0.]))
+
+    def dist_from_prev(self, index):
+        return self.dist_from_previous[index]
+
+    def distance_from_origine(self, coord):
+        """
+        :return the distance from the first point
+        """
+        return self.dist_from_origin[self.index_of(coord)]
@@ -1,11 +1,127 @@
 # -*- coding: utf-8 -*-
-from fastkml import kml, Document, Folder, Placemark, styles
-from shapely.geometry import Point, LineString, Polygon
+from fastkml import kml, Document, Folder, Placemark
+from shapely.geometry import Point, Polygon
+from lxml import etree
+import numpy as np
 import pandas as pd
+import io
 import random
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
 from colour import Color
 
 ns = '{http://www.opengis.net/kml/2.2}'
+FEATURE_TAGS = ('Document', 'Folder', 'Placemark')
+GEOMETRY_TAGS = ('Point', 'LineString', 'LinearRing', 'Polygon', 'MultiGeometry', 'Model', 'Track')
+
+
+class KMLRecord:
+    __slots__ = ('kind', 'id', 'name', 'description', 'parent', 'children', 'geom_type', 'coords')
+
+    def __init__(self, kind, id=None, parent=None):
+        """
+        Lightweight Document, Folder or Placemark read from a KML stream
+        :param kind: 'kml', 'Document', 'Folder' or 'Placemark'
+        :param id: id attribute of the element
+        :param parent: record of the enclosing Document or Folder
+        :property geom_type: type of the geometry of a Placemark e.g: 'LineString', 'Point'
+        :property coords: the LineString coordinates as a numpy array of (long, lat, alt)
+        """
+        self.kind, self.id, self.parent = kind, id, parent
+        self.name = self.description = self.geom_type = self.coords = None
+        self.children = []
+
+    def __repr__(self):
+        return '<KMLRecord {0} {1!r}>'.format(self.kind, self.name)
+
+    def features(self):
+        return iter(self.children)
+
+
+def parse_coordinates(text):
+    """
+    Parse the content of a <coordinates> element
+    :param text: 'long,lat[,alt] long,lat[,alt] ...'
+    :return: array of (long, lat, alt), the altitude is 0 when absent
+    :rtype: numpy.ndarray of shape (N, 3)
+    """
+    tuples = text.split()
+    if not tuples:
+        return np.empty((0, 3))
+    values = np.array(' '.join(tuples).replace(',', ' ').split(), dtype=float).reshape(len(tuples), -1)
+    if values.shape[1] == 2:
+        values = np.column_stack((values, np.zeros(len(values))))
+    return values[:, :3]
+
+
+def _open_kml_stream(kml_file):
+    """
+    :return: a binary stream of the KML, the main .kml of the archive for a KMZ
+    """
+    if zipfile.is_zipfile(kml_file):
+        archive = zipfile.ZipFile(kml_file)
+        names = [name for name in archive.namelist() if name.lower().endswith('.kml')]
+        if not names:
+            raise ValueError("L'archive KMZ ne contient pas de fichier .kml")
+        return archive.open('doc.kml' if 'doc.kml' in names else names[0])
+    return open(kml_file, 'rb')
+
+
+def iterparse_kml(kml_file):
+    """
+    Stream the Documents, Folders and Placemarks of a KML or KMZ file with bounded memory
+    every record is yielded when its element ends (the children before their parent) and the parsed
+    elements are cleared as it goes, so no tree of the file is ever kept in memory
+    :param kml_file: path of a .kml or .kmz file
+    :return: generator of KMLRecord
+    """
+    root = KMLRecord('kml')
+    stack = [root]
+    with _open_kml_stream(kml_file) as stream:
+        context = etree.iterparse(stream, events=('start', 'end'), huge_tree=True, recover=True)
+        for event, el in context:
+            if not isinstance(el.tag, str):
+                continue
+            tag = etree.QName(el).localname
+            if event == 'start':
+                if tag in FEATURE_TAGS:
+                    record = KMLRecord(tag, el.get('id'), parent=stack[-1])
+                    stack[-1].children.append(record)
+                    stack.append(record)
+                elif tag in GEOMETRY_TAGS and stack[-1].kind == 'Placemark' and stack[-1].geom_type is None:
+                    stack[-1].geom_type = tag
+                continue
+
+            parent = el.getparent()
+            parent_tag = etree.QName(parent).localname if parent is not None else None
+            if tag in ('name', 'description') and parent_tag in FEATURE_TAGS:
+                setattr(stack[-1], tag, el.text)
+            elif tag == 'coordinates' and parent_tag == 'LineString' and stack[-1].kind == 'Placemark' \
+                    and stack[-1].coords is None:
+                stack[-1].coords = parse_coordinates(el.text or '')
+            elif tag in FEATURE_TAGS:
+                yield stack.pop()
+
+            if tag in FEATURE_TAGS or parent_tag in FEATURE_TAGS:
+                # on libère les éléments déjà traités
+                el.clear()
+                while el.getprevious() is not None:
+                    del parent[0]
+
+
+def read_kml(kml_file):
+    """
+    Read the structure of a KML or KMZ file without building its XML tree
+    :param kml_file: path of a .kml or .kmz file
+    :return: the root record, its features are the Documents
+    :rtype: KMLRecord
+    """
+    root = None
+    for record in iterparse_kml(kml_file):
+        while record.parent is not None:
+            record = record.parent
+        root = record
+    return root if root is not None else KMLRecord('kml')
 
 def openKML(kml_file):
     validate_kml_format(kml_file)
@@ -29,19 +145,17 @@ def validate_kml_format(kml_file):
             file.close()
 
 
-def gen_placemark_from_Line(coords, ns, names):
+def line_styles(coords, names):
     """
-    create a placemark object for kml
+    Give the style of the base line and of the optional offsets lines, the offsets lines come first by pair (l, r)
     :param coords: list of the base line and optionaly the offsets lines
     :type coords: list of coordinates
-    :param ns: ns of kml version
-    :type ns: str
-    :param name: list of line names
-    :type name: list of str
-    :return: list of placemark object
-    :rtype: list of placemark
+    :param names: list of line names
+    :type names: list of str
+    :return: list of (name, coordinates, color, width)
+    :rtype: list of tuple
     """
-    outplacemarks = []
+    styled = []
     name_l = [name for name in names if 'offset_l' in name]
     name_r = [name for name in names if 'offset_r' in name]
     name_b = [name for name in names if 'offset_r' not in name and 'offset_l' not in name]
@@ -51,21 +165,107 @@ def gen_placemark_from_Line(coords, ns, names):
     coords_b = [coords[names.index(name)] for name in names if 'offset_r' not in name and 'offset_l' not in name]
     colors = color_range_gen(dim+1)
     for i in range(dim):
-        ls = styles.LineStyle(ns=ns, id=None, color=colors[i+1], width=1.5)
-        s1 = styles.Style(styles=[ls])
-        outplacemark_l = kml.Placemark(ns, None, name_l[i], None, styles=[s1])
-        outplacemark_r = kml.Placemark(ns, None, name_r[i], None, styles=[s1])
-        outplacemark_l.geometry = LineString(coords_l[i])
-        outplacemark_r.geometry = LineString(coords_r[i])
-        outplacemarks.append(outplacemark_l)
-        outplacemarks.append(outplacemark_r)
-    ls = styles.LineStyle(ns=ns, id=None, color=colors[0], width=3)
-    s1 = styles.Style(styles=[ls])
-    outplacemark = kml.Placemark(ns, None, name_b[0], None, styles=[s1])
-    outplacemark.geometry = LineString(coords_b[0])
-    outplacemarks.append(outplacemark)
-
-    return outplacemarks
+        styled.append((name_l[i], coords_l[i], colors[i+1], 1.5))
+        styled.append((name_r[i], coords_r[i], colors[i+1], 1.5))
+    styled.append((name_b[0], coords_b[0], colors[0], 3))
+    return styled
+
+
+class KMLWriter:
+    def __init__(self, file, prettyprint=True):
+        """
+        Write a KML incrementally to a file handle, nothing but the current placemark is kept in memory
+        use it as a context manager, the header and the closing tags are written on enter and exit
+        :param file: text or binary file handle (e.g: an entry of a zipfile.ZipFile opened in 'w' mode)
+        :param prettyprint: indent the elements
+        :type prettyprint: bool
+        """
+        self.file = file
+        self._binary = not isinstance(file, io.TextIOBase)
+        self._indent = '  ' if prettyprint else ''
+        self._newline = '\n' if prettyprint else ''
+        self._open = []
+
+    def __enter__(self):
+        self._write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self._open_tag('<kml xmlns="http://www.opengis.net/kml/2.2">', 'kml')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        while self._open:
+            self.end_container()
+
+    def _write(self, text):
+        self.file.write(text.encode('utf-8') if self._binary else text)
+
+    def _lines(self, lines, depth=None):
+        depth = len(self._open) if depth is None else depth
+        self._write(''.join(self._indent * (depth + d) + line + self._newline for d, line in lines))
+
+    def _open_tag(self, line, tag):
+        self._lines([(0, line)])
+        self._open.append(tag)
+
+    @staticmethod
+    def _feature_header(name, description):
+        lines = [(1, '<name>{0}</name>'.format(escape(name)))] if name is not None else []
+        if description is not None:
+            lines.append((1, '<description>{0}</description>'.format(escape(description))))
+        lines.append((1, '<visibility>1</visibility>'))
+        return lines
+
+    @staticmethod
+    def _start_tag(tag, id):
+        return '<{0}>'.format(tag) if id is None else '<{0} id={1}>'.format(tag, quoteattr(str(id)))
+
+    @staticmethod
+    def _coordinates(coords):
+        return ' '.join('{0:.7f},{1:.7f},{2:f}'.format(*coord) for coord in coords)
+
+    def start_container(self, kind, id=None, name=None, description=None):
+        """
+        Open a Document or a Folder
+        :param kind: 'Document' or 'Folder'
+        """
+        self._open_tag(self._start_tag(kind, id), kind)
+        self._lines(self._feature_header(name, description), depth=len(self._open) - 1)
+
+    def end_container(self):
+        tag = self._open.pop()
+        self._lines([(0, '</{0}>'.format(tag))])
+
+    def write_linestring(self, name, coords, color=None, width=None, id=None, description=None):
+        """
+        Write a LineString placemark
+        :param coords: list of (long, lat, alt)
+        :param color: kml color of the line e.g: 'ff0000ff'
+        :param width: width of the line
+        """
+        lines = [(0, self._start_tag('Placemark', id))] + self._feature_header(name, description)
+        if color is not None or width is not None:
+            lines += [(1, '<Style>'), (2, '<LineStyle>')]
+            if color is not None:
+                lines.append((3, '<color>{0}</color>'.format(color)))
+            if width is not None:
+                lines.append((3, '<width>{0}</width>'.format(width)))
+            lines += [(2, '</LineStyle>'), (1, '</Style>')]
+        lines += [(1, '<LineString>'), (2, '<coordinates>{0}</coordinates>'.format(self._coordinates(coords))),
+                  (1, '</LineString>'), (0, '</Placemark>')]
+        self._lines(lines)
+
+    def write_points(self, coords, ids, names, description=None):
+        """
+        Write a Point placemark for every coordinate
+        :param coords: list of (long, lat, alt)
+        :param ids: id of every placemark
+        :param names: name of every placemark
+        :param description: description shared by all the placemarks
+        """
+        for coord, id, name in zip(coords, ids, names):
+            lines = [(0, self._start_tag('Placemark', id))] + self._feature_header(name, description)
+            lines += [(1, '<Point>'), (2, '<coordinates>{0}</coordinates>'.format(self._coordinates([coord]))),
+                      (1, '</Point>'), (0, '</Placemark>')]
+            self._lines(lines)
 
 
 def random_color_gen():
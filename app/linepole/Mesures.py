@@ -1,55 +1,233 @@
 # -*- coding: utf-8 -*-
 import math
-import subprocess
-from itertools import repeat
-from geopy import distance
-from shapely.geometry import LineString, MultiPoint
+import numpy as np
+from .Elevation import AltitudeRetrievingError, get_provider
+from .Projection import TransverseMercator, WGS84_A, WGS84_F, WGS84_B
 
 r_earth = 6371.009
 
 
-class AltitudeRetrievingError(Exception):
-    def __init__(self, err, list):
-        self.err = err
-        self.list = list
-        self.message = ("Error while getting elevation :", err, '\n arguments : {0}'.format(list))
-
 def chunks(lst, n):
     """Yield successive n-sized chunks from lst."""
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
-def get_elevation(coordList):
-    coordList = [list(i) for i in coordList]
-    coordList_sliced = chunks(coordList, 100)
-    elevation = []
-    for coords_chunk in coordList_sliced:
-        proc = subprocess.Popen(["curl", "-d", str(coords_chunk), "-XPOST", "-H", "Content-Type: application/json", \
-                                 "https://elevation.racemap.com/api"], stdout=subprocess.PIPE, shell=True)
-        (elevation_sliced, err) = proc.communicate()
-
-        if err != None or b'Too Many Requests' in elevation_sliced:
-            try:
-                elevation += get_elevation(coords_chunk)
-            except:
-                print("Too many requests :", err, elevation_sliced)
-                raise AltitudeRetrievingError(err, 'Too many requests')
-        elif elevation_sliced == b'' or b'<' in elevation_sliced or b'>' in elevation_sliced:
-            print("Error while getting elevation :", err, elevation)
-            raise AltitudeRetrievingError(err, elevation_sliced)
-        else:
-            elevation += eval(elevation_sliced)
-
-    return list(map(round,elevation, repeat(2)))
+def get_elevation(coordList, provider=None):
+    """
+    Give the elevation of every coordinate in a single batch
+    the duplicated coordinates are resolved only once
+    :param coordList: list of (lat, long)
+    :param provider: elevation provider, the one configured in Elevation by default
+    :type provider: Elevation.ElevationProvider
+    :return: list of elevations in meters rounded to 2 decimals
+    """
+    if provider is None:
+        provider = get_provider()
+    coords = np.asarray(coordList, dtype=float).reshape(-1, 2)
+    if len(coords) == 0:
+        return []
+    unique_coords, inverse = np.unique(coords, axis=0, return_inverse=True)
+    elevation = provider.get_elevations(unique_coords)
+    if np.isnan(elevation).any():
+        raise AltitudeRetrievingError('No elevation available', unique_coords[np.isnan(elevation)].tolist())
+    return np.round(elevation[inverse.reshape(-1)], 2).tolist()
 
 def addToCoord(coord, dx, dy, unit='m'):
-    if unit == 'm':
-        dx /= 1000
-        dy /= 1000
-        latitude, longitude, alt = coord
-        new_latitude = latitude + (dy / r_earth) * (180 / math.pi)
-        new_longitude = longitude + (dx / r_earth) * (180 / math.pi) / math.cos(latitude * math.pi / 180)
-    return [round(new_latitude, 6), round(new_longitude,6), alt]
+    """
+    Move a coordinate toward the east and the north
+    :param coord: (latitude, longitude, altitude)
+    :param dx: distance toward the east in the given unit
+    :param dy: distance toward the north in the given unit
+    :return: [latitude, longitude, altitude] rounded to 6 decimals
+    """
+    latitude, longitude, alt = coord
+    projection = TransverseMercator((latitude, longitude))
+    new_latitude, new_longitude = projection.inverse([[dx / UNITS[unit], dy / UNITS[unit]]])[0]
+    return [round(float(new_latitude), 6), round(float(new_longitude), 6), alt]
+
+UNITS = {'m': 1., 'meters': 1., 'km': 1e-3, 'kilometers': 1e-3, 'mi': 1 / 1609.344, 'miles': 1 / 1609.344,
+         'ft': 1 / 0.3048, 'feet': 1 / 0.3048, 'nm': 1 / 1852., 'nautical': 1 / 1852.}
+
+
+def geodesic_inverse(lat1, long1, lat2, long2, max_iter=200, tol=1e-12):
+    """
+    Vectorized Vincenty inverse solution on the WGS-84 ellipsoid
+    the few nearly antipodal pairs where Vincenty does not converge are solved with Karney's algorithm
+    :param lat1: latitudes of the first points in degrees
+    :param long1: longitudes of the first points in degrees
+    :param lat2: latitudes of the second points in degrees
+    :param long2: longitudes of the second points in degrees
+    :return: (distance in meters, forward azimuth at the first point in degrees clockwise from the north)
+    :rtype: tuple of numpy.ndarray
+    """
+    lat1, long1, lat2, long2 = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (lat1, long1, lat2, long2)])
+    f = WGS84_F
+    L = np.radians(long2 - long1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam = L
+    for _ in range(max_iter):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sin_alpha = np.where(sin_sigma == 0, 0., cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # sur l'équateur cos2_alpha est nul
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0., cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        lam_prev = lam
+        lam = L + (1 - C) * f * sin_alpha * (sigma + C * sin_sigma *
+                                             (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        if np.all(np.abs(lam - lam_prev) < tol):
+            break
+    converged = np.abs(lam - lam_prev) < tol
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+                                                           B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) *
+                                                           (-3 + 4 * cos_2sigma_m ** 2)))
+    dist = WGS84_B * A * (sigma - delta_sigma)
+    azimuth = np.degrees(np.arctan2(cosU2 * np.sin(lam), cosU1 * sinU2 - sinU1 * cosU2 * np.cos(lam)))
+
+    if not converged.all():
+        from geographiclib.geodesic import Geodesic
+        dist, azimuth = np.array(dist), np.array(azimuth)
+        for i in zip(*np.nonzero(~converged)):
+            solution = Geodesic.WGS84.Inverse(lat1[i], long1[i], lat2[i], long2[i])
+            dist[i], azimuth[i] = solution['s12'], solution['azi1']
+    return dist, azimuth
+
+
+def get_distances_with_altitude(coords, unit='m'):
+    """
+    Give the distance relative to altitude between every pair of consecutive coordinates
+    the altitude must be provided in the same unit as the one supplied (default : m)
+    :param coords: array of (latitude, longitude, altitude)
+    :type coords: numpy.ndarray of shape (N, 3)
+    :param unit: string:name of the returned unit i.e : "km", "miles", "m"
+    :return: (distances, angles) of shape (N-1,) in the selected unit and degrees
+    :rtype: tuple of numpy.ndarray
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    x_dist, _ = geodesic_inverse(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1])
+    x_dist = x_dist * UNITS[unit]
+    y_dist = np.abs(np.diff(coords[:, 2]))
+    # sans altitude connue, on garde la distance au sol
+    no_alt = (coords[:-1, 2] == 0) | (coords[1:, 2] == 0)
+    y_dist[no_alt] = 0
+    hypothenus = np.hypot(x_dist, y_dist)
+    angle = np.degrees(np.arctan2(y_dist, x_dist))
+    return np.round(hypothenus, 3), np.round(angle, 3)
+
+
+def get_xy_ground_distances(coords, unit='m'):
+    """
+    Give the ground distance along the parallel (x) and the meridian (y) between every pair of consecutive
+    coordinates, and the direction of the pair in radians counterclockwise from the east
+    :param coords: array of (latitude, longitude, ...)
+    :type coords: numpy.ndarray of shape (N, 2) or (N, 3)
+    :param unit: string:name of the returned unit i.e : "km", "miles", "m"
+    :return: (x, y, angle) of shape (N-1,)
+    :rtype: tuple of numpy.ndarray
+    """
+    coords = np.asarray(coords, dtype=float)
+    lat1, long1, lat2, long2 = coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]
+    y_dist, _ = geodesic_inverse(lat1, long1, lat2, long1)
+    x_dist, _ = geodesic_inverse(lat1, long1, lat1, long2)
+    y_dist = np.where(lat2 < lat1, -y_dist, y_dist) * UNITS[unit]
+    x_dist = np.where(long2 < long1, -x_dist, x_dist) * UNITS[unit]
+    angle = np.arctan2(y_dist, x_dist)
+    return np.round(x_dist, 3), np.round(y_dist, 3), np.round(angle, 3)
+
+
+def get_local_xy(coords, origin):
+    """
+    Project coordinates on the local transverse Mercator projection of the origin, in meters toward the east (x) and
+    the north (y)
+    :param coords: array of (latitude, longitude, ...)
+    :type coords: numpy.ndarray of shape (N, 2) or (N, 3)
+    :param origin: (latitude, longitude) of the origin
+    :return: array of (x, y)
+    :rtype: numpy.ndarray of shape (N, 2)
+    """
+    return TransverseMercator(origin).forward(coords)
+
+
+def get_azimuths(coords):
+    """
+    Give the forward azimuth of every pair of consecutive coordinates
+    :param coords: array of (latitude, longitude, ...)
+    :type coords: numpy.ndarray of shape (N, 2) or (N, 3)
+    :return: azimuths of shape (N-1,) in degrees clockwise from the north
+    :rtype: numpy.ndarray
+    """
+    coords = np.asarray(coords, dtype=float)
+    _, azimuth = geodesic_inverse(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1])
+    return azimuth
+
+
+def get_angles_between_lines(coords):
+    """
+    Give the horizontal angle at every inner vertex of a polyline, counterclockwise in [-180, 180[
+    :param coords: array of (latitude, longitude, ...)
+    :type coords: numpy.ndarray of shape (N, 2) or (N, 3)
+    :return: angles of shape (N-2,) in degrees
+    :rtype: numpy.ndarray
+    """
+    coords = np.asarray(coords, dtype=float)
+    # la projection est conforme : les angles y sont ceux du terrain
+    x, y = TransverseMercator.around(coords).forward(coords).T
+    angle = np.degrees(np.arctan2(np.diff(y), np.diff(x)))
+    return np.round((angle[1:] - angle[:-1] + 180) % 360 - 180, 3)
+
+
+def get_parallel_lines(coords, distances, miter_limit=4.):
+    """
+    Give the parallels of a polyline, every vertex is moved along the bisector of its two sections (mitered join)
+    so each parallel stays at the same distance of all the sections
+    :param coords: array of (latitude, longitude, altitude)
+    :type coords: numpy.ndarray of shape (N, 3)
+    :param distances: distance of every parallel in meter, positive on the left of the polyline, negative on the right
+    :type distances: list or numpy.ndarray of shape (K,)
+    :param miter_limit: the vertex moves at most miter_limit times the distance, sharper turns are clipped
+    :return: the parallels, the altitude of every vertex is kept
+    :rtype: numpy.ndarray of shape (K, N, 3)
+    """
+    coords = np.asarray(coords, dtype=float)
+    distances = np.asarray(distances, dtype=float).reshape(-1, 1)
+    # la polyligne est projetée une fois en mètres : x vers l'est, y vers le nord
+    projection = TransverseMercator.around(coords)
+    x, y = projection.forward(coords).T
+    dx, dy = np.diff(x), np.diff(y)
+    length = np.hypot(dx, dy)
+    length[length == 0] = np.inf
+    # normale à gauche de chaque section, celle des sections de longueur nulle est nulle
+    nx, ny = -dy / length, dx / length
+    prev_x, prev_y = np.concatenate((nx[:1], nx)), np.concatenate((ny[:1], ny))
+    next_x, next_y = np.concatenate((nx, nx[-1:])), np.concatenate((ny, ny[-1:]))
+    # la bissectrice (n1 + n2) / (1 + n1.n2) est à la distance 1 des deux sections
+    scale = 1 + prev_x * next_x + prev_y * next_y
+    scale[scale < 1e-12] = np.inf
+    miter_x, miter_y = (prev_x + next_x) / scale, (prev_y + next_y) / scale
+    miter = np.hypot(miter_x, miter_y)
+    clip = np.where(miter > miter_limit, miter_limit / np.where(miter > 0, miter, 1), 1.)
+    miter_x, miter_y = miter_x * clip, miter_y * clip
+    # demi-tour : la bissectrice n'existe pas, le sommet est décalé selon la section précédente
+    u_turn = np.isinf(scale)
+    miter_x[u_turn], miter_y[u_turn] = prev_x[u_turn], prev_y[u_turn]
+
+    parallels = np.empty((len(distances), len(coords), 3))
+    xy = np.stack((x + distances * miter_x, y + distances * miter_y), axis=-1)
+    parallels[:, :, :2] = projection.inverse(xy.reshape(-1, 2)).reshape(len(distances), len(coords), 2)
+    parallels[:, :, 2] = coords[:, 2]
+    return parallels
+
 
 def get_distance_with_altitude(coordAlt1, coordAlt2, unit='m'):
     """
@@ -60,32 +238,56 @@ def get_distance_with_altitude(coordAlt1, coordAlt2, unit='m'):
     :param unit: string:name of the returned unit i.e : "km", "miles", "m"
     :return: (distance, angle) in the selected unit and degrees
     """
-    lat1, long1, alt1 = coordAlt1
-    lat2, long2, alt2 = coordAlt2
-    if alt1 == 0 or alt2 == 0:
-        return distance.geodesic(coordAlt1[:-1], coordAlt2[:-1]).m, 0
-    x_dist = eval('distance.geodesic((lat1,long1),(lat2, long2)).{0}'.format(unit))
-    y_dist = abs(alt2 - alt1)
-    hypothenus = math.sqrt(x_dist**2 + y_dist**2)
-    angle = math.degrees(math.atan(y_dist / x_dist))
-    return round(hypothenus, 3), round(angle, 3)
+    hypothenus, angle = get_distances_with_altitude([coordAlt1, coordAlt2], unit=unit)
+    return float(hypothenus[0]), float(angle[0])
 
 
 def get_xy_ground_distance(coord1, coord2, unit='m'):
-    y_dist = distance.geodesic(coord1[:-1], (coord2[0],coord1[1])).m
-    if coord2[0] < coord1[0]:
-        y_dist *= -1
-    x_dist = distance.geodesic(coord1[:-1], (coord1[0], coord2[1])).m
-    if coord2[1] < coord1[1]:
-        x_dist *= -1
-    if x_dist < 0 or y_dist < 0:
-        angle = math.atan2(y_dist, x_dist)
-    elif x_dist == 0:
-        return x_dist, y_dist, 0.0001
-    else:
-        angle = math.atan(y_dist / x_dist)
-
-    return round(x_dist, 3), round(y_dist, 3), round(angle,3)
+    x_dist, y_dist, angle = get_xy_ground_distances([coord1[:2], coord2[:2]], unit=unit)
+    return float(x_dist[0]), float(y_dist[0]), float(angle[0])
+
+def get_subcoords_dist(starts, stops, space, unit='m'):
+    """
+    Slice many segments at once, every segment is cut in equal parts of at most the given distance
+    the inner points are interpolated along the great circle and rounded to 7 decimals
+    :param starts: first coordinate of every segment (latitude, longitude, ...)
+    :type starts: numpy.ndarray of shape (M, 2) or (M, 3)
+    :param stops: last coordinate of every segment
+    :type stops: numpy.ndarray of shape (M, 2) or (M, 3)
+    :param space: distance between two points in given unit (default meter), scalar or one by segment
+    :param unit: string:name of the unit of space i.e : "km", "miles", "m"
+    :return: (points, counts) the points (latitude, longitude, altitude) of every segment one after the other,
+    its start and stop included with their altitude (0 for the inner points), and the number of points by segment
+    :rtype: tuple of numpy.ndarray of shape (P, 3) and (M,)
+    """
+    starts, stops = np.atleast_2d(np.asarray(starts, dtype=float)), np.atleast_2d(np.asarray(stops, dtype=float))
+    dist, _ = geodesic_inverse(starts[:, 0], starts[:, 1], stops[:, 0], stops[:, 1])
+    number = np.maximum(np.ceil(np.abs(dist * UNITS[unit] / np.asarray(space, dtype=float))), 1).astype(int)
+    counts = number + 1
+    segment = np.repeat(np.arange(len(starts)), counts)
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    fraction = (np.arange(counts.sum()) - first[segment]) / number[segment]
+
+    # interpolation sphérique entre les vecteurs unitaires des extrémités
+    lat1, long1 = np.radians(starts[segment, 0]), np.radians(starts[segment, 1])
+    lat2, long2 = np.radians(stops[segment, 0]), np.radians(stops[segment, 1])
+    a = np.stack((np.cos(lat1) * np.cos(long1), np.cos(lat1) * np.sin(long1), np.sin(lat1)))
+    b = np.stack((np.cos(lat2) * np.cos(long2), np.cos(lat2) * np.sin(long2), np.sin(lat2)))
+    delta = np.arccos(np.clip((a * b).sum(axis=0), -1, 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        wa = np.where(delta > 0, np.sin((1 - fraction) * delta) / np.sin(delta), 1 - fraction)
+        wb = np.where(delta > 0, np.sin(fraction * delta) / np.sin(delta), fraction)
+    x, y, z = wa * a + wb * b
+    points = np.zeros((len(segment), 3))
+    points[:, 0] = np.degrees(np.arctan2(z, np.hypot(x, y))).round(7)
+    points[:, 1] = np.degrees(np.arctan2(y, x)).round(7)
+
+    # les extrémités sont gardées telles quelles
+    last = first + number
+    points[first, :min(starts.shape[1], 3)] = starts[:, :3]
+    points[last, :min(stops.shape[1], 3)] = stops[:, :3]
+    return points, counts
+
 
 def get_subcoord_dist(coord1, coord2, space, unit='m'):
     """
@@ -96,32 +298,12 @@ def get_subcoord_dist(coord1, coord2, space, unit='m'):
     :param unit: string:name of the returned unit i.e : "km", "miles", "m"
     :return: a list of coordinates
     """
-    dist_tot = distance.geodesic(coord1, coord2).m
-    x_dist, y_dist, angle = get_xy_ground_distance(coord1,coord2, unit=unit)
-
-    number = math.ceil(abs(dist_tot / space))
-
-    if number <= 1:
-        return [list(coord1), list(coord2)]
-
-    line = LineString([coord1[:-1], coord2[:-1]])
-    splitter = MultiPoint([line.interpolate((i / number), normalized=True) for i in range(1, number)])
-    wkt = splitter.wkt.replace('MULTIPOINT','').replace('(','').replace(')','').split(',')
-    coordlist_str = [point.replace(' ','',1).split(' ') for point in wkt]
-    # ici on coupe à 7 décimales les coordonnées
-    coordlist = [list(map(round,list(map(float, coord_str)), repeat(7))) for coord_str in coordlist_str]
-    [coord.append(0.0) for coord in coordlist]
-
-    coordlist.insert(0, list(coord1))
-    coordlist.append(list(coord2))
-
-    return coordlist
+    points, _ = get_subcoords_dist([coord1], [coord2], space, unit=unit)
+    return points.tolist()
 
 
 def get_angle_between_two_lines(coord1, coord2, coord3):
-    _, _, angle1 = get_xy_ground_distance(coord1, coord2)
-    _, _, angle2 = get_xy_ground_distance(coord2, coord3)
-    return round(math.degrees(angle2) - math.degrees(angle1), 3)
+    return float(get_angles_between_lines([coord1[:2], coord2[:2], coord3[:2]])[0])
 
 def grad2deg(angle_in_grad):
     """
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Placement of the poles along the altitude profile of a trace
+the poles are chosen among candidate points of the trace by dynamic programming, so that the fewest poles
+keep the conductor above the ground within the span and slope limits
+"""
+import numpy as np
+
+
+class PolePlacement:
+    def __init__(self, max_span=100., pole_height=10., min_clearance=6., sag=2.5e-4, max_slope=30., max_turn=0.,
+                 step=5.):
+        """
+        Constraints of the placement
+        :param max_span: maximum distance between two poles in meter
+        :param pole_height: height of the conductor at the poles in meter
+        :param min_clearance: minimum height of the conductor above the ground in meter
+        :param sag: sag coefficient of the conductor, weight by length / (2 * horizontal tension) in 1/meter,
+        the conductor is x * (span - x) * sag under the chord at x meter from a pole
+        :param max_slope: maximum angle of the chord of a span in degrees
+        :param max_turn: a vertex of the trace whose horizontal angle is over max_turn degrees always gets a pole,
+        every vertex gets a pole by default
+        :param step: distance between two candidate points in meter
+        """
+        self.max_span = float(max_span)
+        self.pole_height = float(pole_height)
+        self.min_clearance = float(min_clearance)
+        self.sag = float(sag)
+        self.max_slope = float(max_slope)
+        self.max_turn = float(max_turn)
+        self.step = float(step)
+
+    def __repr__(self):
+        return 'PolePlacement({0})'.format(', '.join('{0}={1!r}'.format(name, value)
+                                                      for name, value in self.__dict__.items()))
+
+    def feasible_spans(self, dist, alt, forced):
+        """
+        Check every span between two candidates at most max_span apart
+        two consecutive candidates can always be joined, so that a placement always exists
+        :param dist: distance of the candidates from the start of the trace in meter, increasing
+        :param alt: altitude of the candidates in meter
+        :param forced: True for the candidates that must get a pole
+        :return: (feasible, length) arrays of shape (width + 1, N), the span from candidate j - w to j is at [w, j]
+        :rtype: tuple of numpy.ndarray
+        """
+        dist, alt = np.asarray(dist, dtype=float), np.asarray(alt, dtype=float)
+        n = len(dist)
+        nb_forced = np.cumsum(forced)
+        width = int(max(1, (np.searchsorted(dist, dist + self.max_span, side='right') - 1 - np.arange(n)).max()))
+        feasible = np.zeros((width + 1, n), dtype=bool)
+        length = np.zeros((width + 1, n))
+        for w in range(1, min(width, n - 1) + 1):
+            i, j = np.arange(n - w), np.arange(w, n)
+            span = dist[j] - dist[i]
+            top_i, top_j = alt[i] + self.pole_height, alt[j] + self.pole_height
+            # pas de poteau obligatoire sous la portée
+            ok = (span <= self.max_span) & (nb_forced[j - 1] == nb_forced[i])
+            ok &= np.degrees(np.arctan2(np.abs(top_j - top_i), span)) <= self.max_slope
+            with np.errstate(invalid='ignore', divide='ignore'):
+                for m in range(1, w):
+                    x = dist[i + m] - dist[i]
+                    wire = top_i + (top_j - top_i) * np.where(span > 0, x / span, 0) - self.sag * x * (span - x)
+                    ok &= wire - alt[i + m] >= self.min_clearance
+            if w == 1:
+                ok[:] = True
+            feasible[w, w:], length[w, w:] = ok, span
+        return feasible, length
+
+    def place(self, dist, alt, forced):
+        """
+        Choose the poles among the candidates, the first and the last candidates always get one
+        the number of poles is minimized, then the spans are evened out
+        :param dist: distance of the candidates from the start of the trace in meter, increasing
+        :param alt: altitude of the candidates in meter
+        :param forced: True for the candidates that must get a pole
+        :return: indices of the candidates that get a pole
+        :rtype: numpy.ndarray
+        """
+        n = len(dist)
+        if n <= 2:
+            return np.arange(n)
+        forced = np.asarray(forced, dtype=bool).copy()
+        forced[[0, -1]] = True
+        feasible, length = self.feasible_spans(dist, alt, forced)
+        # un poteau de plus coûte toujours plus que des portées inégales
+        cost = np.where(feasible, 1 + 1e-3 * (length / self.max_span) ** 2 / n, np.inf)
+
+        best = np.full(n, np.inf)
+        best[0] = 0
+        previous = np.zeros(n, dtype=int)
+        for j in range(1, n):
+            w = np.arange(1, min(len(cost) - 1, j) + 1)
+            total = best[j - w] + cost[w, j]
+            k = int(np.argmin(total))
+            best[j], previous[j] = total[k], j - w[k]
+
+        poles = [n - 1]
+        while poles[-1] != 0:
+            poles.append(previous[poles[-1]])
+        return np.array(poles[::-1])
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Local transverse Mercator projection on the WGS-84 ellipsoid
+a trace is projected once in meters, its planar geometry (parallels, angles, proximity) is computed on arrays,
+and the result is projected back once
+"""
+import numpy as np
+
+# ellipsoïde WGS-84, le même que celui de geopy.distance.geodesic
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+# séries de Krüger à l'ordre 3 en n, précises au millimètre à quelques centaines de km du méridien central
+_N = WGS84_F / (2 - WGS84_F)
+_A = WGS84_A / (1 + _N) * (1 + _N ** 2 / 4 + _N ** 4 / 64)
+_ALPHA = np.array([_N / 2 - 2 * _N ** 2 / 3 + 5 * _N ** 3 / 16, 13 * _N ** 2 / 48 - 3 * _N ** 3 / 5, 61 * _N ** 3 / 240])
+_BETA = np.array([_N / 2 - 2 * _N ** 2 / 3 + 37 * _N ** 3 / 96, _N ** 2 / 48 + _N ** 3 / 15, 17 * _N ** 3 / 480])
+_DELTA = np.array([2 * _N - 2 * _N ** 2 / 3 - 2 * _N ** 3, 7 * _N ** 2 / 3 - 8 * _N ** 3 / 5, 56 * _N ** 3 / 15])
+_E = 2 * np.sqrt(_N) / (1 + _N)
+_J = 2 * np.arange(1, 4).reshape(-1, 1)
+
+
+class TransverseMercator:
+    def __init__(self, origin):
+        """
+        Transverse Mercator projection whose central meridian and origin go through a point, the scale is 1 on the
+        central meridian and grows as 1 + x² / 2R² away from it (1e-6 at 10 km)
+        :param origin: (latitude, longitude) of the point projected at (0, 0)
+        """
+        self.origin = (float(origin[0]), float(origin[1]))
+        self._northing = 0.
+        self._northing = self._forward(np.array([self.origin[0]]), np.array([self.origin[1]]))[1][0]
+
+    def __repr__(self):
+        return 'TransverseMercator({0!r})'.format(self.origin)
+
+    @classmethod
+    def around(cls, coords):
+        """
+        Projection centered on the bounding box of coordinates
+        :param coords: array of (latitude, longitude, ...)
+        :rtype: TransverseMercator
+        """
+        coords = np.asarray(coords, dtype=float).reshape(len(coords), -1)
+        if len(coords) == 0:
+            return cls((0., 0.))
+        long = (coords[:, 1] - coords[0, 1] + 180) % 360 - 180 + coords[0, 1]
+        return cls(((coords[:, 0].min() + coords[:, 0].max()) / 2, (long.min() + long.max()) / 2))
+
+    def forward(self, coords):
+        """
+        :param coords: array of (latitude, longitude, ...) in degrees
+        :return: array of (x, y) in meters toward the east and the north of the origin
+        :rtype: numpy.ndarray of shape (N, 2)
+        """
+        coords = np.asarray(coords, dtype=float).reshape(len(coords), -1)
+        x, y = self._forward(coords[:, 0], coords[:, 1])
+        return np.column_stack((x, y))
+
+    def _forward(self, lat, long):
+        phi = np.radians(lat)
+        dlambda = np.radians((long - self.origin[1] + 180) % 360 - 180)
+        sin_phi = np.sin(phi)
+        t = np.sinh(np.arctanh(sin_phi) - _E * np.arctanh(_E * sin_phi))
+        xi = np.arctan2(t, np.cos(dlambda))
+        eta = np.arctanh(np.sin(dlambda) / np.sqrt(1 + t ** 2))
+        x = _A * (eta + (_ALPHA[:, None] * np.cos(_J * xi) * np.sinh(_J * eta)).sum(axis=0))
+        y = _A * (xi + (_ALPHA[:, None] * np.sin(_J * xi) * np.cosh(_J * eta)).sum(axis=0))
+        return x, y - self._northing
+
+    def inverse(self, xy):
+        """
+        :param xy: array of (x, y) in meters
+        :return: array of (latitude, longitude) in degrees
+        :rtype: numpy.ndarray of shape (N, 2)
+        """
+        xy = np.asarray(xy, dtype=float).reshape(len(xy), -1)
+        xi, eta = (xy[:, 1] + self._northing) / _A, xy[:, 0] / _A
+        xi_p = xi - (_BETA[:, None] * np.sin(_J * xi) * np.cosh(_J * eta)).sum(axis=0)
+        eta_p = eta - (_BETA[:, None] * np.cos(_J * xi) * np.sinh(_J * eta)).sum(axis=0)
+        chi = np.arcsin(np.sin(xi_p) / np.cosh(eta_p))
+        phi = chi + (_DELTA[:, None] * np.sin(_J * chi)).sum(axis=0)
+        long = self.origin[1] + np.degrees(np.arctan2(np.sinh(eta_p), np.cos(xi_p)))
+        return np.column_stack((np.degrees(phi), (long + 180) % 360 - 180))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial index of the poles and the segments of the generated lines, for the proximity queries of the clearance checks
+e.g: nearest pole of a building, poles within a radius, segments crossed by a road
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+from shapely import STRtree, linestrings, points
+
+from .Projection import TransverseMercator
+
+
+class SpatialIndex:
+    def __init__(self, lines, names=None):
+        """
+        Index built once on the points and the segments of lines, in meters on a transverse Mercator projection
+        centered on them
+        the queries return ids of points or segments, the arrays line, pole, segment_line and segment_pole give
+        the line of an id and its index in the line
+        :param lines: list of Line
+        :param names: name of the trace of every line, their index by default
+        :property line: line of every point
+        :property pole: index of every point in its line
+        :property segment_line: line of every segment
+        :property segment_pole: index in its line of the first point of every segment
+        """
+        self.names = list(range(len(lines))) if names is None else list(names)
+        counts = np.array([len(line) for line in lines], dtype=int)
+        coords = np.concatenate([line.coords[:, :2] for line in lines]) if lines else np.empty((0, 2))
+        self.projection = TransverseMercator.around(coords)
+        self.xy = self.projection.forward(coords)
+        self.line = np.repeat(np.arange(len(lines)), counts)
+        self.pole = np.arange(len(coords)) - np.repeat(np.cumsum(counts) - counts, counts)
+        self._poles = cKDTree(self.xy)
+
+        # un segment relie deux points consécutifs d'une même ligne
+        first = np.flatnonzero(self.line[:-1] == self.line[1:])
+        self.segment_line, self.segment_pole = self.line[first], self.pole[first]
+        self._segments = STRtree(linestrings(np.stack((self.xy[first], self.xy[first + 1]), axis=1)))
+
+    def __len__(self):
+        return len(self.xy)
+
+    def project(self, coords):
+        """
+        :param coords: (lat, long) or array of (lat, long)
+        :return: (x, y) or array of (x, y) in meters in the plane of the index
+        :rtype: numpy.ndarray
+        """
+        coords = np.asarray(coords, dtype=float)
+        xy = self.projection.forward(np.atleast_2d(coords))
+        return xy[0] if coords.ndim == 1 else xy
+
+    def nearest_poles(self, coords, k=1):
+        """
+        :param coords: (lat, long) or array of (lat, long)
+        :param k: number of poles by coordinate
+        :return: (distances in meters, ids of the poles) like scipy.spatial.cKDTree.query
+        :rtype: tuple
+        """
+        return self._poles.query(self.project(coords), k=k)
+
+    def poles_within(self, coords, radius):
+        """
+        :param coords: (lat, long) or array of (lat, long)
+        :param radius: distance in meters
+        :return: ids of the poles within radius of the coordinate, sorted by distance, a list of them for an array
+        of coordinates
+        :rtype: numpy.ndarray or list of numpy.ndarray
+        """
+        xy = self.project(coords)
+        ids = self._poles.query_ball_point(xy, radius)
+        if xy.ndim == 1:
+            return self._sort_by_distance(xy, ids)
+        return [self._sort_by_distance(point, point_ids) for point, point_ids in zip(xy, ids)]
+
+    def _sort_by_distance(self, xy, ids):
+        ids = np.asarray(ids, dtype=int)
+        return ids[np.argsort(np.hypot(*(self.xy[ids] - xy).T), kind='stable')]
+
+    def crossed_segments(self, vertices):
+        """
+        :param vertices: array of (lat, long) of a polyline e.g: a road
+        :return: ids of the segments intersecting the polyline
+        :rtype: numpy.ndarray
+        """
+        return np.sort(self._segments.query(self._geometry(vertices), predicate='intersects'))
+
+    def segments_within(self, vertices, distance):
+        """
+        :param vertices: (lat, long) of a point or array of (lat, long) of a polyline e.g: a building outline
+        :param distance: distance in meters
+        :return: ids of the segments within distance of the point or the polyline
+        :rtype: numpy.ndarray
+        """
+        return np.sort(self._segments.query(self._geometry(vertices), predicate='dwithin', distance=distance))
+
+    def _geometry(self, vertices):
+        xy = self.project(vertices)
+        if xy.ndim == 1:
+            return points(xy)
+        return linestrings(xy) if len(xy) > 1 else points(xy[0])
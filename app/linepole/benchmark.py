@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the linepole generator
+the elevation is given by a deterministic stand-in, nothing reaches the network
+usage : python -m app.linepole.benchmark [--pipeline] [--memory] [--save results.json] [--baseline results.json]
+with a baseline, the stages of the pipeline slower than tolerance times the baseline are reported as regressions
+and the exit code is 1
+"""
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from fastkml import kml, styles
+from shapely.geometry import Point, LineString
+
+from . import settings
+from .Elevation import ElevationProvider, set_provider
+from .KMLHandler import KMLHandler, Line
+from .KMLutils import KMLWriter, openKML, read_kml, line_styles, ns
+from .Placement import PolePlacement
+
+
+def fastkml_output(handle):
+    """
+    Augmented kml of a handle built in memory with fastkml, as the generator did before KMLWriter
+    kept as the reference of the benchmarks of write_kml
+    :param handle: KMLHandler whose poles or parallel lines are generated
+    :rtype: fastkml.kml.KML
+    """
+    trace_index = handle._get_trace_index()
+    outputkml = kml.KML()
+    for doc in handle.Documents:
+        outdoc = kml.Document(ns, doc.id, doc.name, doc.description)
+        outputkml.append(outdoc)
+
+        if list(doc.features())[0].kind == 'Placemark':
+            for out_nsfolder in _fastkml_placemarks(handle, doc.features(), trace_index):
+                outdoc.append(out_nsfolder)
+        else:
+            for folder in doc.features():
+                outfolder = kml.Folder(ns, folder.id, folder.name, folder.description)
+                for out_nsfolder in _fastkml_placemarks(handle, folder.features(), trace_index):
+                    outfolder.append(out_nsfolder)
+                outdoc.append(outfolder)
+
+    return outputkml
+
+
+def _fastkml_placemarks(handle, upstream_feature, trace_index):
+    out_nsfolders = []
+    for placemark in upstream_feature:
+        if placemark.kind != 'Placemark' or placemark.geom_type != 'LineString':
+            continue
+        out_nsfolder = kml.Folder(ns, placemark.id, placemark.name, placemark.description)
+        traces = trace_index.get(placemark.name, [])
+        lines = [coords for _, coords, _ in traces]
+        for name, line_coords, color, width in line_styles(lines, [trace for trace, _, _ in traces]):
+            style = styles.Style(styles=[styles.LineStyle(ns=ns, id=None, color=color, width=width)])
+            outplacemark = kml.Placemark(ns, None, name, None, styles=[style])
+            outplacemark.geometry = LineString(line_coords)
+            out_nsfolder.append(outplacemark)
+
+        if not handle.offset:
+            out_points_folder = kml.Folder(ns, placemark.id, name='Poteaux')
+            for _, line, point_names in traces:
+                for i, (point, name) in enumerate(zip(line, point_names)):
+                    outpoint = kml.Placemark(ns, str(i), name, 'Electric Pole')
+                    outpoint.geometry = Point(point)
+                    out_points_folder.append(outpoint)
+            out_nsfolder.append(out_points_folder)
+        out_nsfolders.append(out_nsfolder)
+    return out_nsfolders
+
+
+class SyntheticElevationProvider(ElevationProvider):
+    """
+    Smooth and deterministic terrain, a stand-in for the real providers
+    """
+
+    def get_elevations(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        lat, long = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+        return 200 + 50 * np.sin(lat * 2000) * np.cos(long * 1500) + 20 * np.sin(long * 7000)
+
+
+class CountingElevationProvider(ElevationProvider):
+    """
+    Count the altitudes asked to another provider
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.count = 0
+
+    def get_elevations(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.count += len(coords)
+        return self.provider.get_elevations(coords)
+
+
+def synthetic_trace(nb_points, spacing=20., start=(45.5, -73.6), seed=0):
+    """
+    Random walk with gentle turns
+    :param nb_points: number of vertices of the trace
+    :param spacing: distance between two vertices in meter
+    :param start: (lat, long) of the first vertex
+    :param seed: seed of the random generator
+    :return: list of (lat, long, 0.)
+    :rtype: list of tuple
+    """
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.2, nb_points - 1)) + rng.uniform(0, 2 * math.pi)
+    dlat = np.degrees(spacing * np.cos(heading) / 6371009)
+    dlong = np.degrees(spacing * np.sin(heading) / 6371009) / math.cos(math.radians(start[0]))
+    lat = np.concatenate(([start[0]], start[0] + np.cumsum(dlat))).round(7)
+    long = np.concatenate(([start[1]], start[1] + np.cumsum(dlong))).round(7)
+    return list(zip(lat.tolist(), long.tolist(), [0.] * nb_points))
+
+
+def write_synthetic_kml(file, traces, typekey='normal'):
+    """
+    Write traces as the LineString placemarks of a single Document
+    :param file: text or binary file handle
+    :param traces: list of traces as given by synthetic_trace
+    :param typekey: description of the placemarks, i.e. the type of the traces
+    """
+    with KMLWriter(file) as writer:
+        writer.start_container('Document', 'doc', 'synthetic')
+        for i, trace in enumerate(traces):
+            coords = np.asarray(trace)[:, [1, 0, 2]]
+            writer.write_linestring('Trace{0}'.format(i), coords, description=typekey)
+        writer.end_container()
+
+
+def timed(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def measured(func, *args, **kwargs):
+    """
+    :return: (result, seconds, memory still held by the result in bytes, peak memory in bytes)
+    """
+    tracemalloc.start()
+    try:
+        result, duration = timed(func, *args, **kwargs)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, duration, current, peak
+
+
+def bench_line_scaling(sizes=(1000, 10000, 100000), memory=False, spacing=20.):
+    """
+    Time the construction of a Line (distances from the origin, angles) for growing number of vertices
+    by default the vertices are closer than the space between poles so the sections are not subdivided
+    :param memory: also trace the memory allocations (slower)
+    :param spacing: distance between two vertices in meter, above 100 m the sections are sliced
+    :return: list of (number of points, seconds, held bytes, peak bytes)
+    """
+    settings.init()
+    previous = set_provider(SyntheticElevationProvider())
+    results = []
+    try:
+        for size in sizes:
+            trace = synthetic_trace(size, spacing=spacing)
+            if memory:
+                _, duration, current, peak = measured(Line, trace, typekey='normal')
+            else:
+                (_, duration), current, peak = timed(Line, trace, typekey='normal'), None, None
+            results.append((size, duration, current, peak))
+            line = "Line {0:>7} points every {1:g} m : {2:8.3f} s ({3:6.1f} µs/point)".format(
+                size, spacing, duration, 1e6 * duration / size)
+            if memory:
+                line += " held {0:7.1f} MB, peak {1:7.1f} MB".format(current / 2**20, peak / 2**20)
+            print(line)
+    finally:
+        set_provider(previous)
+    return results
+
+
+def bench_kml_output(nb_poles=5000):
+    """
+    Time the generation of the augmented kml of a single trace with nb_poles poles
+    the generation of the poles was quadratic in the number of poles of a trace
+    :return: dict of seconds by stage
+    """
+    settings.init()
+    previous = set_provider(SyntheticElevationProvider())
+    fd, path = tempfile.mkstemp(suffix='.kml')
+    try:
+        with os.fdopen(fd, 'w') as kml_file:
+            write_synthetic_kml(kml_file, [synthetic_trace(nb_poles)])
+        handle = KMLHandler(path)
+        handle.generatePoles()
+        results = {'write_kml': timed(handle.write_kml, io.StringIO())[1],
+                   'fastkml': timed(fastkml_output, handle)[1]}
+    finally:
+        os.remove(path)
+        set_provider(previous)
+    for stage, duration in results.items():
+        print("KML {0:>7} poles, {1:<9} : {2:8.3f} s".format(nb_poles, stage, duration))
+    return results
+
+
+def bench_offsets(nb_vertices=500, offset=5, max_dist=100):
+    """
+    Time the parallels of a trace, on each side every offset until max_dist, and the Lines built on them
+    :return: (seconds of the parallels, seconds of the Lines)
+    """
+    settings.init()
+    vertices = np.asarray(synthetic_trace(nb_vertices, spacing=100.))
+    offsets, duration = timed(Line._get_offsets, vertices, offset, max_dist)
+    _, lines_duration = timed(lambda: [Line.from_vertices(coords) for coords in offsets.values()])
+    print("Offsets {0:>5} vertices, {1:>3} parallels : {2:8.4f} s, Lines {3:8.4f} s".format(
+        nb_vertices, len(offsets), duration, lines_duration))
+    return duration, lines_duration
+
+
+def bench_incremental_poles(nb_traces=20, nb_vertices=500, spaces=(100, 80, 50, 120)):
+    """
+    Time the generation of the poles for successive spaces, from scratch and incrementally
+    :return: list of (space, seconds from scratch, altitudes fetched, seconds incrementally, altitudes fetched)
+    """
+    settings.init()
+    counter = CountingElevationProvider(SyntheticElevationProvider())
+    previous = set_provider(counter)
+    fd, path = tempfile.mkstemp(suffix='.kml')
+    results = []
+    try:
+        with os.fdopen(fd, 'w') as kml_file:
+            write_synthetic_kml(kml_file, [synthetic_trace(nb_vertices, spacing=250., seed=seed,
+                                                           start=(45.5 + 0.02 * seed, -73.6))
+                                           for seed in range(nb_traces)], typekey='custom')
+        full, incremental = KMLHandler(path), KMLHandler(path)
+        for space in spaces:
+            counter.count = 0
+            _, full_duration = timed(full.generatePoles, space=space)
+            full_count, counter.count = counter.count, 0
+            _, incremental_duration = timed(incremental.generatePoles, incremental=True, space=space)
+            results.append((space, full_duration, full_count, incremental_duration, counter.count))
+            print("Poles every {0:>3} m : {1:7.3f} s, {2:>6} altitudes, incremental {3:7.3f} s, {4:>6} altitudes".format(
+                *results[-1]))
+    finally:
+        os.remove(path)
+        set_provider(previous)
+    return results
+
+
+def bench_placement(lengths=(1000, 10000, 50000), space=100., max_span=150.):
+    """
+    Time the placement of the poles along the elevation profile of a trace, compared to equidistant poles
+    :param lengths: lengths of the traces in meter
+    :param space: space between the equidistant poles in meter
+    :return: list of (length, equidistant poles, placed poles, seconds of the placement)
+    """
+    settings.init()
+    previous = set_provider(SyntheticElevationProvider())
+    results = []
+    try:
+        for length in lengths:
+            fd, path = tempfile.mkstemp(suffix='.kml')
+            try:
+                with os.fdopen(fd, 'w') as kml_file:
+                    write_synthetic_kml(kml_file, [synthetic_trace(int(length // 250) + 1, spacing=250.)],
+                                        typekey='custom')
+                handle = KMLHandler(path)
+                handle.generatePoles(incremental=True, space=space)
+                nb_equidistant = len(handle.info_df['Line'][0])
+                _, duration = timed(handle.generatePoles, placement=PolePlacement(max_span=max_span))
+            finally:
+                os.remove(path)
+            results.append((length, nb_equidistant, len(handle.info_df['Line'][0]), duration))
+            print("Placement {0:>6} m : {1:>4} equidistant poles, {2:>4} placed in {3:7.3f} s".format(*results[-1]))
+    finally:
+        set_provider(previous)
+    return results
+
+
+# réseaux synthétiques du pipeline : nombre de tracés, sommets par tracé, distance entre les sommets en mètres
+PIPELINE_CASES = {'long_trace': (1, 5000, 20.), 'network': (100, 100, 60.), 'long_sections': (10, 50, 1000.)}
+
+
+def bench_pipeline(nb_traces=10, nb_vertices=500, spacing=60., memory=False, fastkml=True, workers=1):
+    """
+    Time every stage of the linepole pipeline on a synthetic network, from the kml to the files of the result
+    :param nb_traces: number of traces of the kml
+    :param nb_vertices: number of vertices of every trace
+    :param spacing: distance between two vertices in meter, above 100 m the sections are sliced
+    :param memory: also trace the peak memory of every stage (slower)
+    :param fastkml: also time the legacy fastkml stages (openKML and fastkml_output), quadratic on large networks
+    :param workers: number of processes computing the traces
+    :return: {stage: {'seconds': ..., 'peak': bytes or None}}
+    :rtype: dict
+    """
+    settings.init()
+    previous = set_provider(SyntheticElevationProvider())
+    fd, path = tempfile.mkstemp(suffix='.kml')
+    results = {}
+
+    def stage(name, func, *args, **kwargs):
+        if memory:
+            result, duration, _, peak = measured(func, *args, **kwargs)
+        else:
+            (result, duration), peak = timed(func, *args, **kwargs), None
+        results[name] = {'seconds': duration, 'peak': peak}
+        return result
+
+    try:
+        with os.fdopen(fd, 'w') as kml_file:
+            write_synthetic_kml(kml_file, [synthetic_trace(nb_vertices, spacing=spacing, seed=seed,
+                                                           start=(45.5 + 0.01 * seed, -73.6))
+                                           for seed in range(nb_traces)])
+        if fastkml:
+            stage('openKML', openKML, path)
+        stage('read_kml', read_kml, path)
+        handle = stage('KMLHandler', KMLHandler, path, workers=workers)
+        stage('_set_dataframe', handle._set_dataframe)
+        stage('_set_sections', handle.generatePoles)
+        stage('outputdf', lambda: handle.outputdf)
+        stage('camelia', lambda: handle.camelia)
+        stage('write_outputs_csv', handle.write_outputs_csv, io.StringIO())
+        stage('write_camelia_csv', handle.write_camelia_csv, io.StringIO())
+        if fastkml:
+            stage('_get_output_kml', fastkml_output, handle)
+        stage('write_kml', handle.write_kml, io.StringIO())
+        state = io.BytesIO()
+        stage('save', handle.save, state)
+        state.seek(0)
+        stage('load', KMLHandler.load, state)
+    finally:
+        os.remove(path)
+        set_provider(previous)
+
+    nb_poles = sum(len(line) for line in handle.info_df['Line'])
+    print("Pipeline {0} traces x {1} vertices every {2:g} m, {3} poles".format(nb_traces, nb_vertices, spacing,
+                                                                           nb_poles))
+    for name, result in results.items():
+        line = "  {0:<18} : {1:8.3f} s".format(name, result['seconds'])
+        if result['peak'] is not None:
+            line += ", peak {0:7.1f} MB".format(result['peak'] / 2**20)
+        print(line)
+    return results
+
+
+def bench_pipelines(cases=None, memory=False, fastkml=True):
+    """
+    Run bench_pipeline on every case
+    :param cases: {name: (nb_traces, nb_vertices, spacing)}, PIPELINE_CASES by default
+    :return: {case: {stage: {'seconds': ..., 'peak': ...}}}
+    :rtype: dict
+    """
+    cases = PIPELINE_CASES if cases is None else cases
+    return {name: bench_pipeline(*case, memory=memory, fastkml=fastkml) for name, case in cases.items()}
+
+
+def compare_results(results, baseline, tolerance=1.5, min_seconds=0.01):
+    """
+    Find the stages slower, or using more memory, than tolerance times the baseline
+    :param results: results of bench_pipelines
+    :param baseline: results of bench_pipelines saved before the change
+    :param min_seconds: stages faster than this in the baseline are too noisy to be compared on time
+    :return: description of every regression
+    :rtype: list of str
+    """
+    regressions = []
+    for case, stages in results.items():
+        for name, result in stages.items():
+            reference = baseline.get(case, {}).get(name)
+            if reference is None:
+                continue
+            if reference['seconds'] >= min_seconds and result['seconds'] > tolerance * reference['seconds']:
+                regressions.append("{0} {1} : {2:.3f} s instead of {3:.3f} s".format(
+                    case, name, result['seconds'], reference['seconds']))
+            if result['peak'] and reference['peak'] and result['peak'] > tolerance * reference['peak']:
+                regressions.append("{0} {1} : peak {2:.1f} MB instead of {3:.1f} MB".format(
+                    case, name, result['peak'] / 2**20, reference['peak'] / 2**20))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the linepole generator")
+    parser.add_argument('--pipeline', action='store_true', help="only the stages of the pipeline")
+    parser.add_argument('--memory', action='store_true', help="trace the peak memory of the stages")
+    parser.add_argument('--no-fastkml', action='store_true', help="skip the legacy fastkml stages")
+    parser.add_argument('--save', help="json file where the results of the pipeline are saved")
+    parser.add_argument('--baseline', help="json file of results to compare with")
+    parser.add_argument('--tolerance', type=float, default=1.5, help="slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    if not args.pipeline:
+        bench_line_scaling(memory=True)
+        bench_line_scaling(sizes=(1000, 10000), spacing=250.)
+        bench_kml_output()
+        bench_offsets()
+        bench_incremental_poles()
+        bench_placement()
+    results = bench_pipelines(memory=args.memory, fastkml=not args.no_fastkml)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_results(results, json.load(file), tolerance=args.tolerance)
+        for regression in regressions:
+            print("Regression " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
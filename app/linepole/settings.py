@@ -1,4 +1,10 @@
-
-def init():
+def init(space=None):
+    """
+    :param space: space between the poles by type of line, the default spaces when None
+    :type space: dict
+    """
     global space_by_type
-    space_by_type = {'city':50, 'roads':100, 'hill':80, 'normal':100}
\ No newline at end of file
+    if space is None:
+        space_by_type = {'city':50, 'roads':100, 'hill':80, 'normal':100}
+    else:
+        space_by_type = dict(space)
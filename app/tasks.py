@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Tasks of the background jobs, run by the worker processes of utils.Jobs
+"""
+from pathlib import Path
+
+from .linepole import settings as kml_settings
+from .linepole.KMLHandler import KMLHandler
+from .linepole.Placement import PolePlacement
+from .eep import eepower_utils as eeu, eep_traitement as eep
+from .eep.report_cache import ReportCache
+from .utils.File import get_uploads_files, full_paths, create_dir_if_dont_exist as create_dir, zip_files
+from .utils.Jobs import task
+from .utils.Workspace import save_file
+
+
+def write_linepole_outputs(handle, output_path, zip_file_name, camelia=True, kmz=False, csv_from_arrays=True):
+    """
+    Write the csv and the augmented kml of a handle in a zip
+    :param handle: KMLHandler whose poles or parallel lines are generated
+    :param output_path: directory of the zip
+    :param camelia: also write the csv in the camelia format
+    :param kmz: compress the kml in a kmz
+    :param csv_from_arrays: write the csv directly from the arrays of the lines, without the DataFrames
+    :return: path of the zip
+    """
+    output_path = Path(output_path)
+
+    def write_csv(csv_name, write_from_arrays, dataframe):
+        if csv_from_arrays:
+            with open(csv_name, 'w', newline='', encoding='utf-8') as csv_file:
+                write_from_arrays(csv_file)
+        else:
+            dataframe().to_csv(csv_name)
+
+    outputs = []
+    if camelia:
+        # create a csv in the camelia format
+        cam_file_name = output_path / "camelia_output.csv"
+        write_csv(cam_file_name, handle.write_camelia_csv, lambda: handle.camelia)
+        outputs.append(cam_file_name)
+
+    # generate a csv containing all generated data
+    csv_name = output_path / "all_data.csv"
+    write_csv(csv_name, handle.write_outputs_csv, lambda: handle.outputdf)
+    outputs.append(csv_name)
+
+    # the kml is written directly in the zip
+    streams = {"augmented_kml.kmz": handle.write_kmz} if kmz else {"augmented_kml.kml": handle.write_kml}
+    return zip_files(outputs, zip_file_name=zip_file_name, streams=streams)
+
+
+@task('linepole')
+def linepole(params, progress):
+    """
+    Generate the poles or the parallel lines of a kml
+    :param params: {'kml': path of the kml, 'handler': path of the KMLHandler saved by the analysis, updated with the
+    generated lines,
+    'mode': 'pole' or 'parallele', 'dist_pole': space between the poles, 'offset': space between the parallel lines, 'max_dist': distance of the last parallel line,
+    'output_path': directory of the outputs of the job, 'zip_file_name', 'workers', 'kmz', 'csv_from_arrays',
+    'incremental',
+    'placement': constraints of the placement of the poles along the elevation profile, see PolePlacement}
+    :return: path of the zip
+    """
+    kml_settings.init()
+    handler = Path(params['handler']) if params.get('handler') else None
+    if handler is not None and handler.exists():
+        handle = KMLHandler.load(handler, workers=params.get('workers', 1))
+    else:
+        progress(0.1, "Lecture du kml")
+        handle = KMLHandler(params['kml'], workers=params.get('workers', 1))
+    if params['mode'] == 'pole':
+        progress(0.3, "Génération des poteaux")
+        placement = PolePlacement(**params['placement']) if params.get('placement') else None
+        handle.generatePoles(incremental=params.get('incremental', False), placement=placement,
+                             space=params['dist_pole'])
+    else:
+        progress(0.3, "Génération des lignes parallèles")
+        handle.generateOffset(params['offset'], params['max_dist'])
+    if handler is not None:
+        save_file(handler, handle.save)
+    progress(0.8, "Écriture des fichiers")
+    return write_linepole_outputs(handle, create_dir(params['output_path']), params['zip_file_name'],
+                                  camelia=params['mode'] == 'pole', kmz=params.get('kmz', False),
+                                  csv_from_arrays=params.get('csv_from_arrays', True))
+
+
+@task('eepower')
+def eepower(params, progress):
+    """
+    Generate the EasyPower reports of the uploaded files
+    :param params: {'upload_path', 'output_path': directory of the outputs of the job, 'zip_file_name', 'bus_exclus',
+    'report_type',
+    'workers': number of reports generated at the same time and of processes parsing the files of the scenarios,
+    'cache_path': directory of the reports parsed at the validation of the uploads}
+    :return: path of the zip
+    """
+    upload_path = Path(params['upload_path'])
+    files = get_uploads_files(upload_path)
+    scenarios = eeu.scenario_finder(files)
+    data = {"BUS_EXCLUS": params['bus_exclus'],
+            "FILE_PATHS": full_paths(upload_path),
+            "FILES": files,
+            "SCENARIOS": scenarios,
+            "NB_SCEN": len(scenarios),
+            "REPORT_TYPE": params['report_type'],
+            "CACHE": ReportCache(params.get('cache_path')),
+            "WORKERS": params.get('workers', 1)}
+    dirpath = create_dir(params['output_path'])
+
+    nb_reports = len([report_type for report_type in eep.REPORTS if report_type in data["REPORT_TYPE"]])
+    progress(0, "Génération des rapports")
+    done, errors, file_list = [], [], []
+
+    def finished_files():
+        # les fichiers d'un rapport sont ajoutés au zip dès qu'il est terminé
+        for report_type, files, seconds, error in eep.generate_reports(data, dirpath, workers=data["WORKERS"]):
+            done.append(report_type)
+            if error is not None:
+                errors.append((report_type, error))
+                progress(len(done) / nb_reports, "Rapport {0} en erreur".format(report_type))
+                continue
+            progress(len(done) / nb_reports, "Rapport {0} terminé en {1:.1f} s".format(report_type, seconds))
+            file_list.extend(files)
+            yield from files
+
+    zippath = zip_files(finished_files(), zip_file_name=params['zip_file_name'], path=dirpath)
+    if len(errors) == 1:
+        raise errors[0][1]
+    elif errors:
+        raise RuntimeError("\n".join("Rapport {0} : {1}".format(report_type, error) for report_type, error in errors))
+    if file_list == []:
+        raise FileNotFoundError("Pas de fichiers fournis")
+    return zippath
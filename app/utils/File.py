@@ -1,19 +1,23 @@
 import re
 import pandas as pd
 import openpyxl
-import os
 import json
 import zipfile
 from pathlib import Path
 from docxtpl import DocxTemplate
 
-from app.eep.eepower_utils import parse_excel_sheet
+from app.eep.eepower_utils import read_report, CC_CSV, CC_EXCEL, TCC_TITLE, NA_VALUES
 
 
 class FileError(Exception):
     pass
 
 
+# premiers octets des classeurs xlsx (archive zip) et xls (OLE2)
+XLSX_MAGIC = b'PK\x03\x04'
+XLS_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
 def get_uploads_files(upload_dir=r'.\uploads'):
     upload_dir = Path(upload_dir)
     if upload_dir.exists() and upload_dir.is_dir():
@@ -29,10 +33,12 @@ def purge_file(dir_name=Path(r'.\uploads')):
             file.unlink()
 
 
-def validate_file_epow(file):
+def validate_file_epow(file, cache=None):
     """
 
     :param file: Path (pathlib) to the file to validate
+    :param cache: ReportCache, the file is parsed in it the way the reports read it, so it is not parsed again,
+    only the header rows of the file are read if None
     :return: The type of file it is for the study, None is not valitated
     """
     file_names_patern = {
@@ -76,18 +82,22 @@ def validate_file_epow(file):
     }
 
     if re.match(file_names_patern['cc'], file.name):
-        try:
-            df = pd.DataFrame(pd.read_csv(file, skiprows=1))
-        except:
+        if cache is None:
+            skiprows = CC_CSV['skiprows'] if sniff_file_type(file) == 'csv' else CC_EXCEL['skiprows']
+            labels = header_labels(file, skiprows=skiprows)
+        else:
             try:
-                df = pd.DataFrame(pd.read_excel(file, skiprows=7, engine='openpyxl'))
-            except openpyxl.utils.exceptions.InvalidFileException as notXL:
-                raise FileError("Le type de fichiers n'est pas .xlsx")
-
-        if col1.issubset(df.columns.to_list()) or col30.issubset(df.columns.to_list()):
+                labels = _labels(read_report(file, 'csv', cache=cache, **CC_CSV))
+            except:
+                try:
+                    labels = _labels(read_report(file, 'excel', cache=cache, **CC_EXCEL))
+                except (zipfile.BadZipFile, openpyxl.utils.exceptions.InvalidFileException):
+                    raise FileError("Le type de fichiers n'est pas .xlsx")
+
+        if col1.issubset(labels) or col30.issubset(labels):
             return "CC"
         else:
-            missing_col = col30 + col1 - set(df.columns.to_list())
+            missing_col = (col30 | col1) - labels
             raise FileError(
                 "Les colonnes {0} du fichier '{1}' semblent être manquantes ou mal écrite dans les fichiers "
                 "fournis".format(missing_col, file)
@@ -95,13 +105,13 @@ def validate_file_epow(file):
 
     elif re.match(file_names_patern['af'], file.name):
         try:
-            df = pd.DataFrame(pd.read_excel(file, engine='openpyxl'))
-        except openpyxl.utils.exceptions.InvalidFileException as notXL:
+            labels = _excel_labels(file, cache, index_col=0)
+        except (zipfile.BadZipFile, openpyxl.utils.exceptions.InvalidFileException):
             raise FileError("Le type de fichiers n'est pas .xlsx")
-        if af_col.issubset(df.columns.to_list()):
+        if af_col.issubset(labels):
             return "AF"
         else:
-            missing_col = af_col - set(df.columns.to_list())
+            missing_col = af_col - labels
             raise FileError(
                 "Les colonnes {0} du fichier '{1}' semblent être manquantes ou mal écrite dans les fichiers "
                 "fournis".format(missing_col, file)
@@ -109,13 +119,13 @@ def validate_file_epow(file):
         
     elif re.match(file_names_patern['ed'],  file.name):
         try:
-            df = pd.DataFrame(pd.read_excel(file, engine='openpyxl'))
-        except openpyxl.utils.exceptions.InvalidFileException as notXL:
+            labels = _excel_labels(file, cache, index_col=1)
+        except (zipfile.BadZipFile, openpyxl.utils.exceptions.InvalidFileException):
             raise FileError("Le type de fichiers n'est pas .xlsx")
-        if ed_col.issubset(df.columns.to_list()):
+        if ed_col.issubset(labels):
             return "ED"
         else:
-            missing_col = ed_col - set(df.columns.to_list())
+            missing_col = ed_col - labels
             raise FileError(
                 "Les colonnes {0} du fichier '{1}' semblent être manquantes ou mal écrite dans les fichiers "
                 "fournis".format(missing_col, file.name)
@@ -123,9 +133,11 @@ def validate_file_epow(file):
 
     elif re.match(file_names_patern['tcc'], file.name):
         try:
-            df_tcc = parse_excel_sheet(file, header=[0, 1])
-            df = df_tcc[0]
-            if set.intersection(tcc_col, df.columns.to_list()[0]) != set():
+            if cache is not None:
+                labels = set(read_report(file, 'tables', cache=cache, header=[0, 1])[0].columns.to_list()[0])
+            else:
+                labels = _first_table_labels(file)
+            if set.intersection(tcc_col, labels) != set():
                 return "TCC"
             else:
                 missing_col = ("infos manquantes")
@@ -133,7 +145,7 @@ def validate_file_epow(file):
                     "Les colonnes {0} du fichier '{1}' semblent être manquantes ou mal écrite dans les fichiers "
                     "fournis".format(missing_col, file.name)
                 )
-        except openpyxl.utils.exceptions.InvalidFileException:
+        except (zipfile.BadZipFile, openpyxl.utils.exceptions.InvalidFileException):
             raise FileError("Le type de fichiers n'est pas .xlsx")
         except BaseException:
             raise FileError("Impossible de déterminer les fins et le débuts des tableaux des protections")
@@ -143,6 +155,85 @@ def validate_file_epow(file):
             "Le fichier '{0}' ne semblent pas être un fichier géré par cet outil".format(file.name))
 
 
+def _labels(df):
+    # la colonne lue comme index fait partie des colonnes attendues
+    return set(df.columns.to_list()) | set(df.index.names)
+
+
+def _excel_labels(file, cache, index_col):
+    if cache is None:
+        return header_labels(file, xlsx_only=True)
+    return _labels(read_report(file, 'excel', cache=cache, index_col=index_col))
+
+
+def sniff_file_type(file):
+    """
+    Type of a report from its first bytes, whatever its extension
+    :param file: path of the file
+    :return: 'xlsx', 'xls' or 'csv'
+    :rtype: str
+    """
+    with open(file, 'rb') as content:
+        start = content.read(1024)
+    if start.startswith(XLSX_MAGIC):
+        return 'xlsx'
+    elif start.startswith(XLS_MAGIC):
+        return 'xls'
+    elif b'\x00' in start:
+        raise FileError("Le type de fichiers n'est pas .csv ou .xlsx")
+    return 'csv'
+
+
+def header_labels(file, skiprows=0, xlsx_only=False):
+    """
+    Labels of the header row of a csv or xlsx report, the rest of the file is not read
+    :param file: path of the file
+    :param skiprows: number of rows before the header
+    :param xlsx_only: refuse the csv files
+    :rtype: set
+    """
+    file_type = sniff_file_type(file)
+    if file_type == 'csv' and not xlsx_only:
+        try:
+            return set(pd.read_csv(file, skiprows=skiprows, nrows=0).columns.to_list())
+        except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError):
+            raise FileError("Le type de fichiers n'est pas .csv ou .xlsx")
+    elif file_type != 'xlsx':
+        raise FileError("Le type de fichiers n'est pas .xlsx")
+    try:
+        row = next(_excel_rows(file, min_row=skiprows + 1, max_row=skiprows + 1), ())
+    except (zipfile.BadZipFile, openpyxl.utils.exceptions.InvalidFileException):
+        # une archive zip corrompue ou qui n'est pas un classeur
+        raise FileError("Le type de fichiers n'est pas .xlsx")
+    return {value for value in row if value is not None}
+
+
+def _first_table_labels(file, title=TCC_TITLE):
+    """
+    Labels of the first column of the first table of a TCC report, the sheet is read up to its header
+    """
+    rows = _excel_rows(file)
+    try:
+        column = list(next(rows, ())).index(title)
+        for row in rows:
+            if column < len(row) and row[column] is not None and row[column] not in NA_VALUES:
+                return {row[0], next(rows, (None,))[0]}
+        raise ValueError("Aucun tableau dans le fichier")
+    finally:
+        rows.close()
+
+
+def _excel_rows(file, min_row=1, max_row=None):
+    # lecture en continu, le classeur n'est lu que jusqu'à la dernière ligne demandée
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        yield from sheet.iter_rows(min_row=min_row, max_row=max_row, values_only=True)
+    finally:
+        workbook.close()
+
+
 def full_paths(upload_dir):
     return upload_dir / "*"
 
@@ -152,35 +243,39 @@ def create_dir_if_dont_exist(dir_name):
     return Path(dir_name)
 
 
-def zip_files(list_of_files, zip_file_name=''):
+def zip_files(list_of_files, zip_file_name='', streams=None, path=None):
     """
     Generate a zip file from a list of files in the location of the first file of the list
-    :param list_of_files:
-    :type list_of_files:
-    :param zip_file_name:
-    :type zip_file_name:
-    :return:
-    :rtype:
+    :param list_of_files: paths of the files to add, each file is added as soon as the iterable gives it when path
+    is given
+    :type list_of_files: list of Path or iterable of Path
+    :param zip_file_name: name of the zip file without extension
+    :type zip_file_name: str
+    :param streams: entries written directly in the zip, {name in the zip: function writing in a binary file handle}
+    :type streams: dict
+    :param path: directory of the zip file, the directory of the first file by default
+    :type path: Path
+    :return: path of the zip file
+    :rtype: Path
     """
-
+    if path is None:
+        list_of_files = [Path(file) for file in list_of_files]
+        path = list_of_files[0].parent
+    wd = Path(path)
     if zip_file_name == '':
-        file_name = list_of_files[0].parent
-
-    # the current working directory is changed to the directory of the first file in the list
-    # return to the previous directory after saving
-    previous_dir = Path.cwd()
-    wd = list_of_files[0].parent
-    os.chdir(wd)
-    zip_file_name += '.zip'
-    with zipfile.ZipFile(zip_file_name,
+        zip_file_name = wd.name
+
+    zippath = wd / (zip_file_name + '.zip')
+    with zipfile.ZipFile(zippath,
                          "w",
                          zipfile.ZIP_DEFLATED,
                          allowZip64=True) as zf:
+        for name, write in (streams or {}).items():
+            with zf.open(name, 'w', force_zip64=True) as entry:
+                write(entry)
         for file in list_of_files:
-            zf.write(file.name)
+            zf.write(file, arcname=Path(file).name)
 
-    zippath = wd/zip_file_name
-    os.chdir(previous_dir)
     return zippath
 
 
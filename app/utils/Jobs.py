@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Background jobs run by local worker processes
+the jobs are kept in a SQLite table shared by the web and worker processes, no broker is needed
+usage : python -m app.utils.Jobs [nb_workers] to run the workers apart from the web server
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+import traceback
+import uuid
+from pathlib import Path
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+TASKS = {}
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+DB_PATH = Path(os.environ.get('JOB_DB', ROOT_DIR / 'generated' / 'jobs.sqlite'))
+
+
+def task(name):
+    """
+    Register a function as the task run by the jobs of the given kind
+    the function is called with the parameters of the job and a progress(fraction, message) callback,
+    it returns the path of the result file
+    """
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+class JobQueue:
+    def __init__(self, path):
+        """
+        Persistent table of the jobs
+        :param path: path of the SQLite file
+        """
+        self.path = str(path)
+        self._conn = None
+
+    def __getstate__(self):
+        # chaque processus de travail ouvre la file sur le même fichier sqlite, avec sa propre connexion
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    def _connect(self):
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS job (id TEXT PRIMARY KEY, kind TEXT, status TEXT, '
+                               'params TEXT, progress REAL, message TEXT, result TEXT, error TEXT, worker INTEGER, '
+                               'created REAL, updated REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS job_status ON job (status, created)')
+        return self._conn
+
+    def enqueue(self, kind, params, job_id=None):
+        """
+        :param kind: name of a registered task
+        :param params: parameters of the task, serializable in json
+        :param job_id: id of the job, from new_job_id, so the parameters can name the outputs of the job after it
+        :return: id of the job
+        :rtype: str
+        """
+        job_id = job_id or new_job_id()
+        now = time.time()
+        self._connect().execute('INSERT INTO job (id, kind, status, params, progress, created, updated) '
+                                'VALUES (?, ?, ?, ?, 0, ?, ?)', (job_id, kind, QUEUED, json.dumps(params), now, now))
+        return job_id
+
+    def get(self, job_id):
+        """
+        :return: the job as a dict, None if it does not exist
+        """
+        row = self._connect().execute('SELECT * FROM job WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def claim(self, worker):
+        """
+        Take the oldest queued job, a job is given to a single worker
+        :param worker: pid of the worker process
+        :return: the job as a dict, None if no job is queued
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT id FROM job WHERE status = ? ORDER BY created LIMIT 1', (QUEUED,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE job SET status = ?, worker = ?, updated = ? WHERE id = ?',
+                             (RUNNING, worker, time.time(), row['id']))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return None if row is None else self.get(row['id'])
+
+    def _update(self, job_id, **columns):
+        columns['updated'] = time.time()
+        assignments = ', '.join('{0} = ?'.format(name) for name in columns)
+        self._connect().execute('UPDATE job SET {0} WHERE id = ?'.format(assignments),
+                                list(columns.values()) + [job_id])
+
+    def set_progress(self, job_id, progress, message=None):
+        self._update(job_id, progress=progress, message=message)
+
+    def finish(self, job_id, result):
+        self._update(job_id, status=DONE, progress=1, result=str(result), message=None)
+
+    def fail(self, job_id, error):
+        self._update(job_id, status=FAILED, error=error)
+
+    def requeue_orphans(self):
+        """
+        Queue again the running jobs whose worker process died
+        :return: number of jobs queued again
+        """
+        orphans = [row['id'] for row in self._connect().execute('SELECT id, worker FROM job WHERE status = ?',
+                                                                  (RUNNING,)) if not _is_alive(row['worker'])]
+        for job_id in orphans:
+            self._update(job_id, status=QUEUED, worker=None)
+        return len(orphans)
+
+    def purge(self, max_age):
+        """
+        Forget the finished jobs older than max_age seconds
+        """
+        self._connect().execute('DELETE FROM job WHERE status IN (?, ?) AND updated < ?',
+                                (DONE, FAILED, time.time() - max_age))
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def _is_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def run_job(queue, job):
+    """
+    Run the task of a job and record its result or its error
+    """
+    job_id = job['id']
+    try:
+        func = TASKS[job['kind']]
+    except KeyError:
+        queue.fail(job_id, "Tâche inconnue : {0}".format(job['kind']))
+        return
+    try:
+        result = func(job['params'], lambda progress, message=None: queue.set_progress(job_id, progress, message))
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(job_id, str(e) or type(e).__name__)
+    else:
+        queue.finish(job_id, result)
+
+
+def work(path, poll_interval=0.5, max_jobs=None):
+    """
+    Loop of a worker process : take the queued jobs one after the other
+    :param path: path of the SQLite file of the jobs
+    :param poll_interval: seconds between two looks at the table when no job is queued
+    :param max_jobs: stop after this number of jobs, never by default
+    """
+    # les tâches sont enregistrées à l'import du module qui les définit
+    from app import tasks  # noqa: F401
+    queue = JobQueue(path)
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = queue.claim(os.getpid())
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        run_job(queue, job)
+        done += 1
+
+
+class WorkerPool:
+    def __init__(self, path, processes=1):
+        """
+        Local worker processes of a job table, the throughput grows with the number of processes
+        :param path: path of the SQLite file of the jobs
+        :param processes: number of worker processes
+        """
+        self.path = str(path)
+        self.processes = processes
+        self._workers = []
+
+    def start(self):
+        JobQueue(self.path).requeue_orphans()
+        # des interpréteurs neufs : le module principal du serveur web n'est pas réimporté et
+        # une tâche peut elle-même lancer des processus (KMLHandler workers)
+        command = [sys.executable, '-c', 'from app.utils.Jobs import work; work({0!r})'.format(self.path)]
+        for _ in range(self.processes):
+            self._workers.append(subprocess.Popen(command, cwd=ROOT_DIR))
+        return self
+
+    def wait(self):
+        for worker in self._workers:
+            worker.wait()
+
+    def stop(self):
+        for worker in self._workers:
+            worker.terminate()
+        for worker in self._workers:
+            worker.wait()
+        self._workers = []
+
+
+if __name__ == "__main__":
+    nb_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    pool = WorkerPool(DB_PATH, nb_workers).start()
+    try:
+        pool.wait()
+    except KeyboardInterrupt:
+        pool.stop()
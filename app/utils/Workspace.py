@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Workspaces of the sessions : the uploaded files, the generated files and the state of a session are kept on disk
+so any process of the application can serve any request of the session
+"""
+import json
+import os
+import pickle
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+STATE_FILE = 'state.json'
+
+
+class Workspace:
+    def __init__(self, path):
+        """
+        Directory of a session
+        :param path: root directory of the workspace
+        """
+        self.path = Path(path)
+
+    @property
+    def id(self):
+        return self.path.name
+
+    def upload_path(self, app_name):
+        return _create_dir(self.path / 'uploads' / app_name)
+
+    def generated_path(self, app_name):
+        return _create_dir(self.path / 'generated' / app_name)
+
+    def cache_path(self, app_name):
+        return _create_dir(self.path / 'cache' / app_name)
+
+    def touch(self):
+        _create_dir(self.path)
+        (self.path / STATE_FILE).touch()
+
+    def last_used(self):
+        try:
+            return (self.path / STATE_FILE).stat().st_mtime
+        except FileNotFoundError:
+            return 0
+
+    def get_state(self, key, default=None):
+        """
+        :return: the value of the key in the state of the session, serializable in json
+        """
+        return self._read_state().get(key, default)
+
+    def set_state(self, key, value):
+        state = self._read_state()
+        state[key] = value
+        self._write_state(state)
+
+    def _read_state(self):
+        try:
+            with open(self.path / STATE_FILE, encoding='utf-8') as file:
+                return json.loads(file.read() or '{}')
+        except FileNotFoundError:
+            return {}
+
+    def _write_state(self, state):
+        _create_dir(self.path)
+        # écriture atomique : un autre processus ne lit jamais un fichier à moitié écrit
+        tmp = self.path / '{0}.{1}.tmp'.format(STATE_FILE, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(state))
+        os.replace(tmp, self.path / STATE_FILE)
+
+    def object_path(self, name, suffix):
+        return self.path / (name + suffix)
+
+    def purge(self, app_name):
+        """
+        Remove the uploaded, generated and cached files of an application
+        """
+        for directory in (self.path / 'uploads' / app_name, self.path / 'generated' / app_name,
+                          self.path / 'cache' / app_name):
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class WorkspaceStore:
+    def __init__(self, root, ttl=24 * 3600, eviction_interval=600):
+        """
+        Workspaces of all the sessions, under a directory shared by the processes of the application
+        :param root: directory of the workspaces
+        :param ttl: seconds after the last use of a workspace before it is removed
+        :param eviction_interval: minimum seconds between two look for expired workspaces
+        """
+        self.root = Path(root)
+        self.ttl = ttl
+        self.eviction_interval = eviction_interval
+        self._last_eviction = 0
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def is_valid_id(workspace_id):
+        return isinstance(workspace_id, str) and re.fullmatch('[0-9a-f]{32}', workspace_id) is not None
+
+    def get(self, workspace_id):
+        """
+        :param workspace_id: id of the workspace of the session
+        :return: the workspace, marked as used now
+        :rtype: Workspace
+        """
+        if not self.is_valid_id(workspace_id):
+            raise ValueError("Identifiant d'espace de travail invalide")
+        workspace = Workspace(self.root / workspace_id)
+        workspace.touch()
+        return workspace
+
+    def evict(self, now=None):
+        """
+        Remove the workspaces unused for more than ttl seconds, at most once every eviction_interval
+        :return: ids of the removed workspaces
+        """
+        now = time.time() if now is None else now
+        if now - self._last_eviction < self.eviction_interval or not self.root.exists():
+            return []
+        self._last_eviction = now
+        removed = []
+        for path in self.root.iterdir():
+            if path.is_dir() and now - Workspace(path).last_used() > self.ttl:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path.name)
+        return removed
+
+
+def load_object(path):
+    """
+    :param path: path of an object pickled with save_file e.g: a report of ReportCache
+    :return: the object, None if the file does not exist
+    """
+    try:
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def save_file(path, write):
+    """
+    Write a file atomically, the processes reading it never see it half written
+    :param path: path of the file
+    :param write: function writing the content in the binary file handle it receives
+    """
+    path = Path(path)
+    tmp = path.with_name('{0}.{1}.tmp'.format(path.name, os.getpid()))
+    with open(tmp, 'wb') as file:
+        write(file)
+    os.replace(tmp, path)
+
+
+def _create_dir(path):
+    path.mkdir(parents=True, exist_ok=True)
+    return path